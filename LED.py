@@ -2,36 +2,35 @@ import logging
 import time
 
 import cflib.crtp
-from cflib.crazyflie import Crazyflie
-from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
-from cflib.crazyflie.mem import MemoryElement
+from cfdemos.ledring import LedRing, spin, pulse
+from cfdemos.scheduler import Scheduler
+from cfdemos.util import connect
 
 URI = 'usb://0'
 
 # Only output errors from the logging framework
 logging.basicConfig(level=logging.ERROR)
 
-def set_led_color(cf, color):
-
-    # Get LED memory and write to it
-    mem = cf.mem.get_mems(MemoryElement.TYPE_DRIVER_LED)
-    if len(mem) > 0:
-        for i in range(12):
-            mem[0].leds[i].set(r=color[0], g=color[1], b=color[2])
-        mem[0].write_data(None)
-
 if __name__ == '__main__':
     # Initialize the low-level drivers (don't list the debug drivers)
     cflib.crtp.init_drivers(enable_debug_driver=False)
 
-    with SyncCrazyflie(URI, cf=Crazyflie(rw_cache='./cache')) as scf:
+    with connect(URI) as scf:
         cf = scf.cf
 
         # Set virtual mem effect
         cf.param.set_value('ring.effect', '13')
 
-        # Get LED memory and write to it
-        mem = cf.mem.get_mems(MemoryElement.TYPE_DRIVER_LED)
-        set_led_color(cf, color[100,0,0])
-
+        ring = LedRing(cf)
+        ring.set_color([100,0,0])
         time.sleep(2)
+
+        # Pulse blue, with a green LED going around the ring after a second
+        ring.start_timeline()
+        ring.animate(pulse([0,0,100], period=2), duration=6)
+        ring.animate(spin([0,100,0], period=1), start=1, duration=4)
+        for t in Scheduler(rate=50).ticks(6):
+            ring.update()
+
+        ring.set_color([0,0,0])
+        print("Wrote {} frames".format(ring.writes))
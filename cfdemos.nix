@@ -14,7 +14,7 @@ in
   python.pkgs.buildPythonPackage rec {
     pname = "cfdemos";
     version = "0.1";
-    propagatedBuildInputs = [ cflib openvr ];
+    propagatedBuildInputs = [ cflib openvr python.pkgs.numpy ];
     doCheck = false;
     src = nix-gitignore.gitignoreSource [] ./.;
 }
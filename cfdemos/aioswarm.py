@@ -0,0 +1,201 @@
+"""
+This module runs a swarm with asyncio, as an alternative to cflib's
+Swarm.parallel_safe.
+
+parallel_safe starts a thread for every drone on every call and waits for all
+of them, and each thread then sleeps between its own setpoints. With dozens
+of drones that is dozens of threads waking up at slightly different times.
+Here each drone's part of a phase is a coroutine instead, and all of them run
+on one event loop:
+
+  - Setpoints are sent straight from the coroutines. Sending only queues the
+    packet for the radio, so it does not block the loop.
+  - Log data arrives on cflib's threads, and is handed over to the loop with
+    call_soon_threadsafe, so it can be read with async for.
+  - Each phase is awaited as a whole, the same way parallel_safe waits for
+    every thread, so the next phase only starts once every drone is done.
+
+Opening and closing links still uses cflib's own threads, as cflib does not
+offer another way.
+
+Use like the following:
+
+async def main():
+    async with AsyncSwarm(uris, factory) as swarm:
+        report = await preflight(swarm, names)
+        await swarm.run(fly, args_dict=trajectory.args_dict())
+
+asyncio.run(main())
+"""
+import asyncio
+import time
+
+from cfdemos.scheduler import Scheduler
+from cfdemos.util import (PREFLIGHT_VARIABLES, PreflightCheck, log_api,
+                          print_preflight_report, start_console)
+
+
+class AsyncDrone:
+    """
+    One drone of an AsyncSwarm, which is passed to the coroutine of each phase
+
+    :param scf: The SyncCrazyflie of the drone
+    :param loop: The event loop the swarm runs on
+    """
+
+    def __init__(self, scf, loop):
+        self.scf = scf
+        self.cf = scf.cf
+        self.uri = scf.cf.link_uri
+        self.loop = loop
+
+    async def log(self, name, variables, period_in_ms=100):
+        """
+        Logs variables from the drone, use with async for like SyncLogger
+
+        async for timestamp, data in drone.log('Position', ['kalman.stateX']):
+            print(data['kalman.stateX'])
+
+        :param name: The name of the log block
+        :param variables: The names of the variables to log, as floats
+        :param period_in_ms: How often to log
+        """
+        LogConfig, _ = log_api(self.scf)
+        log_config = LogConfig(name=name, period_in_ms=period_in_ms)
+        for variable in variables:
+            log_config.add_variable(variable, 'float')
+
+        entries = asyncio.Queue()
+
+        def received(timestamp, data, logconf):
+            # Called on a cflib thread
+            self.loop.call_soon_threadsafe(entries.put_nowait, (timestamp, data))
+
+        self.cf.log.add_config(log_config)
+        log_config.data_received_cb.add_callback(received)
+        log_config.start()
+        try:
+            while True:
+                yield await entries.get()
+        finally:
+            # In the same order as cflib's SyncLogger, so the drone frees the
+            # block rather than one more being left on it each time
+            log_config.stop()
+            log_config.delete()
+            log_config.data_received_cb.remove_callback(received)
+
+
+class AsyncSwarm:
+    """
+    A swarm of drones driven from one event loop. Use with async with, which
+    opens the links to every drone and closes them afterwards
+
+    :param uris: The uris of the drones
+    :param factory: A factory to construct the SyncCrazyflie of each drone,
+                    like cfdemos.util.CfFactory
+    """
+
+    def __init__(self, uris, factory):
+        self.scfs = {uri: factory.construct(uri) for uri in uris}
+        self.drones = {}
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(None, scf.open_link)
+                               for scf in self.scfs.values()])
+        self.drones = {uri: AsyncDrone(scf, loop) for uri, scf in self.scfs.items()}
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        for scf in self.scfs.values():
+            scf.close_link()
+
+    async def run(self, coroutine, args_dict=None):
+        """
+        Runs a phase: coroutine for every drone at once, returning when all of
+        them are done.
+
+        Like parallel_safe, a drone failing does not stop the others, and the
+        errors are raised together at the end
+
+        :param coroutine: an async function taking an AsyncDrone, and the
+                          drone's arguments from args_dict
+        :param args_dict: a dictionary of uri to a list of extra arguments
+        :return: a dictionary of uri to what the coroutine returned
+        """
+        uris = list(self.drones)
+        results = await asyncio.gather(
+            *[coroutine(self.drones[uri], *(args_dict or {}).get(uri, []))
+              for uri in uris],
+            return_exceptions=True)
+
+        errors = {uri: result for uri, result in zip(uris, results)
+                  if isinstance(result, Exception)}
+        if errors:
+            for uri, error in sorted(errors.items()):
+                print("{}: {!r}".format(uri, error))
+            raise Exception("{} of {} drones failed".format(len(errors), len(uris)))
+        return dict(zip(uris, results))
+
+
+async def preflight_drone(drone, name=None, report=None, min_voltage=3.4,
+                          window=10, period_in_ms=100, threshold=0.001):
+    """
+    The same as cfdemos.util.preflight_drone, as a coroutine
+    """
+    uri = drone.uri
+    if name is None:
+        name = uri
+    start_console(drone.scf, name)
+
+    check = PreflightCheck(uri, name, min_voltage, window, threshold)
+    drone.cf.param.set_value('kalman.resetEstimation', '1')
+    await asyncio.sleep(0.1)
+    drone.cf.param.set_value('kalman.resetEstimation', '0')
+
+    entries = drone.log('Preflight', PREFLIGHT_VARIABLES, period_in_ms)
+    async for timestamp, data in entries:
+        if check.update(data):
+            break
+    await entries.aclose()
+
+    return check.readiness(report)
+
+
+async def preflight(swarm, names=None, **kwargs):
+    """
+    The same as cfdemos.util.preflight, for an AsyncSwarm
+
+    :return: a dictionary of uri to the Readiness of each drone
+    """
+    report = {}
+    start = time.time()
+    await swarm.run(lambda drone, name=None: preflight_drone(drone, name, report, **kwargs),
+                    args_dict=names)
+    print_preflight_report(report, time.time() - start)
+    return report
+
+
+async def get_positions(swarm):
+    """
+    The same as cfdemos.assignment.get_positions, for an AsyncSwarm
+    """
+    async def read(drone):
+        entries = drone.log('Kalman Position', ['kalman.stateX', 'kalman.stateY',
+                                                'kalman.stateZ'], 50)
+        timestamp, data = await entries.__anext__()
+        await entries.aclose()
+        return [data['kalman.stateX'], data['kalman.stateY'], data['kalman.stateZ']]
+
+    return await swarm.run(read)
+
+
+async def fly(drone, setpoints, rate):
+    """
+    The same as cfdemos.trajectory.fly, as a coroutine. Pass this to
+    AsyncSwarm.run with Trajectory.args_dict
+    """
+    scheduler = Scheduler(rate, name=drone.uri)
+    async for t in scheduler.async_ticks(len(setpoints) / rate):
+        x, y, z, yaw = setpoints[int(round(t * rate))]
+        drone.cf.commander.send_position_setpoint(x, y, z, yaw)
@@ -12,14 +12,48 @@ will happen when you press "fly" on the interface
 
 It also requires having matplotlib installed:
 pip3 install --user matplotlib
+
+The drone is flown from this process, SAMPLE_RATE times a second, while the
+plot and the fly button run in a process of their own. Each sample is passed
+to the plot through shared memory (see cfdemos.sharedring), so however long
+the plot takes to draw, the setpoints are sent on time.
+
+Run with --record to record the positions of the trackers, and with --replay
+and that recording to play it back without the trackers or SteamVR, at the
+speed given by --speed (like 10, or max).
+
+The distance is smoothed a sample at a time by the filters given with
+--smoothing (see cfdemos.filters), despike:5,lowpass:1.5 by default. The
+drone is flown between its lowest and highest heights as the smoothed
+distance goes between its 5th and 95th percentiles over the last
+--calibration seconds (see cfdemos.rolling), so it adapts to the breathing
+without a breath far deeper than the rest setting the range for a while.
+
+The drone trails the breath by the delay of the smoothing and the time it
+takes to fly there. With --predict, the rate and phase of the breathing are
+estimated as it goes (see cfdemos.breathrate), and once they have been found
+the drone is flown to where the chest will be that many seconds from now. At
+the end it prints how far the drone trailed the chest, to tune it by. With
+--latency FILE, how long the drone takes to respond to each setpoint is
+measured too, and saved to FILE (see cfdemos.latency).
+
+Without SteamVR, set CFDEMOS_FAKE_VR to make up the trackers (see
+cfdemos.fakevr). To run it on a computer without a display, leave out the
+plot with --no-plot, and use --fly and --duration to fly straight away and
+stop, like
+
+CFDEMOS_FAKE_VR=breathing python -m cfdemos.sim cfdemos/breathing.py --no-plot --fly --duration 60
 """
 
+import argparse
+import itertools
+import multiprocessing
+import queue
 import sys
+from collections import deque
 import time
 import math
 
-import openvr
-
 import cflib.crtp
 from cflib.crazyflie import Crazyflie
 from cflib.crazyflie.log import LogConfig
@@ -32,56 +66,116 @@ import matplotlib.animation as animation
 from matplotlib.widgets import Button
 from matplotlib import style
 from cflib.crazyflie.console import Console
-from cfdemos.util import print_errors, wait_for_position_estimator, reset_estimator, start_console, check_battery
+from cfdemos import openvrutil
+from cfdemos.breathrate import BreathingEstimator, measure_lag
+from cfdemos.filters import add_filter_arguments, parse_filters
+from cfdemos.latency import LatencyMonitor
+from cfdemos.liveplot import FrameRate, fit_limits, redraw
+from cfdemos.replay import Replay, add_replay_arguments
+from cfdemos.rolling import RollingPercentiles
+from cfdemos.scheduler import MAX_RATE, Scheduler, print_stats
+from cfdemos.sharedring import SharedRing
+from cfdemos.telemetry import Block, TelemetryRecorder, read_telemetry
+from cfdemos.util import print_errors, wait_for_position_estimator, reset_estimator, start_console, check_battery, connect, log_api
 
     
 
 # URI to the Crazyflie to connect to
 uri = 'radio://0/80/2M/A0A0A0A0AA'
 
-# Connect to Steam VR
-vr = openvr.init(openvr.VRApplication_Other)
+# How many times a second the trackers are read and the drone is sent a
+# setpoint
+SAMPLE_RATE = 10
+
+# How often the plot is redrawn, in ms
+FRAME_INTERVAL = 33
+
+# The names the positions of the two trackers are recorded under with
+# --record, to RECORDING. See cfdemos.telemetry
+TRACKERS = ['tracker1', 'tracker2']
+TRACKER_BLOCKS = [Block('pose', ['x', 'y', 'z'], None)]
+RECORDING = 'breathing.telemetry'
+
+# How many smoothed distances are shown
+HISTORY = 100
 
-style.use('fivethirtyeight')
+# How many seconds of the smoothed distance it calibrates against, and the
+# percentiles of them that map to the lowest and highest heights
+CALIBRATION = 30
+LOW_PERCENTILE = 5
+HIGH_PERCENTILE = 95
 
-fig = plt.figure()
-ax1 = fig.add_subplot(1,1,1)
+# How the distance is smoothed, see cfdemos.filters
+SMOOTHING = 'despike:5,lowpass:1.5'
 
-# Finds the trackers
+# How often the drone sends its height back while flying, in ms, how many
+# seconds of it and of the distance are kept to measure how far the drone
+# trails the chest, and how long after setting off to start
+HEIGHT_PERIOD_IN_MS = 50
+LAG_HISTORY = 120
+LAG_SETTLE = 5
+
+# How long to take coming down if it is still flying at the end, in seconds
+LANDING_TIME = 2.0
+
+# What is passed to the plot for every sample: the time in seconds, the
+# distance between the trackers, the smoothed distance, the height the drone
+# is flown to, and the smoothed distances that map to the lowest and highest
+# heights
+COLUMNS = ['time', 'distance', 'smoothed', 'height', 'low', 'high']
+
+# SteamVR, the two trackers and the PoseSampler reading them, once found by
+# find_trackers
+vr = None
 tracker1 = None
 tracker2 = None
-poses = vr.getDeviceToAbsoluteTrackingPose(openvr.TrackingUniverseStanding, 0,
-                                           openvr.k_unMaxTrackedDeviceCount)
-for i in range(openvr.k_unMaxTrackedDeviceCount):
-    if poses[i].bPoseIsValid:
-        device_class = vr.getTrackedDeviceClass(i)
-        if device_class == openvr.TrackedDeviceClass_GenericTracker:
-            if tracker1 is not None:
-                if tracker2 is not None:
-                    print('More than two controllers, exiting')
-                    sys.exit(1)
-                tracker2 = i
-                break
-            else:
-                tracker1 = i
-            
-# If the trackers cannot be found, error
-if tracker1 is None or tracker2 is None:
-    print('Cannot find controller or tracker, exiting')
-    sys.exit(1)
-
-
-def get_tracker_pos(tracker):
-    poses = vr.getDeviceToAbsoluteTrackingPose(
-            openvr.TrackingUniverseStanding, 0,
-            openvr.k_unMaxTrackedDeviceCount)
-
-    controller_pose = poses[tracker]
-    pose = controller_pose.mDeviceToAbsoluteTracking
-        
-    pos = [-1*pose[2][3], -1*pose[0][3], pose[1][3]]
-    return pos
-    
+sampler = None
+
+# What records the trackers with --record, or plays them back with --replay
+recorder = None
+# What measures the latency of the setpoints with --latency
+monitor = None
+replay = None
+# The latest position of each tracker played back, by name
+replayed = {}
+
+
+def find_trackers():
+    """ Connects to SteamVR and finds the two trackers, exiting if it cannot """
+    global vr, tracker1, tracker2, sampler
+    vr = openvrutil.init()
+    tracker1, tracker2 = openvrutil.assert_has_two_trackers(vr)
+    sampler = openvrutil.PoseSampler(vr)
+
+
+def replay_trackers(path, speed):
+    """ Plays the positions of the trackers back from a recording into replayed """
+    global replay
+    replay = Replay(read_telemetry(path), speed)
+    for name in TRACKERS:
+        def played(timestamp, data, block, name=name):
+            replayed[name] = [data['x'], data['y'], data['z']]
+        replay.add_callback(name, 'pose', played)
+
+
+def tracker_positions():
+    """
+    The positions of the two trackers for this sample, from SteamVR or played
+    back a sample's worth of the recording at a time. A tracker that has not
+    been seen or played back yet is None, and one that has lost tracking is
+    where it was last seen
+    """
+    if replay is not None:
+        replay.advance(1 / SAMPLE_RATE)
+        return [replayed.get(name) for name in TRACKERS]
+
+    sampler.sample()
+    positions = [sampler.position(tracker1), sampler.position(tracker2)]
+    if recorder is not None and None not in positions:
+        for name, position in zip(TRACKERS, positions):
+            recorder.append(name, 'pose', position)
+    return positions
+
 def squared(x):
   return x * x
     
@@ -89,16 +183,39 @@ def distance(pos1, pos2):
     return math.sqrt(squared(pos1[0] - pos2[0]) + squared(pos1[1] - pos2[1]) + squared(pos1[2] - pos2[2]))
     
 
-xs = []
-time_series_smooth = []
-ys = []
+smoother = parse_filters(SMOOTHING, SAMPLE_RATE)
+estimator = BreathingEstimator(SAMPLE_RATE)
+# How far ahead to predict the breath with --predict, in seconds
+predict_ahead = None
+calibration = RollingPercentiles(CALIBRATION * SAMPLE_RATE)
 flying = False
-base = 0
+# When the drone last set off and last landed, in time.monotonic()
+flying_since = None
+landed_at = None
+# The height the drone was last sent to
+last_height = None
 scf = None
-high = 2
-low = 0
+# (time.monotonic(), value) of the distance and of the drone's height while
+# flying
+chest = deque(maxlen=LAG_HISTORY * SAMPLE_RATE)
+heights = deque(maxlen=LAG_HISTORY * 1000 // HEIGHT_PERIOD_IN_MS)
+
+
+def start_height_log(scf):
+    """ Logs the height of the drone into heights while flying """
+    def received(timestamp, data, logconf):
+        if flying:
+            heights.append((time.monotonic(), data['kalman.stateZ']))
+
+    LogConfig, _ = log_api(scf)
+    log_conf = LogConfig(name='Height', period_in_ms=HEIGHT_PERIOD_IN_MS)
+    log_conf.add_variable('kalman.stateZ', 'float')
+    scf.cf.log.add_config(log_conf)
+    log_conf.data_received_cb.add_callback(received)
+    log_conf.start()
 
-def change_fly(event):
+
+def change_fly():
     """
     What happens when you press the fly button on the matplotlib interface.
 
@@ -106,76 +223,273 @@ def change_fly(event):
     the drone and turns off
     """
    
-    global flying, scf
-    scf = SyncCrazyflie(uri, cf=Crazyflie(rw_cache='./cache'))
-    scf.open_link()
-    reset_estimator(scf)
-    check_battery(scf, "Drone")
-    start_console(scf, "Drone")
+    global flying, flying_since, landed_at, scf
+    if scf is None:
+        scf = connect(uri)
+        scf.open_link()
+        reset_estimator(scf)
+        check_battery(scf, "Drone")
+        start_console(scf, "Drone")
+        start_height_log(scf)
+        if monitor is not None:
+            monitor.start(scf)
     flying = not flying
+    if flying:
+        flying_since = time.monotonic()
+        landed_at = None
+    else:
+        landed_at = time.monotonic()
     if not flying and scf:
         scf.cf.commander.send_position_setpoint(0,
                                                 0,
                                                 0,
                                                 0)
 
-def animate(i):
+def control_step(t):
     """
-    The clock method of matplotlib
+    Reads the trackers, smooths the distance between them and flies the drone
+    to the height it maps to
+
+    :param t: The time of the sample in seconds
+    :return: the row of COLUMNS for the plot, or None until both trackers
+             have been read
     """
-    poses = vr.getDeviceToAbsoluteTrackingPose(
-            openvr.TrackingUniverseStanding, 0,
-            openvr.k_unMaxTrackedDeviceCount)
+    global last_height
+    pos1, pos2 = tracker_positions()
+    if pos1 is None or pos2 is None:
+        return None
+    current = distance(pos1, pos2)
+    average = smoother.update(current)
+    estimator.update(current)
+    if flying:
+        chest.append((time.monotonic(), current))
 
-    pos1 = get_tracker_pos(tracker1)
-    pos2 = get_tracker_pos(tracker2)
-    print(distance(pos1, pos2))
-    
-    if len(time_series_smooth) < 5:
-        time_series_smooth.append(distance(pos1, pos2))
+    # The calibration cannot take a distance that is not a number, and there
+    # would be no height to fly to, so the drone holds its last setpoint
+    if not math.isfinite(average):
+        return None
+    calibration.push(average)
+
+    lowest_point = 0.5
+    highest_point = 1.5
+    low = calibration.percentile(LOW_PERCENTILE)
+    high = calibration.percentile(HIGH_PERCENTILE) + 0.0001
+    target = average
+    if predict_ahead is not None and estimator.ready():
+        target = estimator.predict(predict_ahead)
+    percentage = max(min((target - low ) / (high - low), 1), 0)
+    fly_height = lowest_point + percentage
+    if flying and scf:
+        scf.cf.commander.send_position_setpoint(0,
+                                                0,
+                                                fly_height,
+                                                0)
+        last_height = fly_height
+    return [t, current, average, fly_height, low, high]
+
+
+def land():
+    """
+    Brings the drone down from the last height it was sent to and stops the
+    motors, for when it is still flying at the end rather than leaving it to
+    fall once the setpoints stop
+    """
+    global flying, landed_at
+    flying = False
+    landed_at = time.monotonic()
+    if last_height is not None:
+        for t in Scheduler(SAMPLE_RATE, name='landing').ticks(LANDING_TIME):
+            scf.cf.commander.send_position_setpoint(0, 0, last_height * (1 - t / LANDING_TIME), 0)
+    scf.cf.commander.send_stop_setpoint()
+    # Make sure that the last packet leaves before the link is closed
+    # since the message queue is not flushed before closing
+    time.sleep(0.1)
+
+
+def print_breathing_report():
+    """
+    Prints the breathing found, and how far the drone trailed the chest the
+    last time it flew
+    """
+    estimator.print_report()
+    if flying_since is None:
+        return
+    settled = flying_since + LAG_SETTLE
+    end = landed_at if landed_at is not None else math.inf
+    chest_samples = [sample for sample in chest if settled <= sample[0] <= end]
+    height_samples = [sample for sample in heights if settled <= sample[0] <= end]
+    if len(chest_samples) < 2 or len(height_samples) < 2:
+        return
+    lag = measure_lag(*zip(*chest_samples), *zip(*height_samples))
+    if lag is None:
+        print("Not flown long enough to measure how far the drone trails the chest")
     else:
-        time_series_smooth.pop(0)
-        time_series_smooth.append(distance(pos1, pos2))
-        
-        average = sum(time_series_smooth) / len(time_series_smooth)
-           
-        # 100 divided by 10 is the amount of time it shows on the plotter, and the amount of time it takes to calibrate
-        if len(xs) > 100:
-            xs.pop(0)
-            ys.pop(0)
-        
-        xs.append(i)
-        ys.append(average)
-        ax1.clear()
-        ax1.plot(xs, ys)
-        lowest_point = 0.5
-        highest_point = 1.5
-        low = min(ys)
-        high = max(ys) + 0.0001
-        percentage = max(min((average - low ) / (high - low), 1), 0)
-        fly_height = lowest_point + percentage
-        if flying and scf:
-          
-            scf.cf.commander.send_position_setpoint(0,
-                                                    0,
-                                                    fly_height,
-                                                    0)      
-        ax1.set_ylim((low, high))
+        print("The drone trailed the chest by {:.0f}ms{}".format(
+            lag * 1000, "" if predict_ahead is None
+            else ", predicting {:.0f}ms ahead".format(predict_ahead * 1000)))
+
+
+def control_ticks(speed=1):
+    """
+    Yields the time in seconds, SAMPLE_RATE times a second, forever.
+    Replaying speed times faster, the ticks come speed times as often, or as
+    fast as they can if that is faster than a Scheduler goes (or speed is
+    None)
+    """
+    if speed is not None and SAMPLE_RATE * speed <= MAX_RATE:
+        scheduler = Scheduler(SAMPLE_RATE * speed, name='control')
+        for t in scheduler.ticks():
+            yield t * speed
+    else:
+        for tick in itertools.count():
+            yield tick / SAMPLE_RATE
+
+
+def control(ring, commands, plotter, speed=1, duration=None):
+    """
+    Flies the drone from the trackers until the plot is closed, passing every
+    sample to the plot through ring
+
+    :param ring: The SharedRing of COLUMNS the plot reads
+    :param commands: The Queue the plot puts presses of the fly button on
+    :param plotter: The Process drawing the plot, or None if there is no plot
+    :param speed: How many times faster than recorded a replay goes
+    :param duration: How many seconds to stop after, or None to go on until
+                     the plot is closed or the replay ends
+    """
+    for t in control_ticks(speed):
+        if plotter is not None and not plotter.is_alive():
+            break
+        if duration is not None and t >= duration:
+            break
+        try:
+            while commands is not None:
+                commands.get_nowait()
+                change_fly()
+        except queue.Empty:
+            pass
+        if replay is not None and replay.finished():
+            # Leave the end of the replay on the plot until it is closed
+            if plotter is not None:
+                plotter.join()
+            break
+        row = control_step(t)
+        if row is not None:
+            ring.push(row)
+
+
+def plot(ring, commands):
+    """
+    Draws the smoothed distance from the samples in the ring, in a process of
+    its own. Only the line is drawn each frame (see cfdemos.liveplot)
+
+    :param ring: The SharedRing of COLUMNS
+    :param commands: a Queue to put presses of the fly button on
+    """
+    style.use('fivethirtyeight')
+
+    fig = plt.figure()
+    ax1 = fig.add_subplot(1,1,1)
+    ax1.set_xlim(-HISTORY / SAMPLE_RATE, 0)
+    ax1.set_xlabel('Seconds ago')
+    line, = ax1.plot([], [], animated=True)
+    frame_rate = FrameRate(ax1)
+
+    def animate(i):
+        rows = ring.latest(HISTORY)
+        if len(rows):
+            times = ring.column(rows, 'time')
+            smoothed = ring.column(rows, 'smoothed')
+            line.set_data(times - times[-1], smoothed)
+            # Changing the limits draws the whole plot again, so they are only
+            # changed once the distance has moved well out of them. The
+            # calibration leaves out the deepest and shallowest breaths, which
+            # are still shown
+            limits = fit_limits(ax1.get_ylim(),
+                                min(ring.column(rows, 'low')[-1], smoothed.min()),
+                                max(ring.column(rows, 'high')[-1], smoothed.max()))
+            if limits is not None:
+                ax1.set_ylim(limits)
+                redraw(ax1)
+        return line, frame_rate.tick()
+
+    ani = animation.FuncAnimation(fig, animate, interval=FRAME_INTERVAL, blit=True,
+                                  cache_frame_data=False)
+    axfly = plt.axes([0.7, 0, 0.1, 0.075])
+    bfly = Button(axfly, 'Fly')
+    bfly.on_clicked(lambda event: commands.put('fly'))
+
+    plt.show()
+    frame_rate.print_report()
+    ring.close()
 
     
 print("Starting")
 if __name__ == '__main__':
-    cflib.crtp.init_drivers(enable_debug_driver=False)
+    parser = argparse.ArgumentParser(description='Flies a drone with your breathing')
+    parser.add_argument('--record', action='store_true',
+                        help='record the positions of the trackers to ' + RECORDING)
+    parser.add_argument('--no-plot', action='store_true',
+                        help='do not show the plot, such as on a computer without a display')
+    parser.add_argument('--fly', action='store_true',
+                        help='fly straight away rather than waiting for the fly button')
+    parser.add_argument('--duration', type=float,
+                        help='stop after this many seconds')
+    parser.add_argument('--calibration', type=float, default=CALIBRATION, metavar='SECONDS',
+                        help='how many seconds of breathing to calibrate the heights against')
+    parser.add_argument('--latency', metavar='FILE',
+                        help='measure the latency of the setpoints and save it to FILE')
+    parser.add_argument('--predict', type=float, metavar='SECONDS',
+                        help='fly to where the breath will be this many seconds ahead')
+    add_filter_arguments(parser, SMOOTHING)
+    add_replay_arguments(parser)
+    options = parser.parse_args()
+    try:
+        smoother = parse_filters(options.smoothing, SAMPLE_RATE)
+    except ValueError as e:
+        parser.error(str(e))
+    predict_ahead = options.predict
+    if options.latency:
+        monitor = LatencyMonitor()
+    calibration = RollingPercentiles(max(int(options.calibration * SAMPLE_RATE), 1))
 
     cflib.crtp.init_drivers(enable_debug_driver=False)
 
-    
-        
-    scf = None
-    ani = animation.FuncAnimation(fig, animate, interval=100)
-    axfly = plt.axes([0.7, 0, 0.1, 0.075])
-    bfly = Button(axfly, 'Fly')
-    bfly.on_clicked(change_fly)
-    
-    plt.show()
-    openvr.shutdown()
+    if options.replay:
+        replay_trackers(options.replay, options.speed)
+    else:
+        find_trackers()
+        if options.record:
+            recorder = TelemetryRecorder(RECORDING, TRACKERS, TRACKER_BLOCKS)
+
+    ring = SharedRing(COLUMNS)
+    commands = None
+    plotter = None
+    if not options.no_plot:
+        commands = multiprocessing.Queue()
+        plotter = multiprocessing.Process(target=plot, args=(ring, commands))
+        plotter.start()
+    try:
+        if options.fly:
+            change_fly()
+        control(ring, commands, plotter, options.speed if options.replay else 1,
+                options.duration)
+    finally:
+        if plotter is not None:
+            plotter.join()
+        ring.close()
+        if monitor is not None:
+            monitor.stop()
+        if scf is not None:
+            if flying:
+                land()
+            scf.close_link()
+        if recorder is not None:
+            recorder.close()
+        if vr is not None:
+            openvrutil.shutdown()
+    print_breathing_report()
+    if monitor is not None:
+        monitor.print_report()
+        monitor.save(options.latency)
+    print_stats()
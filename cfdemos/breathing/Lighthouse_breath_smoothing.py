@@ -12,8 +12,14 @@ will happen when you press "fly" on the interface
 
 It also requires having matplotlib installed:
 pip3 install --user matplotlib
+
+The distance is smoothed by the filters given with --smoothing (see
+cfdemos.filters). The heights are calibrated against the 5th and 95th
+percentiles of the last CALIBRATION seconds of it, unless High or Low has
+been pressed to set them by hand
 """
 
+import argparse
 import sys
 import time
 import math
@@ -32,6 +38,8 @@ import matplotlib.animation as animation
 from matplotlib.widgets import Button
 from matplotlib import style
 from cflib.crazyflie.console import Console
+from cfdemos.filters import add_filter_arguments, parse_filters
+from cfdemos.rolling import RollingPercentiles
 from cfdemos.util import print_errors, wait_for_position_estimator, reset_estimator, start_console, check_battery
 
     
@@ -39,6 +47,16 @@ from cfdemos.util import print_errors, wait_for_position_estimator, reset_estima
 # URI to the Crazyflie to connect to
 uri = 'radio://0/80/2M/A0A0A0A0AA'
 
+# How often the trackers are read, in ms, and how the distance is smoothed
+INTERVAL = 100
+SMOOTHING = 'despike:5,lowpass:1.5'
+
+# How many seconds of the smoothed distance it calibrates against, and the
+# percentiles of them that map to the lowest and highest heights
+CALIBRATION = 30
+LOW_PERCENTILE = 5
+HIGH_PERCENTILE = 95
+
 # Connect to Steam VR
 vr = openvr.init(openvr.VRApplication_Other)
 
@@ -90,13 +108,16 @@ def distance(pos1, pos2):
     
 
 xs = []
-time_series_smooth = []
+smoother = parse_filters(SMOOTHING, 1000 / INTERVAL)
+smoothed = None
+calibration = RollingPercentiles(CALIBRATION * 1000 // INTERVAL)
 ys = []
 flying = False
 base = 0
 scf = None
-high = 2
-low = 0
+# The distances pressing High and Low set, None to calibrate them
+high = None
+low = None
 
 def change_fly(event):
     """
@@ -123,6 +144,7 @@ def animate(i):
     """
     The clock method of matplotlib
     """
+    global smoothed
     poses = vr.getDeviceToAbsoluteTrackingPose(
             openvr.TrackingUniverseStanding, 0,
             openvr.k_unMaxTrackedDeviceCount)
@@ -130,46 +152,52 @@ def animate(i):
     pos1 = get_tracker_pos(tracker1)
     pos2 = get_tracker_pos(tracker2)
     print(distance(pos1, pos2))
-    
-    if len(time_series_smooth) < 5:
-        time_series_smooth.append(distance(pos1, pos2))
-    else:
-        time_series_smooth.pop(0)
-        time_series_smooth.append(distance(pos1, pos2))
-        
-        average = sum(time_series_smooth) / len(time_series_smooth)
-            
-        if len(xs) > 20:
-            xs.pop(0)
-            ys.pop(0)
-        
-        xs.append(i)
-        ys.append(average)
-        ax1.clear()
-        ax1.plot(xs, ys)
-        lowest_point = 0.5
-        highest_point = 1.5
-        percentage = max(min((average - low ) / (high - low), 1), 0)
-        fly_height = lowest_point + percentage
-        if flying and scf:
-          
-            scf.cf.commander.send_position_setpoint(0,
-                                                    0,
-                                                    fly_height,
-                                                    0)      
-    ax1.set_ylim((low, high))
+
+    average = smoother.update(distance(pos1, pos2))
+    smoothed = average
+    calibration.push(average)
+    bottom = low if low is not None else calibration.percentile(LOW_PERCENTILE)
+    top = high if high is not None else calibration.percentile(HIGH_PERCENTILE) + 0.0001
+
+    if len(xs) > 20:
+        xs.pop(0)
+        ys.pop(0)
+
+    xs.append(i)
+    ys.append(average)
+    ax1.clear()
+    ax1.plot(xs, ys)
+    lowest_point = 0.5
+    highest_point = 1.5
+    percentage = max(min((average - bottom) / (top - bottom), 1), 0)
+    fly_height = lowest_point + percentage
+    if flying and scf:
+
+        scf.cf.commander.send_position_setpoint(0,
+                                                0,
+                                                fly_height,
+                                                0)
+    ax1.set_ylim((bottom, top))
 
     
 def set_high(event):
     global high
-    high = time_series_smooth[-1]
+    high = smoothed
     
 def set_low(event):
     global low
-    low = time_series_smooth[-1]
+    low = smoothed
     
 print("Starting")
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Flies a drone with your breathing')
+    add_filter_arguments(parser, SMOOTHING)
+    options = parser.parse_args()
+    try:
+        smoother = parse_filters(options.smoothing, 1000 / INTERVAL)
+    except ValueError as e:
+        parser.error(str(e))
+
     cflib.crtp.init_drivers(enable_debug_driver=False)
 
     cflib.crtp.init_drivers(enable_debug_driver=False)
@@ -177,7 +205,7 @@ if __name__ == '__main__':
     
         
     scf = None
-    ani = animation.FuncAnimation(fig, animate, interval=100)
+    ani = animation.FuncAnimation(fig, animate, interval=INTERVAL)
     axfly = plt.axes([0.7, 0, 0.1, 0.075])
     axlow = plt.axes([0.75, 0, 0.1, 0.075])
     axhigh = plt.axes([0.8, 0, 0.1, 0.075])
@@ -0,0 +1,198 @@
+"""
+This module follows the rate and phase of someone's breathing as it happens,
+from a signal like the distance between two VIVE trackers on their chest.
+
+Flying the drone to a height worked out from the smoothed distance means the
+drone is always behind the breath, by the delay of the smoothing and then the
+time the drone takes to get there. Breathing is close to periodic though, so
+once its rate and phase are known, where the chest will be a moment from now
+can be predicted, and the drone sent there instead.
+
+BreathingEstimator keeps the last WINDOW seconds of the signal. The period is
+the lag with the strongest autocorrelation among those a breath could take,
+and the phase and depth come from fitting a sinusoid of that period to the
+last couple of breaths. The fit is of the raw signal, so it is not delayed by
+any smoothing.
+
+measure_lag finds how far one signal trails another by cross-correlating
+them, such as the height of the drone against the distance, to report how
+long the drone takes to follow a breath.
+
+Use like the following:
+
+estimator = BreathingEstimator(rate=10)
+for distance in distances:
+    estimator.update(distance)
+    if estimator.ready():
+        target = estimator.predict(0.3)
+"""
+import math
+
+import numpy as np
+
+# How many seconds of the signal are kept to estimate the rate from, and how
+# many it needs to start
+WINDOW = 30
+MIN_HISTORY = 10
+
+# The slowest and fastest breathing it looks for, in breaths per minute
+MIN_BREATHS_PER_MINUTE = 4
+MAX_BREATHS_PER_MINUTE = 40
+
+# How strongly the signal has to correlate with itself a breath later, from 0
+# to 1, to count as breathing rather than noise
+MIN_CONFIDENCE = 0.3
+
+# A later peak of the autocorrelation is a multiple of the period unless it is
+# stronger than the first by this much
+PEAK_TOLERANCE = 0.9
+
+# How many breaths the phase is fitted over
+FIT_BREATHS = 2
+
+
+class BreathingEstimator:
+    """
+    The rate, phase and depth of breathing, estimated from its latest samples
+
+    The phase is 0 at the largest value of the signal (fully breathed in, for
+    the distance between trackers on the chest) and goes up to 2 pi over a
+    breath.
+
+    :param rate: How many samples a second
+    :param window: How many seconds of samples to estimate the rate from
+    """
+
+    def __init__(self, rate, window=WINDOW):
+        self.rate = rate
+        self.size = int(window * rate)
+        # Each sample is written twice, so the latest window is always one
+        # slice of the buffer
+        self._buffer = np.zeros(2 * self.size)
+        self.count = 0
+        self.frequency = None
+        self.confidence = 0.0
+        self.mean = None
+        self.amplitude = 0.0
+        self.phase = 0.0
+        self._min_lag = rate * 60 / MAX_BREATHS_PER_MINUTE
+        self._max_lag = rate * 60 / MIN_BREATHS_PER_MINUTE
+
+    def samples(self):
+        """ The samples in the window, oldest first """
+        end = self.count % self.size + self.size
+        return self._buffer[end - min(self.count, self.size):end]
+
+    def ready(self):
+        """ Whether it is confident it has found the breathing """
+        return self.frequency is not None and self.confidence >= MIN_CONFIDENCE
+
+    def breaths_per_minute(self):
+        return self.frequency * 60 if self.frequency is not None else None
+
+    def update(self, value):
+        """
+        Takes in a sample, and estimates again
+
+        :return: whether it is ready
+        """
+        i = self.count % self.size
+        self._buffer[i] = self._buffer[i + self.size] = value
+        self.count += 1
+        if self.count < MIN_HISTORY * self.rate:
+            return False
+        samples = self.samples()
+        self._estimate_period(samples)
+        if self.frequency is not None:
+            self._fit_phase(samples)
+        return self.ready()
+
+    def _estimate_period(self, samples):
+        """ The frequency from the strongest autocorrelation a breath apart """
+        x = samples - samples.mean()
+        n = len(x)
+        spectrum = np.fft.rfft(x, 2 * n)
+        correlation = np.fft.irfft(spectrum * np.conj(spectrum))[:n]
+        if correlation[0] <= 0:
+            self.frequency = None
+            return
+        # Divided by how many samples overlap, so longer lags are not
+        # weaker just for having fewer
+        correlation = correlation / correlation[0] * n / (n - np.arange(n))
+        low = max(int(self._min_lag), 1)
+        high = min(int(math.ceil(self._max_lag)), n // 2)
+        if high - low < 2:
+            self.frequency = None
+            return
+        lags = correlation[low:high + 1]
+        peaks = np.flatnonzero((lags[1:-1] > lags[:-2]) & (lags[1:-1] >= lags[2:])) + 1
+        if len(peaks) == 0:
+            self.frequency = None
+            self.confidence = 0.0
+            return
+        strongest = lags[peaks].max()
+        peak = peaks[np.argmax(lags[peaks] >= strongest * PEAK_TOLERANCE)]
+        # Between samples, from the parabola through the peak and its neighbours
+        before, at, after = lags[peak - 1], lags[peak], lags[peak + 1]
+        curvature = before - 2 * at + after
+        offset = 0.5 * (before - after) / curvature if curvature < 0 else 0.0
+        self.frequency = self.rate / (low + peak + offset)
+        self.confidence = float(min(at, 1.0))
+
+    def _fit_phase(self, samples):
+        """ The mean, depth and phase of a sinusoid fitted to the last breaths """
+        length = min(len(samples), int(FIT_BREATHS * self.rate / self.frequency))
+        t = np.arange(1 - length, 1) / self.rate
+        w = 2 * math.pi * self.frequency * t
+        design = np.stack([np.ones(length), np.cos(w), np.sin(w)], axis=1)
+        (mean, c, s), *_ = np.linalg.lstsq(design, samples[-length:], rcond=None)
+        # mean + c cos(wt) + s sin(wt) = mean + amplitude cos(wt + phase)
+        self.mean = float(mean)
+        self.amplitude = math.hypot(c, s)
+        self.phase = math.atan2(-s, c) % (2 * math.pi)
+
+    def predict(self, ahead):
+        """
+        The value of the signal ahead seconds after the latest sample, from
+        the fitted breath
+
+        :param ahead: How far ahead to predict, in seconds
+        """
+        return self.mean + self.amplitude * math.cos(
+            self.phase + 2 * math.pi * self.frequency * ahead)
+
+    def print_report(self):
+        if self.frequency is None:
+            print("Breathing not found")
+            return
+        print("Breathing at {:.1f} breaths a minute, {:.0f}mm deep (confidence {:.2f})"
+              .format(self.breaths_per_minute(), self.amplitude * 2000, self.confidence))
+
+
+def measure_lag(times, values, lagging_times, lagging_values, max_lag=2.0, step=0.01):
+    """
+    How long one signal trails another, from the shift that best correlates
+    them
+
+    :param times, values: The signal that leads, sampled at times in seconds
+    :param lagging_times, lagging_values: The signal that follows it
+    :param max_lag: The most it can trail by, either way, in seconds
+    :param step: The resolution, in seconds
+    :return: the lag in seconds, negative if it leads instead, or None if
+             the signals do not overlap long enough
+    """
+    times = np.asarray(times, dtype=float)
+    lagging_times = np.asarray(lagging_times, dtype=float)
+    start = max(times[0], lagging_times[0]) + max_lag
+    end = min(times[-1], lagging_times[-1]) - max_lag
+    if end - start < 4 * max_lag:
+        return None
+    grid = np.arange(start, end, step)
+    leading = np.interp(grid, times, values)
+    leading = (leading - leading.mean()) / (leading.std() or 1)
+    shifts = np.arange(-max_lag, max_lag + step / 2, step)
+    scores = []
+    for shift in shifts:
+        following = np.interp(grid + shift, lagging_times, lagging_values)
+        scores.append(np.dot(leading, following - following.mean()))
+    return float(shifts[int(np.argmax(scores))])
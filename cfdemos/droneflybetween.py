@@ -4,91 +4,133 @@ This demonstration looks for two VIVE trackers and gets the drone to fly
 a little above halfway between the two.
 
 It uses the low level commander, and requires SteamVR to be running
+
+The trackers are read SAMPLE_RATE times a second, and the drone is sent a
+setpoint only SETPOINT_RATE times a second, so the radio is not flooded. The
+midpoint is filtered, and the drone is sent where it will be once the
+setpoint has reached the drone and the drone has flown there, measured while
+it flies (see cfdemos.follow). Both rates can be given on the command line,
+like
+
+python cfdemos/droneflybetween.py --sample-rate 90 --rate 30
+
+With --latency FILE, how long the drone takes to respond to its setpoints is
+measured and saved to FILE (see cfdemos.latency).
 """
 
-import sys
+import argparse
 import time
 
-import openvr
-
 import cflib.crtp
 from cflib.crazyflie import Crazyflie
 from cflib.crazyflie.log import LogConfig
 from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
 from cflib.crazyflie.syncLogger import SyncLogger
 from cflib.positioning.position_hl_commander import PositionHlCommander
-from cfdemos.util import wait_for_position_estimator, reset_estimator
+from cfdemos import openvrutil
+from cfdemos.follow import FollowFilter, LatencyEstimator
+from cfdemos.latency import LatencyMonitor
+from cfdemos.scheduler import Scheduler, print_stats
+from cfdemos.util import wait_for_position_estimator, reset_estimator, connect, log_api
 
 # URI to the Crazyflie to connect to
 uri = 'radio://0/80/2M/A0A0A0A0AA'
 
+# How many times a second the trackers are read, and the drone is sent a
+# setpoint
+SAMPLE_RATE = 60
+SETPOINT_RATE = 20
+
+# How often the drone sends its position back, to measure the latency with
+POSITION_PERIOD_IN_MS = 50
+
+# How far above the midpoint to fly, in meters
+HEIGHT_ABOVE_CENTER = 0.1
+
+# How long to take coming down at the end, in seconds
+LANDING_TIME = 2.0
+
 
-vr = openvr.init(openvr.VRApplication_Other)
-
-
-# Find the two VIVE trackers
-tracker1 = None
-tracker2 = None
-poses = vr.getDeviceToAbsoluteTrackingPose(openvr.TrackingUniverseStanding, 0,
-                                           openvr.k_unMaxTrackedDeviceCount)
-for i in range(openvr.k_unMaxTrackedDeviceCount):
-    if poses[i].bPoseIsValid:
-        device_class = vr.getTrackedDeviceClass(i)
-        if device_class == openvr.TrackedDeviceClass_GenericTracker:
-            if tracker1 is not None:
-                if tracker2 is not None:
-                    print('More than two controllers, exiting')
-                    sys.exit(1)
-                tracker2 = i
-                break
-            else:
-                tracker1 = i
-            
-
-if tracker1 is None:
-   sys.exit("Could not find any trackers, exiting")
-   
-if tracker2 is None:
-    sys.exit("Could only find one tracker, exiting")
-
-def get_tracker_pos(tracker):
+def start_position_log(scf):
     """
-    Gets the position of a vive tracker and transforms it into the crazyflie's coordinate space
+    Logs the position of the drone
+
+    :return: a list that always holds the latest [x, y, z], or None until the
+             first arrives
     """
-    poses = vr.getDeviceToAbsoluteTrackingPose(
-            openvr.TrackingUniverseStanding, 0,
-            openvr.k_unMaxTrackedDeviceCount)
-
-    controller_pose = poses[tracker]
-    pose = controller_pose.mDeviceToAbsoluteTracking
-        
-    pos = [-1*pose[2][3], -1*pose[0][3], pose[1][3]]
-    return pos
-    
-    
-def run_sequence(scf):
+    position = [None]
+
+    def received(timestamp, data, logconf):
+        position[0] = [data['kalman.stateX'], data['kalman.stateY'], data['kalman.stateZ']]
+
+    LogConfig, _ = log_api(scf)
+    log_conf = LogConfig(name='Position', period_in_ms=POSITION_PERIOD_IN_MS)
+    log_conf.add_variable('kalman.stateX', 'float')
+    log_conf.add_variable('kalman.stateY', 'float')
+    log_conf.add_variable('kalman.stateZ', 'float')
+    scf.cf.log.add_config(log_conf)
+    log_conf.data_received_cb.add_callback(received)
+    log_conf.start()
+    return position
+
+
+def run_sequence(scf, sampler, tracker1, tracker2, sample_rate=SAMPLE_RATE,
+                 setpoint_rate=SETPOINT_RATE, duration=None):
     """
     Flies to the midpoint of the two controller's
+
+    :param sampler: The openvrutil.PoseSampler to read the trackers with
+    :param tracker1, tracker2: The device indices of the trackers
+    :param sample_rate: How many times a second to read the trackers
+    :param setpoint_rate: How many setpoints to send a second, at most
+                          sample_rate
+    :param duration: How many seconds to fly for, or None until Ctrl-C
     """
     cf = scf.cf
-    height_above_center = 0.1
-    while True:
-                
-        poses = vr.getDeviceToAbsoluteTrackingPose(
-            openvr.TrackingUniverseStanding, 0,
-            openvr.k_unMaxTrackedDeviceCount)
-
-        pos1 = get_tracker_pos(tracker1)
-        pos2 = get_tracker_pos(tracker2)
-        
-        x = (pos1[0] + pos2[0]) / 2
-        y = (pos1[1] + pos2[1]) / 2
-        z = (pos1[2] + pos2[2]) / 2 + height_above_center
-        setpoint = [x, y, z]
-        
-        scf.cf.commander.send_position_setpoint(setpoint[0], setpoint[1], setpoint[2], 0)
-        
-    pc.go_to(0.0, 0.0, 0.0)
+    follow_filter = FollowFilter()
+    latency = LatencyEstimator()
+    drone_position = start_position_log(scf)
+    scheduler = Scheduler(sample_rate, name='trackers')
+    next_send = 0.0
+
+    try:
+        for t in scheduler.ticks(duration):
+            # Both trackers from the same fetch of the poses
+            sampler.sample()
+            # Only fresh poses go into the filter. While a tracker is lost it
+            # carries on from the last ones, and nothing is sent until both
+            # have been seen
+            if sampler.valid[tracker1] and sampler.valid[tracker2]:
+                midpoint = (sampler.positions[tracker1] + sampler.positions[tracker2]) / 2
+                follow_filter.update(sampler.time, midpoint)
+            if follow_filter.position is None:
+                continue
+            if drone_position[0] is not None:
+                target = follow_filter.position + [0, 0, HEIGHT_ABOVE_CENTER]
+                latency.update(target, follow_filter.velocity, drone_position[0])
+
+            if t < next_send:
+                continue
+            # Not sent in a burst to catch up after skipped ticks
+            next_send = max(next_send + 1 / setpoint_rate, t)
+            # Predicted from when the sample was read, to when the drone gets there
+            age = time.monotonic() - follow_filter.time
+            ahead = latency.latency()
+            x, y, z = follow_filter.predict(ahead).tolist()
+            cf.commander.send_position_setpoint(x, y, z + HEIGHT_ABOVE_CENTER, 0)
+            latency.sent(ahead, age)
+    except KeyboardInterrupt:
+        pass
+
+    latency.print_report()
+    # Come down where it is before stopping the motors. It never took off if
+    # the trackers were never seen
+    if follow_filter.position is not None:
+        x, y, z = follow_filter.position.tolist()
+        for t in Scheduler(setpoint_rate).ticks(LANDING_TIME):
+            height = (z + HEIGHT_ABOVE_CENTER) * (1 - t / LANDING_TIME)
+            cf.commander.send_position_setpoint(x, y, height, 0)
+    cf.commander.send_stop_setpoint()
 
     # Make sure that the last packet leaves before the link is closed
     # since the message queue is not flushed before closing
@@ -96,10 +138,33 @@ def run_sequence(scf):
 
 print("Starting")
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Flies a drone between two VIVE trackers')
+    parser.add_argument('--sample-rate', type=float, default=SAMPLE_RATE,
+                        help='how many times a second to read the trackers')
+    parser.add_argument('--rate', type=float, default=SETPOINT_RATE,
+                        help='how many setpoints to send a second')
+    parser.add_argument('--duration', type=float, help='stop after this many seconds')
+    parser.add_argument('--latency', metavar='FILE',
+                        help='measure the latency of the setpoints and save it to FILE')
+    options = parser.parse_args()
+
+    vr = openvrutil.init()
+    tracker1, tracker2 = openvrutil.assert_has_two_trackers(vr)
+    sampler = openvrutil.PoseSampler(vr)
+
     cflib.crtp.init_drivers(enable_debug_driver=False)
 
-    with SyncCrazyflie(uri, cf=Crazyflie(rw_cache='./cache')) as scf:
+    with connect(uri) as scf:
         reset_estimator(scf)
-        run_sequence(scf)
-
-    openvr.shutdown()
+        monitor = LatencyMonitor() if options.latency else None
+        if monitor is not None:
+            monitor.start(scf)
+        run_sequence(scf, sampler, tracker1, tracker2, options.sample_rate,
+                     options.rate, options.duration)
+        if monitor is not None:
+            monitor.stop()
+            monitor.print_report()
+            monitor.save(options.latency)
+
+    openvrutil.shutdown()
+    print_stats()
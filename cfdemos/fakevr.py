@@ -0,0 +1,247 @@
+"""
+This module stands in for openvr, so that the demos that read VIVE trackers
+can be run, profiled and tested on a computer without SteamVR or a headset.
+
+It has the same names as the parts of openvr that the demos use (init,
+shutdown, getDeviceToAbsoluteTrackingPose, getTrackedDeviceClass and the
+TrackedDevicePose_t structure, laid out the same way). The trackers it
+reports either play back a recording made with --record in breathing.py (see
+cfdemos.telemetry), looping once it reaches the end, or move like two
+trackers strapped either side of someone's chest as they breathe.
+
+Setting the CFDEMOS_FAKE_VR environment variable makes cfdemos.openvrutil use
+this module instead of openvr. Set it to the path of a recording to play it
+back, or to breathing to make up the motion:
+
+CFDEMOS_FAKE_VR=breathing python cfdemos/breathing.py
+
+Scripts that import openvr themselves can be run through this module, which
+puts it in place of openvr for them:
+
+python -m cfdemos.fakevr --replay breathing.telemetry cfdemos/breathing/Lighthouse_breath_smoothing.py
+
+Poses follow time.monotonic, so run under cfdemos.sim they follow the
+simulation clock too.
+"""
+import ctypes
+import math
+import os
+import runpy
+import sys
+import time
+
+import numpy as np
+
+FAKE_VR_ENV = 'CFDEMOS_FAKE_VR'
+BREATHING = 'breathing'
+
+# The openvr constants that the demos use, with the same values
+k_unMaxTrackedDeviceCount = 64
+VRApplication_Other = 4
+TrackingUniverseStanding = 1
+TrackedDeviceClass_Invalid = 0
+TrackedDeviceClass_HMD = 1
+TrackedDeviceClass_GenericTracker = 3
+TrackingResult_Running_OK = 200
+
+# The headset is device 0, as in SteamVR, and the trackers come after it
+HMD = 0
+FIRST_TRACKER = 1
+
+# The made up breathing: where the middle of the chest is and how far apart
+# the trackers are on it in meters, how fast and deep the breaths are, how
+# far the body sways and how fast, and the jitter of the lighthouse
+CHEST = (0.0, 0.0, 1.2)
+CHEST_WIDTH = 0.25
+BREATHS_PER_MINUTE = 15
+BREATH_DEPTH = 0.03
+SWAY = 0.05
+SWAY_PERIOD = 7.0
+JITTER = 0.0005
+
+
+class HmdMatrix34_t(ctypes.Structure):
+    _fields_ = [('m', (ctypes.c_float * 4) * 3)]
+
+    def __getitem__(self, key):
+        return self.m[key]
+
+
+class HmdVector3_t(ctypes.Structure):
+    _fields_ = [('v', ctypes.c_float * 3)]
+
+
+class TrackedDevicePose_t(ctypes.Structure):
+    _fields_ = [
+        ('mDeviceToAbsoluteTracking', HmdMatrix34_t),
+        ('vVelocity', HmdVector3_t),
+        ('vAngularVelocity', HmdVector3_t),
+        ('eTrackingResult', ctypes.c_int),
+        ('bPoseIsValid', ctypes.c_bool),
+        ('bDeviceIsConnected', ctypes.c_bool),
+    ]
+
+
+def enabled():
+    """ Returns whether openvr should be faked (CFDEMOS_FAKE_VR is set) """
+    return os.environ.get(FAKE_VR_ENV, '') not in ('', '0')
+
+
+class BreathingMotion:
+    """
+    Two trackers either side of a chest that breathes in and out, sways a
+    little, and jitters like the lighthouse does
+
+    :param seed: The seed of the jitter, so that runs can be compared
+    """
+
+    def __init__(self, seed=0):
+        self.count = 2
+        self._random = np.random.default_rng(seed)
+
+    def positions(self, t):
+        """ Where the trackers are t seconds after init, shape (count, 3) """
+        breath = 0.5 - 0.5 * math.cos(2 * math.pi * t * BREATHS_PER_MINUTE / 60)
+        half = (CHEST_WIDTH + BREATH_DEPTH * breath) / 2
+        sway = SWAY * math.sin(2 * math.pi * t / SWAY_PERIOD)
+        centre = np.array([CHEST[0] + sway, CHEST[1], CHEST[2]])
+        positions = np.array([centre - [0, half, 0], centre + [0, half, 0]])
+        return positions + self._random.normal(0, JITTER, positions.shape)
+
+
+class RecordedMotion:
+    """
+    Trackers played back from a recording of their pose block, in the order
+    of the recording's uris, and looped
+
+    :param telemetry: The cfdemos.telemetry.Telemetry to play
+    :param block: The name of the block holding the x, y and z of each tracker
+    """
+
+    def __init__(self, telemetry, block='pose'):
+        self.series = []
+        for uri in telemetry.uris:
+            received, _, values = telemetry.series(uri, block)
+            if len(received):
+                self.series.append((received, [values['x'], values['y'], values['z']]))
+        if not self.series:
+            raise ValueError("The recording has no {} samples".format(block))
+        self.count = len(self.series)
+        self.start = min(received[0] for received, _ in self.series)
+        self.duration = max(received[-1] for received, _ in self.series) - self.start
+
+    def positions(self, t):
+        """ Where the trackers were t seconds into the recording, shape (count, 3) """
+        t = self.start + (t % self.duration if self.duration > 0 else 0)
+        return np.array([[np.interp(t, received, axis) for axis in axes]
+                         for received, axes in self.series])
+
+
+def motion_from_env():
+    """ The motion CFDEMOS_FAKE_VR asks for """
+    source = os.environ.get(FAKE_VR_ENV, BREATHING)
+    if source in ('1', BREATHING):
+        return BreathingMotion()
+    from cfdemos.telemetry import read_telemetry
+    return RecordedMotion(read_telemetry(source))
+
+
+class VRSystem:
+    """
+    The stand-in for openvr's IVRSystem, returned by init
+
+    :param motion: Where the trackers are over time, a BreathingMotion or a
+                   RecordedMotion
+    """
+
+    def __init__(self, motion):
+        self.motion = motion
+        self.started = time.monotonic()
+        self.calls = 0
+        self._poses = (TrackedDevicePose_t * k_unMaxTrackedDeviceCount)()
+        # The headset sits still on the floor in front of the trackers, which
+        # are the only devices with a rotation other than zero
+        for device in [HMD] + list(range(FIRST_TRACKER, FIRST_TRACKER + motion.count)):
+            pose = self._poses[device]
+            for i in range(3):
+                pose.mDeviceToAbsoluteTracking.m[i][i] = 1.0
+            pose.eTrackingResult = TrackingResult_Running_OK
+            pose.bPoseIsValid = True
+            pose.bDeviceIsConnected = True
+
+    def getTrackedDeviceClass(self, device):
+        if device == HMD:
+            return TrackedDeviceClass_HMD
+        if FIRST_TRACKER <= device < FIRST_TRACKER + self.motion.count:
+            return TrackedDeviceClass_GenericTracker
+        return TrackedDeviceClass_Invalid
+
+    def getDeviceToAbsoluteTrackingPose(self, origin, predicted_seconds, count):
+        """
+        The poses of every device, as an array of TrackedDevicePose_t. Like
+        openvr, the same array is filled in again on every call
+        """
+        self.calls += 1
+        t = time.monotonic() - self.started + predicted_seconds
+        for i, (x, y, z) in enumerate(self.motion.positions(t).tolist()):
+            # The reverse of the transform in openvrutil.get_tracker_pos
+            m = self._poses[FIRST_TRACKER + i].mDeviceToAbsoluteTracking.m
+            m[0][3] = -y
+            m[1][3] = z
+            m[2][3] = -x
+        return self._poses
+
+
+# The VRSystem made by init, until shutdown
+system = None
+
+
+def init(application_type, motion=None):
+    """
+    Starts the fake, like openvr.init
+
+    :param motion: Where the trackers are over time, or None for what
+                   CFDEMOS_FAKE_VR asks for
+    """
+    global system
+    system = VRSystem(motion if motion is not None else motion_from_env())
+    return system
+
+
+def shutdown():
+    global system
+    system = None
+
+
+def run(script, args=(), source=BREATHING):
+    """
+    Runs a script with this module in place of openvr
+
+    :param script: path to the script
+    :param args: command line arguments for the script
+    :param source: the path of a recording to play back, or breathing
+    """
+    os.environ[FAKE_VR_ENV] = source
+    real = sys.modules.get('openvr')
+    sys.modules['openvr'] = sys.modules[__name__]
+    sys.argv = [script] + list(args)
+    try:
+        runpy.run_path(script, run_name='__main__')
+    finally:
+        if real is not None:
+            sys.modules['openvr'] = real
+        else:
+            del sys.modules['openvr']
+
+
+if __name__ == '__main__':
+    import argparse
+    # Run through the imported module, so that the script shares it
+    from cfdemos import fakevr
+    parser = argparse.ArgumentParser(description='Runs a script with openvr faked')
+    parser.add_argument('--replay', metavar='FILE', default=BREATHING,
+                        help='play a recording made with --record instead of made up breathing')
+    parser.add_argument('script', help='the script to run')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='arguments for the script')
+    options = parser.parse_args()
+    fakevr.run(options.script, options.args, options.replay)
@@ -0,0 +1,208 @@
+"""
+This module contains filters that smooth a signal one sample at a time, such
+as the distance between two VIVE trackers as someone breathes.
+
+The breathing demos smoothed the distance by keeping the last few samples in a
+list, removing the oldest with pop(0) and summing them all again for every
+sample. Each filter here keeps only the state it needs between samples, and
+takes the same short time for every sample:
+
+  average  the mean of the last n samples, kept as a running sum
+  ema      an exponential moving average, with a time constant in seconds
+  lowpass  a second order Butterworth low-pass filter (a biquad), with a
+           cutoff in Hz, that keeps its state from one sample to the next
+  despike  replaces a sample that is far from the median of the last n
+           samples with that median, leaving the rest as they are, so a
+           tracker that jumps for a moment does not move the drone
+
+A chain of them is given as text, like despike:5,lowpass:1.5, so it can be
+chosen on the command line with add_filter_arguments. Averaging and low-pass
+filtering both delay the signal, and the smoother they make it the more they
+delay it, so it is worth trying a few against a recording (see
+cfdemos.replay).
+
+Use like the following:
+
+smoother = parse_filters('despike:5,lowpass:1.5', rate=10)
+for sample in samples:
+    smoothed = smoother.update(sample)
+"""
+import math
+from collections import deque
+
+# The default parameter of each filter: how many samples to average over, the
+# time constant in seconds, the cutoff in Hz, and how many samples to take the
+# median of
+AVERAGE_SIZE = 5
+EMA_TIME_CONSTANT = 0.2
+LOWPASS_CUTOFF = 1.0
+DESPIKE_SIZE = 5
+
+# How far a sample can be from the median before despike replaces it
+DESPIKE_THRESHOLD = 0.01
+
+# The Q of a Butterworth filter, which is as flat as it can be below the cutoff
+BUTTERWORTH_Q = 1 / math.sqrt(2)
+
+
+class MovingAverage:
+    """
+    The mean of the last size samples
+
+    :param size: How many samples to average over
+    """
+
+    def __init__(self, size=AVERAGE_SIZE):
+        if size < 1:
+            raise ValueError("The average must be over at least 1 sample")
+        self._values = deque(maxlen=size)
+        self._sum = 0.0
+
+    def update(self, value):
+        if len(self._values) == self._values.maxlen:
+            self._sum -= self._values[0]
+        self._values.append(value)
+        self._sum += value
+        return self._sum / len(self._values)
+
+
+class ExponentialAverage:
+    """
+    An exponential moving average
+
+    :param time_constant: How long it takes to move most (63%) of the way to
+                          a new value, in seconds
+    :param rate: How many samples a second
+    """
+
+    def __init__(self, time_constant=EMA_TIME_CONSTANT, rate=10):
+        if time_constant <= 0:
+            raise ValueError("The time constant must be above 0")
+        self.alpha = 1 - math.exp(-1 / (rate * time_constant))
+        self.value = None
+
+    def update(self, value):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+class LowPass:
+    """
+    A second order low-pass filter, in transposed direct form II
+
+    :param cutoff: The frequency to cut off above, in Hz
+    :param rate: How many samples a second
+    :param q: The Q of the filter, Butterworth by default
+    """
+
+    def __init__(self, cutoff=LOWPASS_CUTOFF, rate=10, q=BUTTERWORTH_Q):
+        if not 0 < cutoff < rate / 2:
+            raise ValueError("The cutoff must be between 0 and half the rate ({}Hz)"
+                             .format(rate / 2))
+        w0 = 2 * math.pi * cutoff / rate
+        alpha = math.sin(w0) / (2 * q)
+        a0 = 1 + alpha
+        self.b0 = (1 - math.cos(w0)) / 2 / a0
+        self.b1 = (1 - math.cos(w0)) / a0
+        self.b2 = self.b0
+        self.a1 = -2 * math.cos(w0) / a0
+        self.a2 = (1 - alpha) / a0
+        self._z1 = None
+        self._z2 = None
+
+    def update(self, value):
+        if self._z1 is None:
+            # Start as if it had always been at the first value, rather than
+            # rising from 0
+            self._z2 = (self.b2 - self.a2) * value
+            self._z1 = (self.b1 - self.a1) * value + self._z2
+        filtered = self.b0 * value + self._z1
+        self._z1 = self.b1 * value - self.a1 * filtered + self._z2
+        self._z2 = self.b2 * value - self.a2 * filtered
+        return filtered
+
+
+class Despike:
+    """
+    Replaces samples far from the median of the last few with the median
+
+    :param size: How many samples to take the median of
+    :param threshold: How far a sample can be from the median
+    """
+
+    def __init__(self, size=DESPIKE_SIZE, threshold=DESPIKE_THRESHOLD):
+        if size < 1:
+            raise ValueError("The median must be of at least 1 sample")
+        self.threshold = threshold
+        self._values = deque(maxlen=size)
+        self.spikes = 0
+
+    def update(self, value):
+        self._values.append(value)
+        ordered = sorted(self._values)
+        median = ordered[len(ordered) // 2]
+        if abs(value - median) > self.threshold:
+            self.spikes += 1
+            return median
+        return value
+
+
+class FilterChain:
+    """
+    Filters one after the other
+
+    :param filters: The filters, the first is given the samples
+    """
+
+    def __init__(self, filters):
+        self.filters = list(filters)
+
+    def update(self, value):
+        for f in self.filters:
+            value = f.update(value)
+        return value
+
+
+# The filters by the name they are given in a chain, and the function of
+# their parameters (as text) and the rate that makes them
+FILTERS = {
+    'average': lambda rate, size=AVERAGE_SIZE: MovingAverage(int(size)),
+    'ema': lambda rate, time_constant=EMA_TIME_CONSTANT: ExponentialAverage(
+        float(time_constant), rate),
+    'lowpass': lambda rate, cutoff=LOWPASS_CUTOFF: LowPass(float(cutoff), rate),
+    'despike': lambda rate, size=DESPIKE_SIZE, threshold=DESPIKE_THRESHOLD: Despike(
+        int(size), float(threshold)),
+}
+
+
+def parse_filters(text, rate):
+    """
+    Makes a chain of filters from text, like despike:5:0.01,lowpass:1.5.
+    Each filter is its name followed by its parameters, separated by
+    colons, and any left out take their defaults. none is no filtering
+
+    :param text: The filters, separated by commas
+    :param rate: How many samples a second the chain is given
+    :return: a FilterChain
+    """
+    filters = []
+    for part in text.split(','):
+        name, *parameters = part.strip().split(':')
+        if name == 'none':
+            continue
+        if name not in FILTERS:
+            raise ValueError("Unknown filter {}, use one of {}".format(
+                name, ", ".join(sorted(FILTERS))))
+        filters.append(FILTERS[name](rate, *parameters))
+    return FilterChain(filters)
+
+
+def add_filter_arguments(parser, default):
+    """ Adds --smoothing to a demo's argparse parser """
+    parser.add_argument('--smoothing', default=default, metavar='FILTERS',
+                        help='how to smooth the signal, like despike:5,lowpass:1.5 '
+                             '(filters: {}, or none). Default {}'.format(
+                                 ", ".join(sorted(FILTERS)), default))
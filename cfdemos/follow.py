@@ -0,0 +1,173 @@
+"""
+This module helps a drone follow something that moves, like the midpoint of
+two VIVE trackers held in someone's hands.
+
+Sending the target as the setpoint as soon as it is read floods the radio and
+the drone still trails behind, as it takes time for the setpoint to reach it
+and for it to fly there. Instead:
+
+  - The target is read at a fixed rate, and filtered with a constant velocity
+    Kalman filter (FollowFilter), which takes out the jitter of the trackers
+    and estimates how fast the target is moving.
+  - The setpoint is where the target will be after the latency, predicted
+    from that velocity.
+  - The latency is measured while flying (LatencyEstimator): while the target
+    moves, how far behind it the drone is, along the way it is moving, over
+    how fast it is moving, is how long the drone takes to get to where the
+    target was. Added to how old the sample is when it is sent, that is the
+    end-to-end latency.
+
+Use like the following:
+
+follow_filter = FollowFilter()
+latency = LatencyEstimator()
+for t in scheduler.ticks():
+    follow_filter.update(t, target)
+    latency.update(follow_filter.position, follow_filter.velocity, drone_position)
+    setpoint = follow_filter.predict(latency.latency())
+"""
+import numpy as np
+
+# How much the target is expected to accelerate, in m/s^2, and how much the
+# trackers jitter, in m. More acceleration follows quick moves more closely,
+# more jitter smooths more
+ACCELERATION_NOISE = 2.0
+MEASUREMENT_NOISE = 0.005
+
+# The latency to assume before any has been measured, and the most to predict
+# ahead by, in seconds
+DEFAULT_LATENCY = 0.1
+MAX_LATENCY = 0.5
+
+# How slowly the target can move for the latency to still be measured, in m/s.
+# Any slower and the distance to the drone is mostly noise
+MIN_SPEED = 0.03
+
+# How much of each new measurement of the latency is taken in
+LATENCY_SMOOTHING = 0.02
+
+
+class FollowFilter:
+    """
+    A constant velocity Kalman filter of a position, each axis on its own
+
+    :param acceleration_noise: How much the target is expected to accelerate,
+                               in m/s^2
+    :param measurement_noise: The standard deviation of the measured position
+    """
+
+    def __init__(self, acceleration_noise=ACCELERATION_NOISE,
+                 measurement_noise=MEASUREMENT_NOISE):
+        self.acceleration_noise = acceleration_noise
+        self.measurement_variance = measurement_noise ** 2
+        # The position and velocity of each axis, and their covariance as
+        # [[pp, pv], [pv, vv]] for each axis
+        self.position = None
+        self.velocity = np.zeros(3)
+        self._pp = np.zeros(3)
+        self._pv = np.zeros(3)
+        self._vv = np.zeros(3)
+        self.time = None
+
+    def update(self, t, measured):
+        """
+        Takes in a measured position
+
+        :param t: The time it was measured, in seconds
+        :param measured: The position, [x, y, z]
+        :return: the filtered position
+        """
+        measured = np.asarray(measured, dtype=float)
+        if self.position is None:
+            self.position = measured.copy()
+            self._pp[:] = self.measurement_variance
+            self._vv[:] = 1.0
+            self.time = t
+            return self.position
+        dt = t - self.time
+        self.time = t
+
+        # Predict, with white noise acceleration between samples
+        q = self.acceleration_noise ** 2
+        self.position += self.velocity * dt
+        self._pp += dt * (2 * self._pv + dt * self._vv) + q * dt ** 4 / 4
+        self._pv += dt * self._vv + q * dt ** 3 / 2
+        self._vv += q * dt ** 2
+
+        # Correct
+        innovation = measured - self.position
+        s = self._pp + self.measurement_variance
+        position_gain = self._pp / s
+        velocity_gain = self._pv / s
+        self.position += position_gain * innovation
+        self.velocity += velocity_gain * innovation
+        self._vv -= velocity_gain * self._pv
+        self._pv -= velocity_gain * self._pp
+        self._pp -= position_gain * self._pp
+        return self.position
+
+    def predict(self, ahead):
+        """ Where the target will be ahead seconds after the last update """
+        return self.position + self.velocity * ahead
+
+
+class LatencyEstimator:
+    """
+    Measures how long it takes the drone to get to where the target is
+
+    :param default: The latency until it has been measured, in seconds
+    :param max_latency: The most it can be, in seconds
+    :param min_speed: How slowly the target can move for it to be measured
+    :param smoothing: How much of each new measurement is taken in
+    """
+
+    def __init__(self, default=DEFAULT_LATENCY, max_latency=MAX_LATENCY,
+                 min_speed=MIN_SPEED, smoothing=LATENCY_SMOOTHING):
+        self.max_latency = max_latency
+        self.min_speed = min_speed
+        self.smoothing = smoothing
+        # How long the drone takes to reach a setpoint, and how old samples
+        # are when they are sent
+        self.lag = default
+        self.age = 0.0
+        # The prediction the drone was last sent, which it is flying towards
+        # rather than the target itself
+        self.ahead = 0.0
+        self.measurements = 0
+
+    def latency(self):
+        """ How far ahead to predict, in seconds """
+        return min(self.lag + self.age, self.max_latency)
+
+    def sent(self, ahead, age):
+        """
+        Notes a setpoint that has been sent
+
+        :param ahead: How far ahead it was predicted, in seconds
+        :param age: How long after its sample it was sent, in seconds
+        """
+        self.ahead = ahead
+        self.age += self.smoothing * (age - self.age)
+
+    def update(self, target, velocity, position):
+        """
+        Measures the latency from where the drone is
+
+        :param target: Where the target is now
+        :param velocity: How fast the target is moving, [vx, vy, vz]
+        :param position: Where the drone is now
+        """
+        speed_squared = float(np.dot(velocity, velocity))
+        if speed_squared < self.min_speed ** 2:
+            return
+        behind = float(np.dot(np.subtract(target, position), velocity)) / speed_squared
+        # The drone is behind where it was sent by however far ahead that was
+        lag = min(max(behind + self.ahead, 0.0), self.max_latency)
+        self.lag += self.smoothing * (lag - self.lag)
+        self.measurements += 1
+
+    def print_report(self):
+        print("Latency {:.0f}ms: the drone takes {:.0f}ms to follow and samples "
+              "are {:.0f}ms old when sent, from {} measurements".format(
+                  self.latency() * 1000, self.lag * 1000, self.age * 1000,
+                  self.measurements))
@@ -6,17 +6,19 @@ This example demonstrates a drones precise ability to represent the beating of
 a heart while flying. The drone moving back and forward represents the lub-dub
 of heartbeat
 """
+import sys
 import time
 
 import cflib.crtp
 from cflib.crazyflie.log import LogConfig
 from cflib.crazyflie.console import Console
-from cflib.crazyflie.swarm import CachedCfFactory
 from cflib.crazyflie.swarm import Swarm
 import math
 import random
 # Util class, contains important functions that can be copied to other projects
-from cfdemos.util import wait_for_position_estimator, reset_estimator, print_errors, start_console, check_battery
+from cfdemos.radios import plan_radios
+from cfdemos.scheduler import Scheduler, print_stats
+from cfdemos.util import wait_for_position_estimator, reset_estimator, print_errors, start_console, check_battery, CfFactory, preflight
 
 @print_errors
 def run_shared_sequence(scf):
@@ -29,24 +31,27 @@ def run_shared_sequence(scf):
 
     height = 1
     heartbeat_size = 0.05
+    scheduler = Scheduler(SETPOINT_RATE, name=cf.link_uri)
     
     # This takes off the drone to (height)m above the ground
-    # The command is send 20 times every 0.2 seconds. This
+    # The command is repeated for 4 seconds. This
     # repeating of the same command is becau
-    for i in range(20):
+    for t in scheduler.ticks(4):
         cf.commander.send_position_setpoint(0,
                                             0,
                                             height,
                                             0)
-        time.sleep(0.2)
 
-    for i in range(100):
-        if i % 5 == 0:
+    # Each beat lasts a second, 0.2 seconds back (lub), 0.2 seconds forward
+    # (dub) then 0.6 seconds resting
+    for t in scheduler.ticks(20):
+        beat = t % 1
+        if beat < 0.2:
             cf.commander.send_position_setpoint(- heartbeat_size, 
                                                 0,
                                                 height,
                                                 0)
-        elif i % 5 == 1:
+        elif beat < 0.4:
             cf.commander.send_position_setpoint(heartbeat_size, 
                                                 0,
                                                 height,
@@ -57,16 +62,16 @@ def run_shared_sequence(scf):
                                                 height,
                                                 0)
 
-        time.sleep(0.2)
-
-    for i in range(20):
+    for t in scheduler.ticks(4):
         cf.commander.send_position_setpoint(0,
                                             0,
                                             0.1,
                                             0)
-        time.sleep(0.2)
 
 
+# How many setpoints are sent to each drone per second
+SETPOINT_RATE = 20
+
 URI1 = 'radio://0/80/2M/A0A0A0A0AA'
 URI2 = 'radio://0/80/2M/A0A0A0A0AB'
 URI3 = 'radio://0/80/2M/A0A0A0A0AC'
@@ -86,11 +91,24 @@ names = {
   URI4: ["Doug"]
 }
 
+# The Crazyradio dongles and channels to spread the drones over. Add a dongle
+# and a channel for every few drones, see cfdemos.radios
+DONGLES = [0]
+CHANNELS = [80]
+
 if __name__ == '__main__':
+    radio_plan = plan_radios(uris, DONGLES, CHANNELS, setpoint_rate=SETPOINT_RATE)
+    radio_plan.print_report()
+    uris = radio_plan.rewrite(uris)
+    names = radio_plan.rewrite(names)
+
     cflib.crtp.init_drivers(enable_debug_driver=False)
-    factory = CachedCfFactory(rw_cache='./cache')
+    factory = CfFactory(rw_cache='./cache')
     with Swarm(uris, factory=factory) as swarm:
-        swarm.parallel_safe(start_console, args_dict=names)
-        swarm.parallel_safe(check_battery, args_dict=names)
-        swarm.parallel_safe(reset_estimator)
+        # Run with --compare-preflight to also time the checks done one after
+        # the other, and print how much preflight saves
+        report = preflight(swarm, names, compare='--compare-preflight' in sys.argv)
+        if not all(readiness.ready for readiness in report.values()):
+            sys.exit("Not all drones are ready to fly")
         swarm.parallel_safe(run_shared_sequence)
+        print_stats()
@@ -0,0 +1,217 @@
+"""
+This module measures how long each drone takes to respond to the setpoints it
+is sent, which is what the demos that follow VIVE trackers have to make up
+for.
+
+LatencyMonitor.start puts a timestamp on every position setpoint sent to a
+drone with send_position_setpoint, and logs the drone's kalman state. Each
+setpoint that moves the drone on from the one before is matched with the
+first state in which the drone has got REACTION (half) of the way there, the
+delay time of control theory. Half way, rather than all the way there, as
+while a setpoint is being streamed the drone never quite catches up to any one
+of them. How long that took is its latency.
+
+The times are taken on this computer, so a latency includes the setpoint
+going out over the radio, the drone flying, and the state coming back in a
+log packet (up to STATE_PERIOD_IN_MS late). Setpoints that are never reached
+within TIMEOUT, like ones the next setpoint turns back from, are counted as
+unmatched.
+
+The latencies of each drone are summarised as percentiles and a histogram,
+and saved to a JSON file with save.
+
+Use like the following:
+
+monitor = LatencyMonitor()
+swarm.parallel_safe(monitor.start)
+swarm.parallel_safe(fly, args_dict=trajectory.args_dict())
+monitor.print_report()
+monitor.save('flight.latency.json')
+"""
+import json
+import math
+import threading
+import time
+
+import numpy as np
+
+from cfdemos.util import log_api
+
+# How often the state is logged to match setpoints against, in ms
+STATE_PERIOD_IN_MS = 10
+
+# How far towards a setpoint, from the one before, the drone has to get for
+# it to count as having responded
+REACTION = 0.5
+
+# How far a setpoint has to move on from the one before to be measured, in
+# meters. Any less and the noise of the state is enough to reach it
+MIN_STEP = 0.005
+
+# How long a setpoint can take to be reached before it is given up on, in
+# seconds, and the most waiting to be reached at once
+TIMEOUT = 2.0
+MAX_PENDING = 200
+
+# The percentiles reported, and the width of each bar of the histogram in ms
+PERCENTILES = [50, 90, 95, 99]
+HISTOGRAM_BIN_MS = 10
+
+
+class DroneLatency:
+    """
+    The setpoints of one drone waiting to be reached, and the latencies of
+    those that have been
+
+    :param uri: The uri of the drone
+    :param reaction: How far towards a setpoint the drone has to get
+    """
+
+    def __init__(self, uri, reaction=REACTION):
+        self.uri = uri
+        self.reaction = reaction
+        self.sent = 0
+        self.unmatched = 0
+        self.latencies = []
+        self.state = None
+        self._previous = None
+        # (time sent, the point REACTION of the way there, the direction)
+        self._pending = []
+
+    def setpoint(self, t, position):
+        """ Notes a setpoint sent at time t """
+        self.sent += 1
+        position = np.asarray(position, dtype=float)
+        previous, self._previous = self._previous, position
+        if previous is None or self.state is None:
+            return
+        step = position - previous
+        if np.dot(step, step) < MIN_STEP ** 2:
+            return
+        point = previous + self.reaction * step
+        # Already past it, such as when the setpoints turn back
+        if np.dot(self.state - point, step) >= 0:
+            return
+        if len(self._pending) >= MAX_PENDING:
+            self._pending.pop(0)
+            self.unmatched += 1
+        self._pending.append((t, point, step))
+
+    def update(self, t, state):
+        """ Matches a state received at time t with the setpoints it reaches """
+        self.state = np.asarray(state, dtype=float)
+        waiting = []
+        for sent, point, step in self._pending:
+            if np.dot(self.state - point, step) >= 0:
+                self.latencies.append(t - sent)
+            elif t - sent > TIMEOUT:
+                self.unmatched += 1
+            else:
+                waiting.append((sent, point, step))
+        self._pending = waiting
+
+    def summary(self):
+        """ The percentiles and histogram of the latencies, in ms, as a dictionary """
+        latencies = np.array(self.latencies) * 1000
+        summary = {
+            'setpoints': self.sent,
+            'measured': len(latencies),
+            'unmatched': self.unmatched,
+        }
+        if len(latencies) == 0:
+            return summary
+        bins = max(int(math.ceil(latencies.max() / HISTOGRAM_BIN_MS)), 1)
+        counts, _ = np.histogram(latencies, bins=bins, range=(0, bins * HISTOGRAM_BIN_MS))
+        summary.update({
+            'mean_ms': float(latencies.mean()),
+            'percentiles_ms': {str(p): float(np.percentile(latencies, p)) for p in PERCENTILES},
+            'histogram': {'bin_ms': HISTOGRAM_BIN_MS, 'counts': counts.tolist()},
+            'latencies_ms': latencies.round(1).tolist(),
+        })
+        return summary
+
+
+class LatencyMonitor:
+    """
+    Measures the latency of the position setpoints sent to each drone
+
+    :param reaction: How far towards a setpoint the drone has to get, from 0
+                     to 1
+    """
+
+    def __init__(self, reaction=REACTION):
+        self.reaction = reaction
+        self.drones = {}
+        self._lock = threading.Lock()
+        self._log_configs = []
+        self._commanders = []
+
+    def start(self, scf):
+        """
+        Starts measuring a drone. Use with swarm.parallel_safe(monitor.start)
+
+        :param scf: The SyncCrazyflie of the drone
+        """
+        uri = scf.cf.link_uri
+        drone = DroneLatency(uri, self.reaction)
+        with self._lock:
+            self.drones[uri] = drone
+
+        commander = scf.cf.commander
+        send = commander.send_position_setpoint
+
+        def send_position_setpoint(x, y, z, yaw):
+            sent = time.monotonic()
+            send(x, y, z, yaw)
+            with self._lock:
+                drone.setpoint(sent, (x, y, z))
+        commander.send_position_setpoint = send_position_setpoint
+
+        def received(timestamp, data, logconf):
+            now = time.monotonic()
+            with self._lock:
+                drone.update(now, (data['kalman.stateX'], data['kalman.stateY'],
+                                   data['kalman.stateZ']))
+
+        LogConfig, _ = log_api(scf)
+        log_config = LogConfig(name='Latency', period_in_ms=STATE_PERIOD_IN_MS)
+        for variable in ['kalman.stateX', 'kalman.stateY', 'kalman.stateZ']:
+            log_config.add_variable(variable, 'float')
+        scf.cf.log.add_config(log_config)
+        log_config.data_received_cb.add_callback(received)
+        log_config.start()
+        with self._lock:
+            self._log_configs.append(log_config)
+            self._commanders.append(commander)
+
+    def stop(self):
+        """ Stops logging, and sends setpoints without timing them again """
+        with self._lock:
+            log_configs, self._log_configs = self._log_configs, []
+            commanders, self._commanders = self._commanders, []
+        for log_config in log_configs:
+            log_config.stop()
+        for commander in commanders:
+            del commander.send_position_setpoint
+
+    def summary(self):
+        """ The summary of every drone, by uri """
+        with self._lock:
+            return {uri: drone.summary() for uri, drone in sorted(self.drones.items())}
+
+    def save(self, path):
+        """ Writes the summaries of every drone to a JSON file """
+        with open(path, 'w') as file:
+            json.dump({'reaction': self.reaction, 'drones': self.summary()}, file, indent=1)
+
+    def print_report(self):
+        """ Prints the percentiles of each drone's latency """
+        for uri, summary in self.summary().items():
+            if not summary['measured']:
+                print("{}: no setpoints measured of {}".format(uri, summary['setpoints']))
+                continue
+            percentiles = ", ".join("p{} {:.0f}ms".format(p, ms)
+                                    for p, ms in summary['percentiles_ms'].items())
+            print("{}: latency {} ({} of {} setpoints, {} unmatched)".format(
+                uri, percentiles, summary['measured'], summary['setpoints'],
+                summary['unmatched']))
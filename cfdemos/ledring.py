@@ -0,0 +1,212 @@
+"""
+This module controls the LED ring deck.
+
+The demos used to set the colour of the ring like
+
+mem = cf.mem.get_mems(MemoryElement.TYPE_DRIVER_LED)
+for i in range(12):
+    mem[0].leds[i].set(r=color[0], g=color[1], b=color[2])
+mem[0].write_data(None)
+
+which looks the memory up and sends all 12 LEDs over the radio every time,
+even if they are already that colour. LedRing looks the memory up once, keeps
+the last frame it wrote, and only writes when the frame has changed. Writes
+are limited to max_write_rate per second so that the LEDs do not crowd out
+setpoints on the radio. Setting a colour waits for the limit if it has to, so
+it is always written, while a change made by an animation that comes too soon
+is written by the next update after the limit allows it.
+
+Animations can be added to any of the LEDs, starting at a time on the flight's
+timeline (seconds since the ring was made, or since start_timeline). Call
+update regularly, such as on every tick of a Scheduler, to play them.
+
+Use like the following:
+
+ring = LedRing(scf.cf)
+ring.set_color([0, 100, 0])
+ring.animate(spin([100, 0, 0], period=1), start=2, duration=4)
+for t in scheduler.ticks(10):
+    ring.update()
+"""
+import math
+import time
+
+from cflib.crazyflie.mem import MemoryElement
+
+NUMBER_OF_LEDS = 12
+
+# The most frames to write to the LED ring per second
+MAX_WRITE_RATE = 10
+
+OFF = (0, 0, 0)
+
+
+class Animation:
+    """
+    An animation of some of the LEDs
+
+    :param function: a function of (time since the animation started, led)
+                     giving the [r, g, b] colour of that LED, or None to leave
+                     it as it is
+    :param start: When the animation starts on the timeline, in seconds
+    :param duration: How long the animation lasts, forever if None
+    :param leds: Which LEDs it animates, all of them if None
+    """
+
+    def __init__(self, function, start, duration=None, leds=None):
+        self.function = function
+        self.start = start
+        self.duration = duration
+        self.leds = range(NUMBER_OF_LEDS) if leds is None else leds
+
+    def active(self, t):
+        return t >= self.start and (self.duration is None or t < self.start + self.duration)
+
+    def finished(self, t):
+        return self.duration is not None and t >= self.start + self.duration
+
+
+class LedRing:
+    """
+    The LED ring of a drone
+
+    If the drone has no LED ring, nothing is written.
+
+    :param cf: The scf.cf from the SyncCrazyflie
+    :param max_write_rate: The most frames to write per second
+    """
+
+    def __init__(self, cf, max_write_rate=MAX_WRITE_RATE):
+        mems = cf.mem.get_mems(MemoryElement.TYPE_DRIVER_LED)
+        self.memory = mems[0] if mems else None
+        self.min_interval = 1 / max_write_rate
+        self.colors = [OFF] * NUMBER_OF_LEDS
+        self.animations = []
+        self.writes = 0
+        self._written = None
+        self._last_write = None
+        self._timeline_start = time.monotonic()
+
+    def start_timeline(self):
+        """ Starts the timeline animations are scheduled against from now """
+        self._timeline_start = time.monotonic()
+
+    def timeline(self):
+        """ The time in seconds on the timeline """
+        return time.monotonic() - self._timeline_start
+
+    def set_led(self, led, color, write=True):
+        """
+        Sets the colour of one LED
+
+        :param led: The index of the LED, from 0 to 11
+        :param color: a list of size 3 indicating the color wanted in RGB
+        :param write: Whether to write it now, or wait for the next update
+        """
+        self.colors[led] = tuple(color)
+        if write:
+            self.update(wait=True)
+
+    def set_color(self, color, write=True):
+        """
+        Sets the colour of every LED
+
+        :param color: a list of size 3 indicating the color wanted in RGB
+        :param write: Whether to write it now, or wait for the next update
+        """
+        self.colors = [tuple(color)] * NUMBER_OF_LEDS
+        if write:
+            self.update(wait=True)
+
+    def animate(self, function, start=None, duration=None, leds=None):
+        """
+        Plays an animation over the colours that have been set
+
+        :param function: see Animation
+        :param start: When to start on the timeline, now if None
+        :param duration: How long to play it for in seconds, forever if None
+        :param leds: Which LEDs to animate, all of them if None
+        :return: the Animation, which can be passed to stop
+        """
+        animation = Animation(function, self.timeline() if start is None else start,
+                              duration, leds)
+        self.animations.append(animation)
+        return animation
+
+    def stop(self, animation=None):
+        """ Stops an animation, or all of them if None """
+        if animation is None:
+            self.animations = []
+        elif animation in self.animations:
+            self.animations.remove(animation)
+
+    def frame(self, t):
+        """ The colours of the LEDs at t seconds on the timeline """
+        frame = list(self.colors)
+        for animation in self.animations:
+            if animation.active(t):
+                elapsed = t - animation.start
+                for led in animation.leds:
+                    color = animation.function(elapsed, led)
+                    if color is not None:
+                        frame[led] = tuple(int(c) for c in color)
+        return frame
+
+    def update(self, wait=False):
+        """
+        Writes the current frame to the drone if it has changed, and the write
+        rate allows
+
+        :param wait: Whether to wait until the write rate allows, rather than
+                     leaving the frame for a later update
+        :return: whether a frame was written
+        """
+        t = self.timeline()
+        self.animations = [a for a in self.animations if not a.finished(t)]
+        frame = self.frame(t)
+        if self.memory is None or frame == self._written:
+            return False
+
+        now = time.monotonic()
+        if self._last_write is not None and now - self._last_write < self.min_interval:
+            if not wait:
+                return False
+            time.sleep(self._last_write + self.min_interval - now)
+            now = time.monotonic()
+
+        for led, (r, g, b) in zip(self.memory.leds, frame):
+            led.set(r=r, g=g, b=b)
+        self.memory.write_data(None)
+        self._written = frame
+        self._last_write = now
+        self.writes += 1
+        return True
+
+
+def blink(color, period):
+    """ Blinks between color and off, once every period seconds """
+    return lambda t, led: color if (t % period) < period / 2 else OFF
+
+
+def fade(start_color, end_color, duration):
+    """ Fades from one colour to another over duration seconds """
+    def function(t, led):
+        progress = min(t / duration, 1)
+        return [a + (b - a) * progress for a, b in zip(start_color, end_color)]
+    return function
+
+
+def spin(color, period):
+    """ A single LED of color going around the ring, once every period seconds """
+    def function(t, led):
+        lit = int(t / period * NUMBER_OF_LEDS) % NUMBER_OF_LEDS
+        return color if led == lit else None
+    return function
+
+
+def pulse(color, period):
+    """ Smoothly brightens and dims color, once every period seconds """
+    def function(t, led):
+        brightness = (1 - math.cos(2 * math.pi * t / period)) / 2
+        return [c * brightness for c in color]
+    return function
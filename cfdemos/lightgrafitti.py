@@ -7,8 +7,9 @@ Author: Sam Nolan
 This demonstration draws a path specified by an .obj file (can be exported from
 blender)
 
-This demonstration uses the Position High Level commander as we found it has
-better results.
+This demonstration uses the High Level commander as we found it has
+better results. The path is uploaded to the drone as a trajectory made of
+polynomials, which the drone then flies by itself.
 
 The drone should first take off to it's starting position, then draw the path
 specified, then fly back down to land.
@@ -17,6 +18,12 @@ Unlike the other demonstrations, this demo must be run with an argument indicati
 the obj file that you want the drone to fly in, like
 
 ./lightgrafitti.py RMIT.obj
+
+With --stream, the whole flight is instead planned ahead of time with a speed
+profile (see cfdemos.motionprofile) and streamed to the drone as setpoints with
+the low level commander, like
+
+./lightgrafitti.py RMIT.obj --stream
 """
 import sys
 import time
@@ -28,88 +35,180 @@ from cflib.crazyflie import Crazyflie
 from cflib.crazyflie.log import LogConfig
 from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
 from cflib.crazyflie.syncLogger import SyncLogger
-from cflib.crazyflie.mem import MemoryElement
 from cflib.positioning.position_hl_commander import PositionHlCommander
-from cfdemos.util import wait_for_position_estimator, reset_estimator
+from cfdemos.paths import load_paths, simplify_path
+from cfdemos.ledring import LedRing
+from cfdemos.motionprofile import plan
+from cfdemos.polytrajectory import fit_path, upload_trajectory, TRAJECTORY_ID
+from cfdemos.scheduler import Scheduler, print_stats
+from cfdemos.trajectory import fly
+from cfdemos.util import wait_for_position_estimator, reset_estimator, connect
 
 # URI to the Crazyflie to connect to
 uri = 'radio://0/80/2M/A0A0A0A0AB'
 
-def get_path():
+def get_paths():
     """
-    Very primitive path reading function.
-
-    An .obj file simply contains a list of vertices and the lines that connect
-    those vertices. This function simply takes all the vertices of the .obj
-    file and goes to them in the order they appear in the file.
+    Reads the paths to draw from the .obj file given on the command line.
 
-    If you specify a curve in blender, it should print the vertices in the file
-    in the right order along the curve, so you can use such curves to specify
-    paths to draw.
+    An .obj file contains a list of vertices and the lines (or faces) that
+    connect those vertices. See cfdemos.paths for how these are turned into
+    paths.
 
-    closed shapes will also work, as done with the RMIT logo.
+    If you specify a curve in blender, it becomes a single path along the
+    curve. Closed shapes will also work, as done with the RMIT logo.
 
-    :return: returns an list of 3 dimensional points (represented as lists of size 3)
+    :return: returns a list of cfdemos.paths.Polyline
     """
     if len(sys.argv) < 2:
         sys.exit("Argument required (obj flight path)")
-    path = sys.argv[1]
-    contents = open(path, "r").readlines()
-    vertices = [line for line in contents if line.startswith("v ")]
-    elements = [[float(coordinate) for coordinate in vertex.split(" ")[1:]] for vertex in vertices]
-    return elements
+    return load_paths(sys.argv[1])
     
     
 
-def set_led_color(cf, color):
-    """
-    Sets the color of the light deck. 
+paths = get_paths()
 
-    :param cf: The scf.cf from the SyncCrazyflie
-    :param color: a list of size 3 indicating the color wanted in RGB
-    """
+# How fast to draw the path in m/s
+DRAWING_SPEED = 0.3
+
+# How fast to fly to and from the path in m/s
+TRAVEL_SPEED = 0.3
+
+# The limits of the speed profile when streaming the path
+MAX_ACCELERATION = 0.5
+JUNCTION_DEVIATION = 0.01
+
+# How many setpoints per second to stream
+SETPOINT_RATE = 50
+
+# How far in meters the drawn path can stray from the one in the file, to drop
+# vertices that add nothing to the drawing
+SIMPLIFY_TOLERANCE = 0.005
+
+# The most distance between vertices after simplifying, so the trajectory is
+# timed evenly along the path
+RESAMPLE_SPACING = 0.1
 
-    # Get LED memory and write to it
-    mem = cf.mem.get_mems(MemoryElement.TYPE_DRIVER_LED)
-    if len(mem) > 0:
-        for i in range(12):
-            mem[0].leds[i].set(r=color[0], g=color[1], b=color[2])
-        mem[0].write_data(None)
+# How short in meters a leg to or from the path can be before it is not flown,
+# as when a path starts where the last one ended
+MIN_TRAVEL = 0.001
+
+
+def travel_time(start, end):
+    """ How long to give the high level commander to fly between two points """
+    return max(math.sqrt(sum((a - b) ** 2 for a, b in zip(start, end))) / TRAVEL_SPEED, 1.0)
 
-path = get_path()
 
 def run_sequence(scf):
     """
-    Flies in the given path
+    Flies in the given paths, one after the other
+
+    Each path is uploaded to the drone as a trajectory, so drawing it is a
+    single command rather than a go_to per vertex.
+    """
+    cf = scf.cf
+    commander = cf.high_level_commander
+    cf.param.set_value('commander.enHighLevel', '1')
+    cf.param.set_value('ring.effect', '13')
+    ring = LedRing(cf)
+    # Starts with all the LEDs off
+    ring.set_color([0,0,0])
+
+    simplified = [simplify_path(polyline, SIMPLIFY_TOLERANCE, RESAMPLE_SPACING,
+                                speed=DRAWING_SPEED, acceleration=None)
+                  for polyline in paths]
+    # The obj file is y up, the drone is z up
+    drone_paths = [polyline.points[:, [0, 2, 1]].tolist() for polyline in simplified]
+
+    first = drone_paths[0][0]
+    commander.takeoff(first[2], travel_time([0, 0, 0], [0, 0, first[2]]))
+    time.sleep(travel_time([0, 0, 0], [0, 0, first[2]]))
+    position = [0, 0, first[2]]
+
+    for drone_path in drone_paths:
+        pieces = fit_path(drone_path, speed=DRAWING_SPEED)
+        duration = upload_trajectory(cf, pieces)
+        print("Uploaded {} vertices as {} pieces, drawing takes {:.1f}s"
+              .format(len(drone_path), len(pieces), duration))
+
+        start = drone_path[0]
+        commander.go_to(start[0], start[1], start[2], 0, travel_time(position, start))
+        time.sleep(travel_time(position, start))
+
+        ring.set_color([0,100,0])
+        commander.start_trajectory(TRAJECTORY_ID, 1.0, False)
+        time.sleep(duration)
+        ring.set_color([0,0,0])
+        position = drone_path[-1]
+
+    commander.go_to(0, 0, 0.1, 0, travel_time(position, [0, 0, 0.1]))
+    time.sleep(travel_time(position, [0, 0, 0.1]))
+    commander.land(0, 1)
+    time.sleep(1)
+    commander.stop()
+    # Make sure that the last packet leaves before the link is closed
+    # since the message queue is not flushed before closing
+    time.sleep(0.1)
+
+
+def stream_sequence(scf):
+    """
+    Flies in the given paths, one after the other, with the low level commander
+
+    Every part of the flight is planned with a speed profile and streamed as
+    setpoints at a fixed rate, so nothing blocks between vertices.
     """
     cf = scf.cf
-    with PositionHlCommander(scf, default_velocity=0.1) as pc:
-        cf.param.set_value('ring.effect', '13')
-        # Starts with all the LEDs off
-        set_led_color(cf, [0,0,0])
+    cf.param.set_value('ring.effect', '13')
+    ring = LedRing(cf)
+    ring.set_color([0,0,0])
+
+    scheduler = Scheduler(SETPOINT_RATE, name=cf.link_uri)
+
+    def stream(path, speed):
+        profile = plan(path, speed, MAX_ACCELERATION, JUNCTION_DEVIATION)
+        fly(scf, profile.setpoints(SETPOINT_RATE).tolist(), SETPOINT_RATE, scheduler)
+        return profile
+
+    def travel(start, end):
+        if math.sqrt(sum((a - b) ** 2 for a, b in zip(start, end))) < MIN_TRAVEL:
+            return
+        stream([start, end], TRAVEL_SPEED)
 
+    simplified = [simplify_path(polyline, SIMPLIFY_TOLERANCE, speed=DRAWING_SPEED,
+                                acceleration=None)
+                  for polyline in paths]
+    # The obj file is y up, the drone is z up
+    drone_paths = [polyline.points[:, [0, 2, 1]].tolist() for polyline in simplified]
 
-        
-        pc.go_to(path[0][0], path[0][2], path[0][1])
+    first = drone_paths[0][0]
+    position = [0, 0, first[2]]
+    travel([0, 0, 0], position)
 
-        last_pos = path[0]
-        set_led_color(cf, [0,100,0])
-        for position in get_path():
-            pc.go_to(position[0], position[2], position[1])
-            last_pos = position
+    for drone_path in drone_paths:
+        travel(position, drone_path[0])
 
+        ring.set_color([0,100,0])
+        profile = stream(drone_path, DRAWING_SPEED)
+        ring.set_color([0,0,0])
+        print("Drew {} vertices in {:.1f}s".format(len(drone_path), profile.duration()))
+        position = drone_path[-1]
 
-        set_led_color(cf, [0,0,0])
-        pc.go_to(0,0,0.1)
-        # Make sure that the last packet leaves before the link is closed
-        # since the message queue is not flushed before closing
-        time.sleep(0.1)
+    travel(position, [0, 0, 0.1])
+    cf.commander.send_stop_setpoint()
+    # Make sure that the last packet leaves before the link is closed
+    # since the message queue is not flushed before closing
+    time.sleep(0.1)
 
 
 if __name__ == '__main__':
     cflib.crtp.init_drivers(enable_debug_driver=False)
 
-    with SyncCrazyflie(uri, cf=Crazyflie(rw_cache='./cache')) as scf:
+    with connect(uri) as scf:
         reset_estimator(scf)
-        run_sequence(scf)
+        if '--stream' in sys.argv:
+            stream_sequence(scf)
+            print_stats()
+        else:
+            run_sequence(scf)
 
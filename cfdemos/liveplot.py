@@ -0,0 +1,122 @@
+"""
+This module helps the demos draw live matplotlib plots fast enough to keep up
+with the drones.
+
+The demos used to clear the axes and plot everything again on every frame,
+which rebuilds every artist, tick and label each time and takes most of the
+time between frames, in the same process that sends setpoints. Instead:
+
+  - Make the artists once, with animated=True, and only change their data
+    each frame (set_data, set_data_3d).
+  - Return them from the animation function and pass blit=True to
+    FuncAnimation. The rest of the figure is saved once and only the
+    animated artists are drawn over it.
+  - Keep the limits of the axes still, as changing them means drawing the
+    whole figure again. fit_limits only changes them once the data has gone
+    outside of them or become much smaller, see redraw.
+
+FrameRate counts the frames actually drawn per second and shows it in the
+corner of the axes, to check that a plot keeps up.
+
+Use like the following:
+
+line, = ax.plot([], [], animated=True)
+frame_rate = FrameRate(ax)
+
+def animate(i):
+    line.set_data(xs, ys)
+    limits = fit_limits(ax.get_ylim(), min(ys), max(ys))
+    if limits is not None:
+        ax.set_ylim(limits)
+        redraw(ax)
+    return line, frame_rate.tick()
+
+ani = FuncAnimation(fig, animate, interval=33, blit=True)
+"""
+import time
+from collections import deque
+
+# How many frames the frame rate is averaged over
+FRAME_RATE_WINDOW = 30
+
+# How much room fit_limits leaves around the data, as a fraction of its range
+LIMIT_MARGIN = 0.1
+
+
+class FrameRate:
+    """
+    The frames per second of an animation, shown as an animated text in the
+    corner of the axes
+
+    :param ax: The axes to show it in
+    :param window: How many of the latest frames to average over
+    """
+
+    def __init__(self, ax, window=FRAME_RATE_WINDOW):
+        self.times = deque(maxlen=window)
+        self.frames = 0
+        self.slowest = 0.0
+        self._first = None
+        position = dict(x=0.02, y=0.95, s='', transform=ax.transAxes, animated=True)
+        # 3D axes take a z for text, and have text2D for text on the axes
+        if hasattr(ax, 'text2D'):
+            self.text = ax.text2D(**position)
+        else:
+            self.text = ax.text(**position)
+
+    def fps(self):
+        """ The frames per second over the latest frames """
+        if len(self.times) < 2:
+            return 0.0
+        return (len(self.times) - 1) / (self.times[-1] - self.times[0])
+
+    def tick(self):
+        """
+        Counts a frame, call once from the animation function
+
+        :return: the text artist, to be returned with the other artists
+        """
+        now = time.perf_counter()
+        if self.times:
+            self.slowest = max(self.slowest, now - self.times[-1])
+        else:
+            self._first = now
+        self.times.append(now)
+        self.frames += 1
+        self.text.set_text("{:.0f} fps".format(self.fps()))
+        return self.text
+
+    def print_report(self):
+        """ Prints the average frame rate and the longest frame """
+        if self.frames < 2:
+            return
+        average = (self.frames - 1) / (self.times[-1] - self._first)
+        print("Drew {} frames at {:.1f} fps, the longest taking {:.0f}ms"
+              .format(self.frames, average, self.slowest * 1000))
+
+
+def fit_limits(limits, low, high, margin=LIMIT_MARGIN):
+    """
+    New limits for an axis to show data from low to high, or None if the
+    current limits will do: the data is within them and fills at least half
+    of them
+
+    :param limits: The current (min, max) of the axis
+    :param low, high: The smallest and largest value to show
+    :param margin: How much room to leave on either side, as a fraction of
+                   high - low
+    """
+    bottom, top = limits
+    span = max(high - low, 1e-6)
+    if bottom <= low and high <= top and span >= (top - bottom) / 2:
+        return None
+    return low - span * margin, high + span * margin
+
+
+def redraw(ax):
+    """
+    Draws the whole figure again, such as after changing the limits of ax.
+    The animated artists are left out, and the next blit saves the new
+    background
+    """
+    ax.figure.canvas.draw()
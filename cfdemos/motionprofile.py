@@ -0,0 +1,155 @@
+"""
+This module plans how fast to fly along a path, so that the path can be
+streamed to the drone as setpoints with the low level commander.
+
+Sending the vertices of a path one at a time makes the drone fly to each one
+and wait, and sending them all at once makes it cut across corners. Instead
+the speed along the path is planned ahead of time, with a trapezoidal profile
+on every edge: speeding up at max_acceleration, cruising at max_velocity and
+slowing down again. The drone slows down for corners, more the sharper they
+are, and comes to a stop at the ends of the path.
+
+The speed at a corner is limited the same way as in grbl (a CNC controller),
+with a junction deviation: how far the corner is allowed to be rounded off
+while taking it without stopping. A straight line is not limited at all, and
+turning back on itself means stopping.
+
+Use like the following:
+
+profile = plan(path, max_velocity=0.3, max_acceleration=0.5)
+fly(scf, profile.setpoints(rate=20).tolist(), 20)
+"""
+import math
+
+import numpy as np
+
+
+class MotionProfile:
+    """
+    A path with a speed planned along each of its edges.
+
+    :param points: an array of shape (n, 3) of the vertices
+    :param speeds: the speed at each vertex in m/s
+    :param max_velocity: The fastest to fly in m/s
+    :param max_acceleration: How quickly to speed up and slow down in m/s^2
+    """
+
+    def __init__(self, points, speeds, max_velocity, max_acceleration):
+        self.points = points
+        self.speeds = speeds
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+
+        self.lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+        start, end = speeds[:-1], speeds[1:]
+        a = max_acceleration
+        # The fastest each edge reaches, and how far it takes to get there and
+        # to slow down to the speed at the end of the edge
+        self.peaks = np.minimum(max_velocity,
+                                np.sqrt((2 * a * self.lengths + start ** 2 + end ** 2) / 2))
+        self.speeding_up = (self.peaks ** 2 - start ** 2) / (2 * a)
+        self.slowing_down = (self.peaks ** 2 - end ** 2) / (2 * a)
+        self.cruising = np.maximum(self.lengths - self.speeding_up - self.slowing_down, 0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cruise_times = np.where(self.peaks > 0, self.cruising / self.peaks, 0)
+        self.phase_times = np.stack([(self.peaks - start) / a, cruise_times,
+                                     (self.peaks - end) / a], axis=1)
+        self.edge_times = self.phase_times.sum(axis=1)
+        self.start_times = np.concatenate([[0], np.cumsum(self.edge_times)])
+
+    def duration(self):
+        """ How long the path takes to fly in seconds """
+        return float(self.start_times[-1])
+
+    def positions(self, times):
+        """
+        Where on the path the drone should be at each of times
+
+        :param times: an array of times in seconds from the start of the path
+        :return: an array of shape (len(times), 3)
+        """
+        times = np.clip(np.asarray(times, dtype=float), 0, self.duration())
+        edge = np.clip(np.searchsorted(self.start_times, times, side='right') - 1,
+                       0, len(self.lengths) - 1)
+        t = times - self.start_times[edge]
+
+        a = self.max_acceleration
+        v0 = self.speeds[edge]
+        peak = self.peaks[edge]
+        accelerating, cruising, _ = self.phase_times[edge].T
+
+        # Distance along the edge in each phase of the trapezoid
+        t1 = np.minimum(t, accelerating)
+        t2 = np.clip(t - accelerating, 0, cruising)
+        t3 = np.clip(t - accelerating - cruising, 0, None)
+        distance = (v0 * t1 + a * t1 ** 2 / 2 + peak * t2 + peak * t3 - a * t3 ** 2 / 2)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(self.lengths[edge] > 0,
+                                np.clip(distance / self.lengths[edge], 0, 1), 1)
+        start = self.points[edge]
+        return start + (self.points[edge + 1] - start) * fraction[:, np.newaxis]
+
+    def setpoints(self, rate, yaw=0.0):
+        """
+        The path as setpoints at a fixed rate, ending on the last vertex
+
+        :param rate: How many setpoints per second
+        :param yaw: The yaw to hold in degrees
+        :return: an array of shape (ticks, 4) of x, y, z and yaw
+        """
+        ticks = int(math.ceil(self.duration() * rate)) + 1
+        setpoints = np.empty((ticks, 4))
+        setpoints[:, :3] = self.positions(np.arange(ticks) / rate)
+        setpoints[:, 3] = yaw
+        return setpoints
+
+
+def _corner_speeds(points, max_velocity, max_acceleration, junction_deviation):
+    """
+    The fastest the drone can take each vertex, stopping at the ends
+    """
+    directions = np.diff(points, axis=0)
+    directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+
+    speeds = np.zeros(len(points))
+    # The cosine of the angle between the way out of a corner and the way
+    # back along the way in. -1 on a straight line, 1 when turning back
+    cos_theta = np.clip(-np.sum(directions[:-1] * directions[1:], axis=1), -1, 1)
+    sin_half = np.sqrt((1 - cos_theta) / 2)
+    with np.errstate(divide='ignore'):
+        corner = np.sqrt(max_acceleration * junction_deviation * sin_half / (1 - sin_half))
+    speeds[1:-1] = np.minimum(corner, max_velocity)
+    return speeds
+
+
+def plan(path, max_velocity=0.3, max_acceleration=0.5, junction_deviation=0.01):
+    """
+    Plans the speed along a path
+
+    :param path: a list of [x, y, z] vertices to fly through
+    :param max_velocity: The fastest to fly in m/s
+    :param max_acceleration: How quickly to speed up and slow down in m/s^2
+    :param junction_deviation: How far in meters corners can be rounded off,
+                               the larger the faster corners are taken
+    :return: a MotionProfile
+    """
+    points = np.asarray(path, dtype=float)
+    # Repeated vertices have no direction between them
+    keep = np.concatenate([[True], np.linalg.norm(np.diff(points, axis=0), axis=1) > 1e-9])
+    points = points[keep]
+    if len(points) < 2:
+        raise ValueError("A path needs at least two distinct vertices")
+
+    speeds = _corner_speeds(points, max_velocity, max_acceleration, junction_deviation)
+    lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+
+    # Make sure every speed can be reached from the one before and slowed down
+    # from to the one after
+    for i in range(1, len(points)):
+        speeds[i] = min(speeds[i], math.sqrt(speeds[i - 1] ** 2 + 2 * max_acceleration * lengths[i - 1]))
+    for i in range(len(points) - 2, -1, -1):
+        speeds[i] = min(speeds[i], math.sqrt(speeds[i + 1] ** 2 + 2 * max_acceleration * lengths[i]))
+
+    return MotionProfile(points, speeds, max_velocity, max_acceleration)
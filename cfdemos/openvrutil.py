@@ -6,9 +6,33 @@ Using openvr requires that SteamVR is running on the computer that is being used
 Interestingly, all VIVE trackers connect to the computer via the headset. This means
 that the headset has to be connected and running to any computer that you wish to use VIVE
 with.
+
+Every call to get_tracker_pos fetches the poses of all 64 devices SteamVR can
+track, to use one of them. To read several trackers in the same frame, use a
+PoseSampler, which fetches the poses once per frame and converts them all at
+once:
+
+sampler = PoseSampler(vr)
+sampler.sample()
+if sampler.seen[[tracker1, tracker2]].all():
+    pos1, pos2 = sampler.positions[[tracker1, tracker2]]
+
+A device is NaN in positions until it has had a valid pose, so check seen (or
+valid, for only the devices tracked in this sample) before using it.
 """
-import openvr
+import ctypes
 import sys
+import time
+
+import numpy as np
+
+from cfdemos import fakevr
+
+# Without SteamVR, CFDEMOS_FAKE_VR makes up the trackers, see cfdemos.fakevr
+if fakevr.enabled():
+    openvr = fakevr
+else:
+    import openvr
 
 def init():
     """ Initialises openvr, returns a handle for use in all openvr calls """
@@ -69,4 +93,73 @@ def get_tracker_pos(vr, tracker):
     pose = controller_pose.mDeviceToAbsoluteTracking
         
     pos = [-1*pose[2][3], -1*pose[0][3], pose[1][3]]
-    return pos    
\ No newline at end of file
+    return pos
+
+
+def _pose_dtype():
+    """
+    The parts of openvr's TrackedDevicePose_t that are used, as a NumPy dtype,
+    so that the array of poses can be read without going through each one
+    """
+    pose = openvr.TrackedDevicePose_t
+    return np.dtype({'names': ['matrix', 'valid'],
+                     'formats': [('<f4', (3, 4)), '?'],
+                     'offsets': [pose.mDeviceToAbsoluteTracking.offset, pose.bPoseIsValid.offset],
+                     'itemsize': ctypes.sizeof(pose)})
+
+
+class PoseSampler:
+    """
+    The positions of every device SteamVR tracks, fetched once per frame
+
+    Call sample once at the start of each frame, then read as many positions
+    as needed from positions. They are all from the same moment.
+
+    :param vr: the vr object returned by init
+    """
+
+    def __init__(self, vr):
+        self.vr = vr
+        self.dtype = _pose_dtype()
+        # The last known position of each device in the coordinate space of
+        # the crazyflies, NaN until it has had a valid pose, whether its pose
+        # was valid in the last sample, and whether it has ever been
+        self.positions = np.full((openvr.k_unMaxTrackedDeviceCount, 3), np.nan)
+        self.valid = np.zeros(openvr.k_unMaxTrackedDeviceCount, dtype=bool)
+        self.seen = np.zeros(openvr.k_unMaxTrackedDeviceCount, dtype=bool)
+        # When the poses were fetched, on the monotonic clock, and how many
+        # times they have been
+        self.time = None
+        self.frames = 0
+
+    def sample(self):
+        """
+        Fetches the poses of every device and converts them
+
+        :return: positions, an array of shape (devices, 3)
+        """
+        poses = self.vr.getDeviceToAbsoluteTrackingPose(
+                openvr.TrackingUniverseStanding, 0,
+                openvr.k_unMaxTrackedDeviceCount)
+        self.time = time.monotonic()
+        self.frames += 1
+
+        poses = np.frombuffer(poses, dtype=self.dtype)
+        self.valid[:] = poses['valid']
+        self.seen |= self.valid
+        # The same transform as get_tracker_pos. A device that has lost
+        # tracking keeps the position it was last seen at
+        matrix = poses['matrix'][self.valid]
+        self.positions[self.valid] = np.stack([-matrix[:, 2, 3], -matrix[:, 0, 3],
+                                               matrix[:, 1, 3]], axis=1)
+        return self.positions
+
+    def position(self, device):
+        """
+        The position of one device in the last sample, as [x, y, z], or
+        where it was last seen if it is not tracked now. None if it has
+        never been seen
+        """
+        if not self.seen[device]:
+            return None
+        return self.positions[device].tolist()
@@ -0,0 +1,365 @@
+"""
+This module loads paths for the drone to fly from .obj files (which can be
+exported from blender).
+
+An .obj file contains a list of vertices (v lines), and the lines (l) and
+faces (f) that connect them, grouped into objects (o). Each object is turned
+into polylines by following the connections:
+
+  - Lines are chained together end to end. A curve exported from blender
+    becomes one polyline, closed if the curve is.
+  - Faces are filled shapes, like the RMIT logo, so their outline is used.
+    The outline is made up of the edges that belong to only one face.
+  - An object with neither is flown in the order of its vertices.
+
+Parsing the same file again is avoided by caching the result, both in memory
+and on disk under the hash of the file's contents, so a file that has not
+changed loads instantly the next time.
+
+Paths exported from blender often have many nearly collinear vertices, which
+take time to fly but add nothing to the drawing. simplify_path removes them,
+and can then resample what is left so the vertices are evenly spaced.
+
+Use like the following:
+
+for polyline in load_paths("RMIT.obj"):
+    print(polyline.name, polyline.points.shape, polyline.closed)
+    simplified = simplify_path(polyline, tolerance=0.005, spacing=0.05)
+"""
+import hashlib
+import json
+import os
+from collections import defaultdict, namedtuple
+
+import numpy as np
+
+# A connected path through space
+#
+# name: The name of the object it came from
+# points: an array of shape (n, 3). For closed polylines the first point is
+#         repeated at the end
+# closed: Whether the polyline is a loop
+Polyline = namedtuple('Polyline', 'name points closed')
+
+# Where parsed files are cached, alongside the cflib TOC cache
+CACHE_DIRECTORY = os.path.join('.', 'cache', 'paths')
+
+# Bump this when the parsing changes, so old cache entries are ignored
+CACHE_VERSION = 1
+
+# How quickly a drone is assumed to speed up and slow down in m/s^2, when
+# estimating how long it takes to fly a path stopping at each vertex
+ACCELERATION = 0.5
+
+_memory_cache = {}
+
+
+def _index(token, vertex_count):
+    """
+    Turns an index from an l or f line into an index into the vertices.
+    Indices start at 1, negative ones count back from the latest vertex, and
+    face indices can have texture and normal indices after a slash
+    """
+    index = int(token.split('/')[0])
+    if index < 0:
+        return vertex_count + index
+    return index - 1
+
+
+def parse_obj(lines):
+    """
+    Parses the contents of an .obj file
+
+    :param lines: the lines of the file
+    :return: the vertices as an array of shape (n, 3), and a list of
+             (name, vertex indices, lines, faces) for each object, where lines
+             and faces are lists of vertex index lists
+    """
+    vertices = []
+    objects = []
+    current = None
+
+    def start_object(name):
+        objects.append((name, [], [], []))
+        return objects[-1]
+
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        kind = parts[0]
+        if kind == 'o':
+            current = start_object(' '.join(parts[1:]))
+        elif kind == 'v':
+            if current is None:
+                current = start_object('')
+            current[1].append(len(vertices))
+            vertices.append([float(coordinate) for coordinate in parts[1:4]])
+        elif kind in ('l', 'f'):
+            if current is None:
+                current = start_object('')
+            indices = [_index(token, len(vertices)) for token in parts[1:]]
+            if kind == 'l':
+                current[2].append(indices)
+            else:
+                current[3].append(indices)
+
+    return np.array(vertices, dtype=float).reshape(-1, 3), objects
+
+
+def _edges(lines, faces):
+    """
+    The edges to follow. Every pair of neighbours in a line, and the edges of
+    the faces that are on the outline
+    """
+    edges = []
+    for line in lines:
+        edges.extend(zip(line, line[1:]))
+
+    face_edges = defaultdict(int)
+    for face in faces:
+        for a, b in zip(face, face[1:] + face[:1]):
+            face_edges[(min(a, b), max(a, b))] += 1
+    edges.extend(edge for edge, count in face_edges.items() if count == 1)
+    return edges
+
+
+def _chain(edges):
+    """
+    Chains edges into polylines.
+
+    Open chains start at their lowest numbered end, loops start at their
+    lowest numbered vertex. At each vertex the lowest numbered unvisited
+    neighbour is taken next, which follows the order blender writes curves in.
+
+    :return: a list of (vertex indices, closed)
+    """
+    neighbours = defaultdict(set)
+    for a, b in edges:
+        if a != b:
+            neighbours[a].add(b)
+            neighbours[b].add(a)
+
+    unused = {(min(a, b), max(a, b)) for a, b in edges if a != b}
+    chains = []
+    while unused:
+        remaining = {vertex for edge in unused for vertex in edge}
+        # Start from an end of a chain if there are any left
+        ends = [v for v in remaining
+                if sum((min(v, n), max(v, n)) in unused for n in neighbours[v]) == 1]
+        start = min(ends) if ends else min(remaining)
+
+        chain = [start]
+        current = start
+        while True:
+            options = sorted(n for n in neighbours[current]
+                             if (min(current, n), max(current, n)) in unused)
+            if not options:
+                break
+            following = options[0]
+            unused.discard((min(current, following), max(current, following)))
+            chain.append(following)
+            current = following
+        chains.append((chain, len(chain) > 2 and chain[0] == chain[-1]))
+    return chains
+
+
+def build_polylines(vertices, objects):
+    """
+    Turns parsed .obj contents into polylines, see parse_obj
+    """
+    polylines = []
+    for name, indices, lines, faces in objects:
+        edges = _edges(lines, faces)
+        if edges:
+            for chain, closed in _chain(edges):
+                polylines.append(Polyline(name, vertices[chain], closed))
+        elif indices:
+            polylines.append(Polyline(name, vertices[indices], False))
+    return polylines
+
+
+def _cache_file(digest):
+    return os.path.join(CACHE_DIRECTORY, '{}-{}.npz'.format(digest, CACHE_VERSION))
+
+
+def _read_cache(digest):
+    try:
+        with np.load(_cache_file(digest)) as data:
+            header = json.loads(str(data['header']))
+            return [Polyline(name, data['points{}'.format(i)], closed)
+                    for i, (name, closed) in enumerate(header)]
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _write_cache(digest, polylines):
+    try:
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        header = json.dumps([[p.name, p.closed] for p in polylines])
+        arrays = {'points{}'.format(i): p.points for i, p in enumerate(polylines)}
+        # Written to a temporary file first so a half written cache is never read
+        temporary = _cache_file(digest) + '.tmp.npz'
+        np.savez(temporary, header=header, **arrays)
+        os.replace(temporary, _cache_file(digest))
+    except OSError as e:
+        print("Could not cache path: {}".format(e))
+
+
+def load_paths(filename, use_cache=True):
+    """
+    Loads the polylines in an .obj file
+
+    :param filename: The .obj file
+    :param use_cache: Whether to use (and update) the cache
+    :return: a list of Polyline, in the order the objects appear in the file
+    """
+    with open(filename, 'rb') as f:
+        contents = f.read()
+    digest = hashlib.sha1(contents).hexdigest()
+
+    if use_cache:
+        if digest in _memory_cache:
+            return _memory_cache[digest]
+        polylines = _read_cache(digest)
+        if polylines is not None:
+            _memory_cache[digest] = polylines
+            return polylines
+
+    vertices, objects = parse_obj(contents.decode('utf-8', 'replace').splitlines())
+    polylines = build_polylines(vertices, objects)
+
+    if use_cache:
+        _memory_cache[digest] = polylines
+        _write_cache(digest, polylines)
+    return polylines
+
+
+def _segment_distances(points, start, end):
+    """
+    The distance from each of points to the line segment from start to end
+    """
+    direction = end - start
+    length_squared = direction @ direction
+    if length_squared == 0:
+        return np.linalg.norm(points - start, axis=1)
+    along = np.clip((points - start) @ direction / length_squared, 0, 1)
+    return np.linalg.norm(points - (start + along[:, np.newaxis] * direction), axis=1)
+
+
+def simplify(points, tolerance):
+    """
+    Removes the vertices of a polyline that are within tolerance of the line
+    between the vertices either side, with the Ramer-Douglas-Peucker algorithm.
+
+    The first and last vertices are always kept, so closed polylines stay
+    closed.
+
+    :param points: an array of shape (n, 3)
+    :param tolerance: How far in meters the simplified polyline can be from
+                      any of the original vertices
+    :return: an array of the vertices that are kept, in order
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) < 3:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+
+    # Ranges of vertices still to be simplified, done with a stack rather than
+    # recursion so long paths do not reach the recursion limit
+    ranges = [(0, len(points) - 1)]
+    while ranges:
+        first, last = ranges.pop()
+        if last - first < 2:
+            continue
+        distances = _segment_distances(points[first + 1:last], points[first], points[last])
+        furthest = int(np.argmax(distances))
+        if distances[furthest] > tolerance:
+            middle = first + 1 + furthest
+            keep[middle] = True
+            ranges.append((first, middle))
+            ranges.append((middle, last))
+    return points[keep]
+
+
+def resample(points, spacing):
+    """
+    Spreads vertices evenly along a polyline by arc length.
+
+    Each edge is split into equal parts no longer than spacing. The vertices of
+    the polyline are kept, so sharp corners (like those of the RMIT logo) are
+    not cut off.
+
+    :param points: an array of shape (n, 3)
+    :param spacing: The longest distance between vertices in meters
+    :return: an array of shape (m, 3)
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) < 2:
+        return points
+    lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    parts = np.maximum(np.ceil(lengths / spacing), 1).astype(int)
+    resampled = [points[i] + (points[i + 1] - points[i]) * (np.arange(n) / n)[:, np.newaxis]
+                 for i, n in enumerate(parts)]
+    resampled.append(points[-1:])
+    return np.concatenate(resampled)
+
+
+def path_length(points):
+    """ The length of a polyline in meters """
+    return float(np.linalg.norm(np.diff(points, axis=0), axis=1).sum())
+
+
+def flight_time(points, speed, acceleration=ACCELERATION):
+    """
+    Estimates how long it takes to fly a polyline.
+
+    Flying with a go_to per vertex, the drone comes to a stop at every vertex,
+    speeding up to at most speed in between. Without an acceleration, the path
+    is taken to be flown at a steady speed, as it is as a trajectory.
+
+    :param points: an array of shape (n, 3)
+    :param speed: How fast to fly in m/s
+    :param acceleration: How quickly the drone speeds up and slows down in
+                         m/s^2, or None if it does not stop at the vertices
+    :return: the time in seconds
+    """
+    lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    if acceleration is None:
+        return float(lengths.sum() / speed)
+    # Edges too short to reach full speed are spent speeding up and slowing down
+    reaches_speed = lengths >= speed * speed / acceleration
+    times = np.where(reaches_speed, lengths / speed + speed / acceleration,
+                     2 * np.sqrt(lengths / acceleration))
+    return float(times.sum())
+
+
+def simplify_path(polyline, tolerance=0.005, spacing=None, speed=0.3,
+                  acceleration=ACCELERATION, report=True):
+    """
+    Simplifies a polyline before flying it, and reports how much it helped.
+
+    :param polyline: a Polyline
+    :param tolerance: How far the simplified path can be from the original in
+                      meters, see simplify
+    :param spacing: If given, the path is then resampled to vertices at most
+                    this far apart, see resample
+    :param speed: The speed the path is flown at, for the time estimate
+    :param acceleration: see flight_time
+    :param report: Whether to print the vertex count and estimated flight time
+                   before and after
+    :return: the simplified Polyline
+    """
+    points = simplify(polyline.points, tolerance)
+    if spacing is not None:
+        points = resample(points, spacing)
+    simplified = polyline._replace(points=points)
+
+    if report:
+        print("{}: {} -> {} vertices, {:.2f}m -> {:.2f}m, about {:.1f}s -> {:.1f}s"
+              .format(polyline.name or 'path', len(polyline.points), len(points),
+                      path_length(polyline.points), path_length(points),
+                      flight_time(polyline.points, speed, acceleration),
+                      flight_time(points, speed, acceleration)))
+    return simplified
@@ -3,8 +3,15 @@ Author: Sam Nolan
 This demonstration simply shows the ability to track a drone within 3D space
 using matplotlib
 
-Simply run this and connect to a drone to draw it's location.
+Simply run this and connect to a drone to draw it's location. Add more uris to
+draw more drones together.
+
+Run with --replay and a recording from cfdemos.telemetry to draw a recorded
+flight instead, at the speed given by --speed (like 10, or max).
 """
+import argparse
+import sys
+
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 from matplotlib.animation import FuncAnimation
@@ -13,60 +20,115 @@ from cflib.crazyflie import Crazyflie
 from cflib.crazyflie.log import LogConfig
 from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
 from cflib.crazyflie.syncLogger import SyncLogger
-from cfdemos.util import print_errors, reset_estimator, check_battery, start_console
+from cfdemos.liveplot import FrameRate
+from cfdemos.replay import Replay, add_replay_arguments
+from cfdemos.telemetry import read_telemetry
+from cfdemos.util import print_errors, reset_estimator, check_battery, start_console, connect, log_api
 from matplotlib import style
 
 style.use('fivethirtyeight')
 fig = plt.figure()
-ax = Axes3D(fig)
+ax = fig.add_subplot(projection='3d')
 
 
 
 ax.set_xlabel('X')
 ax.set_ylabel('Y')
 ax.set_zlabel('Z')
+ax.set_xlim(-2, 2)
+ax.set_ylim(-2, 2)
+ax.set_zlim(0, 2)
+
+# The drones to draw, each in its own colour
+uris = ['radio://0/80/2M/A0A0A0A0AA']
+
+# How often the plot is redrawn, in ms
+FRAME_INTERVAL = 33
+
+# The latest position of each drone, by uri
+positions = {}
+# The point drawn for each drone, made once and moved every frame (see
+# cfdemos.liveplot)
+points = {}
+frame_rate = FrameRate(ax)
+
+
+def add_points(uris):
+    """ Makes the point of each drone, with a legend of which is which """
+    for uri in uris:
+        points[uri], = ax.plot([], [], [], 'o', label=uri, animated=True)
+    ax.legend(loc='lower right', fontsize='small')
 
-uri = 'radio://0/80/2M/A0A0A0A0AA'
-x = 0
-y = 0
-z = 0
 
 def animate(i):
     """
-    Redraws the single point that is the drone on the scatter plot
+    Moves the point of each drone to its latest position. Only the points
+    are drawn again, over the rest of the plot
     """
-    ax.clear()
-    ax.scatter([x], [y], [z])
-    ax.set_ylim(-2, 2)
-    ax.set_xlim(-2, 2)
-    ax.set_zlim(0, 2)
+    for uri, point in points.items():
+        if uri in positions:
+            x, y, z = positions[uri]
+            point.set_data_3d([x], [y], [z])
+    return list(points.values()) + [frame_rate.tick()]
 
-@print_errors
-def position_callback(timestamp, data, logconf):
-    global x, y, z
-    
-    x = data['kalman.stateX']
-    y = data['kalman.stateY']
-    z = data['kalman.stateZ']
+def position_callback(uri):
+    """ Makes the log callback that keeps the latest position of the drone at uri """
+    @print_errors
+    def callback(timestamp, data, logconf):
+        positions[uri] = (data['kalman.stateX'], data['kalman.stateY'], data['kalman.stateZ'])
+    return callback
 
-if __name__ == '__main__':
-    cflib.crtp.init_drivers(enable_debug_driver=False)
-    ani = FuncAnimation(fig, animate, interval=100)
-    scf = SyncCrazyflie(uri, cf=Crazyflie(rw_cache='./cache'))
+def replay_recording(path, speed):
+    """ Plays the positions of every drone in a recording into positions """
+    telemetry = read_telemetry(path)
+    replay = Replay(telemetry, speed)
+    for uri in telemetry.uris:
+        replay.add_callback(uri, 'state', position_callback(uri))
+    return replay
+
+
+@print_errors
+def start_drone(uri):
+    """ Connects to the drone at uri and starts logging its position """
+    scf = connect(uri)
     scf.open_link()
-    
+
     # Add position tracking
+    LogConfig, SyncLogger = log_api(scf)
     log_conf = LogConfig(name='Position', period_in_ms=100)
     log_conf.add_variable('kalman.stateX', 'float')
     log_conf.add_variable('kalman.stateY', 'float')
     log_conf.add_variable('kalman.stateZ', 'float')
-    
+
     # Add log config to drone
     scf.cf.log.add_config(log_conf)
-    log_conf.data_received_cb.add_callback(position_callback)
+    log_conf.data_received_cb.add_callback(position_callback(uri))
     log_conf.start()
-    
+
     reset_estimator(scf)
-    check_battery(scf, "Drone")
-    start_console(scf, "Drone")
+    check_battery(scf, uri)
+    start_console(scf, uri)
+    return scf
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Draws the location of drones")
+    add_replay_arguments(parser)
+    options = parser.parse_args()
+
+    if options.replay:
+        replay = replay_recording(options.replay, options.speed)
+        add_points(replay.telemetry.uris)
+        ani = FuncAnimation(fig, animate, interval=FRAME_INTERVAL, blit=True)
+        replay.start()
+        plt.show()
+        replay.stop()
+        frame_rate.print_report()
+        sys.exit()
+
+    cflib.crtp.init_drivers(enable_debug_driver=False)
+    add_points(uris)
+    ani = FuncAnimation(fig, animate, interval=FRAME_INTERVAL, blit=True)
+    scfs = [start_drone(uri) for uri in uris]
     plt.show()
+    frame_rate.print_report()
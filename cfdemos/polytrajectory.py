@@ -0,0 +1,197 @@
+"""
+This module turns a path into a trajectory that the drone flies by itself
+with the high level commander.
+
+Flying a path with go_to costs a radio round trip for every vertex, and the
+drone stops at each one. Instead the path is fitted with piecewise 7th order
+polynomials (the format of the high level commander's trajectories), which are
+written into the drone's trajectory memory in one go and then flown with a
+single start_trajectory.
+
+The trajectory memory only has room for a limited number of pieces, so long
+paths are split into groups of vertices, each fitted by one piece. Every piece
+passes exactly through the vertices at its ends, with the velocity there
+matching the next piece, and passes as close as it can to the vertices in
+between.
+
+Use like the following:
+
+pieces = fit_path(path, speed=0.3)
+duration = upload_trajectory(cf, pieces)
+cf.high_level_commander.start_trajectory(TRAJECTORY_ID, 1.0, False)
+time.sleep(duration)
+"""
+import inspect
+import math
+import threading
+
+import numpy as np
+
+from cflib.crazyflie.mem import MemoryElement
+from cflib.crazyflie.mem import Poly4D
+
+# The id the trajectory is defined with on the drone
+TRAJECTORY_ID = 1
+
+# The trajectory memory is 4kB, and each piece takes 132 bytes
+TRAJECTORY_MEMORY_SIZE = 4096
+PIECE_SIZE = 132
+MAX_PIECES = TRAJECTORY_MEMORY_SIZE // PIECE_SIZE
+
+DEGREE = 7
+
+# How strongly the free coefficients are kept small. This keeps pieces without
+# any vertices in the middle as plain cubics
+REGULARISATION = 1e-6
+
+
+class Piece:
+    """
+    One polynomial piece of a trajectory
+
+    :param duration: How long the piece lasts in seconds
+    :param coefficients: an array of shape (4, 8), the coefficients for x, y, z
+                         and yaw, lowest power first
+    """
+
+    def __init__(self, duration, coefficients):
+        self.duration = duration
+        self.coefficients = coefficients
+
+    def evaluate(self, t):
+        """ The x, y, z and yaw at t seconds into the piece """
+        powers = t ** np.arange(DEGREE + 1)
+        return self.coefficients @ powers
+
+
+def _knot_velocities(points, times):
+    """
+    The velocity at each vertex, the average of the edges either side of it.
+    The drone starts and ends at rest
+    """
+    velocities = np.zeros_like(points)
+    if len(points) > 2:
+        velocities[1:-1] = (points[2:] - points[:-2]) / (times[2:] - times[:-2])[:, np.newaxis]
+    return velocities
+
+
+def _fit_piece(points, times, start_velocity, end_velocity):
+    """
+    Fits one piece through points at times (times[0] being 0).
+
+    The piece is fitted in normalised time s = t / duration. The ends are
+    constraints and the vertices in between are fitted by least squares,
+    which is done by solving the KKT system of the constrained problem.
+    """
+    duration = times[-1]
+    s = times / duration
+    powers = np.arange(DEGREE + 1)
+
+    # Position and velocity at both ends
+    constraints = np.zeros((4, DEGREE + 1))
+    constraints[0, 0] = 1
+    constraints[1, 1] = 1
+    constraints[2] = 1
+    constraints[3, 1:] = powers[1:]
+
+    inner = s[1:-1]
+    design = inner[:, np.newaxis] ** powers
+    regularisation = np.diag([0, 0, 0, 0] + [REGULARISATION] * (DEGREE - 3))
+    kkt = np.zeros((DEGREE + 5, DEGREE + 5))
+    kkt[:DEGREE + 1, :DEGREE + 1] = 2 * (design.T @ design + regularisation)
+    kkt[:DEGREE + 1, DEGREE + 1:] = constraints.T
+    kkt[DEGREE + 1:, :DEGREE + 1] = constraints
+
+    coefficients = np.zeros((4, DEGREE + 1))
+    for axis in range(3):
+        rhs = np.zeros(DEGREE + 5)
+        rhs[:DEGREE + 1] = 2 * design.T @ points[1:-1, axis]
+        # Velocities are scaled by the duration in normalised time
+        rhs[DEGREE + 1:] = [points[0, axis], start_velocity[axis] * duration,
+                            points[-1, axis], end_velocity[axis] * duration]
+        normalised = np.linalg.solve(kkt, rhs)[:DEGREE + 1]
+        coefficients[axis] = normalised / duration ** powers
+    return Piece(duration, coefficients)
+
+
+def fit_path(path, speed=0.3, max_pieces=MAX_PIECES):
+    """
+    Fits a path with piecewise polynomials
+
+    Time along the path is in proportion to distance, so the drone flies at
+    roughly speed the whole way.
+
+    :param path: a list of [x, y, z] vertices to fly through
+    :param speed: How fast to fly along the path in m/s
+    :param max_pieces: The most pieces to use
+    :return: a list of Piece
+    """
+    points = np.asarray(path, dtype=float)
+    # Repeated vertices would have no time between them
+    keep = np.concatenate([[True], np.linalg.norm(np.diff(points, axis=0), axis=1) > 1e-9])
+    points = points[keep]
+    if len(points) < 2:
+        raise ValueError("A path needs at least two distinct vertices")
+
+    lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    times = np.concatenate([[0], np.cumsum(lengths)]) / speed
+    velocities = _knot_velocities(points, times)
+
+    edges = len(points) - 1
+    per_piece = math.ceil(edges / max_pieces)
+    knots = list(range(0, edges, per_piece)) + [edges]
+
+    pieces = []
+    for start, end in zip(knots, knots[1:]):
+        section = slice(start, end + 1)
+        pieces.append(_fit_piece(points[section], times[section] - times[start],
+                                 velocities[start], velocities[end]))
+    return pieces
+
+
+class TrajectoryUploadError(Exception):
+    """ The trajectory could not be written into the drone's memory """
+
+
+def upload_trajectory(cf, pieces, trajectory_id=TRAJECTORY_ID):
+    """
+    Writes the pieces into the trajectory memory of the drone in one write and
+    defines them as a trajectory
+
+    :param cf: The scf.cf from the SyncCrazyflie
+    :param pieces: a list of Piece
+    :param trajectory_id: The id to define the trajectory as
+    :return: How long the trajectory takes to fly in seconds
+    :raises TrajectoryUploadError: if the write fails or the drone does not
+                                   answer in time
+    """
+    if len(pieces) > MAX_PIECES:
+        raise ValueError("{} pieces do not fit in the trajectory memory (max {})"
+                         .format(len(pieces), MAX_PIECES))
+    trajectory_mem = cf.mem.get_mems(MemoryElement.TYPE_TRAJ)[0]
+    trajectory_mem.poly4Ds = [
+        Poly4D(piece.duration, *[Poly4D.Poly(list(c)) for c in piece.coefficients])
+        for piece in pieces]
+
+    written = threading.Event()
+    failed = []
+
+    def write_failed(mem, addr):
+        failed.append(addr)
+        written.set()
+
+    # cflib 0.1.8, which default.nix installs, only takes the callback for a
+    # finished write, so a failure there shows up as the timeout. Newer
+    # versions also report a failure, which is raised straight away
+    if 'write_failed_cb' in inspect.signature(trajectory_mem.write_data).parameters:
+        trajectory_mem.write_data(lambda mem, addr: written.set(), write_failed)
+    else:
+        trajectory_mem.write_data(lambda mem, addr: written.set())
+    if not written.wait(10):
+        raise TrajectoryUploadError("Timed out uploading the trajectory")
+    if failed:
+        raise TrajectoryUploadError("Writing the trajectory failed at address {}"
+                                    .format(failed[0]))
+
+    cf.high_level_commander.define_trajectory(trajectory_id, 0, len(pieces))
+    return sum(piece.duration for piece in pieces)
@@ -0,0 +1,157 @@
+"""
+This module spreads the drones of a swarm over the radios available.
+
+A uri like radio://0/80/2M/A0A0A0A0AA says which Crazyradio dongle (0), which
+channel (80) and which data rate (2M) to reach the drone at address
+A0A0A0A0AA with. The demos give every drone the same dongle and channel, so
+every setpoint and log packet of the whole swarm goes through one radio, and
+it soon runs out of packets per second as the swarm grows.
+
+plan_radios takes the addresses of the drones and the dongles and channels
+available, and gives each drone a radio so the packets are spread evenly.
+Each dongle is kept on its own channel where there are enough channels, as
+two dongles on one channel talk over each other. The drones with the most
+traffic are placed first, each on the least busy radio.
+
+Use like the following:
+
+radio_plan = plan_radios(uris, dongles=[0, 1], channels=[80, 60],
+                         setpoint_rate=SETPOINT_RATE)
+radio_plan.print_report()
+uris = radio_plan.rewrite(uris)
+names = radio_plan.rewrite(names)
+"""
+from collections import namedtuple
+
+# Roughly how many packets per second one Crazyradio can exchange with the
+# drones at 2M. Each packet is a round trip over USB and the air
+RADIO_CAPACITY = 1000
+
+# A dongle on a channel, at a data rate
+Radio = namedtuple('Radio', 'dongle channel datarate')
+
+
+def parse_uri(uri):
+    """
+    Splits a uri into its scheme, Radio and address, like
+    radio://0/80/2M/A0A0A0A0AA -> ('radio://', Radio(0, 80, '2M'), 'A0A0A0A0AA')
+    """
+    scheme, rest = uri.split('://', 1)
+    parts = rest.split('/')
+    if len(parts) != 4:
+        raise ValueError("Expected a uri like radio://0/80/2M/A0A0A0A0AA, not " + uri)
+    dongle, channel, datarate, address = parts
+    return scheme + '://', Radio(int(dongle), int(channel), datarate), address
+
+
+def make_uri(scheme, radio, address):
+    return '{}{}/{}/{}/{}'.format(scheme, radio.dongle, radio.channel, radio.datarate, address)
+
+
+class RadioPlan:
+    """
+    Which radio each drone is reached through
+
+    :param uris: a dictionary of the original uri to the new one
+    :param loads: a dictionary of uri to how many packets per second that
+                  drone needs
+    :param capacity: How many packets per second a radio can carry
+    """
+
+    def __init__(self, uris, loads, capacity=RADIO_CAPACITY):
+        self.uris = uris
+        self.loads = loads
+        self.capacity = capacity
+
+    def rewrite(self, uris):
+        """
+        Swaps the uris in a set, list or dictionary (like positions and names)
+        for the planned ones. Uris that are not in the plan are left as they are
+        """
+        if isinstance(uris, dict):
+            return {self.uris.get(uri, uri): value for uri, value in uris.items()}
+        return type(uris)(self.uris.get(uri, uri) for uri in uris)
+
+    def radios(self):
+        """ A dictionary of Radio to the planned uris reached through it """
+        radios = {}
+        for uri in self.uris.values():
+            radios.setdefault(parse_uri(uri)[1], []).append(uri)
+        return radios
+
+    def radio_rates(self):
+        """ A dictionary of Radio to the packets per second it is expected to carry """
+        return {radio: sum(self.loads[uri] for uri in uris)
+                for radio, uris in self.radios().items()}
+
+    def dongle_rates(self):
+        """
+        A dictionary of dongle to packets per second. A dongle serving more
+        than one channel shares its packets between them
+        """
+        rates = {}
+        for radio, rate in self.radio_rates().items():
+            rates[radio.dongle] = rates.get(radio.dongle, 0) + rate
+        return rates
+
+    def print_report(self):
+        """
+        Prints the drones on each radio and the packet rate expected on each
+        dongle, warning about any that are over capacity
+        """
+        for radio, uris in sorted(self.radios().items()):
+            print("radio {} channel {} at {}: {} drones, {:.0f} packets/s".format(
+                radio.dongle, radio.channel, radio.datarate, len(uris),
+                sum(self.loads[uri] for uri in uris)))
+            for uri in sorted(uris):
+                print("  " + uri)
+        for dongle, rate in sorted(self.dongle_rates().items()):
+            usage = rate / self.capacity
+            warning = " (over capacity, add another radio)" if usage > 1 else ""
+            print("radio {}: {:.0f} of about {} packets/s, {:.0%}{}".format(
+                dongle, rate, self.capacity, usage, warning))
+
+
+def plan_radios(uris, dongles=(0,), channels=(80,), datarate='2M',
+                setpoint_rate=20, log_rate=10, capacity=RADIO_CAPACITY):
+    """
+    Spreads drones over the radios available
+
+    :param uris: The uris of the drones. Only their addresses (and scheme) are
+                 kept, so these can be the ones hard coded in a demo
+    :param dongles: The Crazyradio dongles to use, by number
+    :param channels: The channels to use. Dongles take them in turn, so
+                     give at least as many as dongles, well spread apart
+    :param datarate: The data rate of every radio
+    :param setpoint_rate: How many setpoints are sent to each drone per second,
+                          either one rate for all or a dictionary by uri
+    :param log_rate: How many log packets each drone sends per second (a block
+                     logged every 100ms is 10), one rate or a dictionary by uri
+    :param capacity: How many packets per second a radio can carry
+    :return: a RadioPlan
+    """
+    if not dongles or not channels:
+        raise ValueError("At least one dongle and one channel are needed")
+    if len(channels) < len(dongles):
+        print("Only {} channels for {} radios, some radios will share a channel"
+              .format(len(channels), len(dongles)))
+
+    def rate(rates, uri):
+        return rates.get(uri, 0) if isinstance(rates, dict) else rates
+
+    radios = [Radio(dongle, channels[i % len(channels)], datarate)
+              for i, dongle in enumerate(dongles)]
+    loads = {uri: rate(setpoint_rate, uri) + rate(log_rate, uri) for uri in uris}
+
+    radio_loads = [0] * len(radios)
+    planned = {}
+    planned_loads = {}
+    # The busiest drones first, each to the least busy radio. Ties go by
+    # address so the plan is the same every run
+    for uri in sorted(uris, key=lambda uri: (-loads[uri], parse_uri(uri)[2])):
+        scheme, _, address = parse_uri(uri)
+        least = min(range(len(radios)), key=lambda i: radio_loads[i])
+        radio_loads[least] += loads[uri]
+        planned[uri] = make_uri(scheme, radios[least], address)
+        planned_loads[planned[uri]] = loads[uri]
+    return RadioPlan(planned, planned_loads, capacity)
@@ -0,0 +1,183 @@
+"""
+This module plays back a recording made with cfdemos.telemetry, so the demos
+that show or react to telemetry can be run without a drone or SteamVR.
+
+Each recorded sample is passed to the callbacks added for its drone (or
+tracker) and block, the same way cflib calls a log block's
+data_received_cb:
+
+callback(timestamp, data, block)
+
+where data is a dictionary of variable name to value, and block is the
+cfdemos.telemetry.Block it was recorded in. A callback written for a live log
+block, like position_callback in plotlocation.py, can be added as it is.
+
+The recording can be played at the speed it was recorded (speed 1), faster
+(speed 10) or as fast as possible (speed None). Either start plays it from a
+thread, sleeping until each sample is due, or the demo calls advance itself,
+such as once per frame of an animation, which plays whatever was recorded in
+that much time.
+
+Use like the following:
+
+replay = Replay(read_telemetry('flight.telemetry'), speed=10)
+replay.add_callback(uri, 'state', position_callback)
+replay.start()
+"""
+import threading
+import time
+
+import numpy as np
+
+# How far ahead a sample has to be to sleep until it is due, in seconds.
+# Closer ones are played straight away, as sleeping that little is not
+# accurate anyway
+MIN_SLEEP = 0.001
+
+
+def parse_speed(text):
+    """ A --speed argument: a number, or max for as fast as possible (None) """
+    if text == 'max':
+        return None
+    speed = float(text)
+    if speed <= 0:
+        raise ValueError("The speed must be above 0")
+    return speed
+
+
+def add_replay_arguments(parser):
+    """ Adds --replay and --speed to a demo's argparse parser """
+    parser.add_argument('--replay', metavar='FILE',
+                        help='play a recording made with cfdemos.telemetry instead')
+    parser.add_argument('--speed', type=parse_speed, default=1,
+                        help='how many times faster than recorded to replay, or max')
+
+
+class Replay:
+    """
+    Plays back a recording to callbacks
+
+    :param telemetry: The cfdemos.telemetry.Telemetry to play
+    :param speed: How many times faster than recorded to play, None for as
+                  fast as possible
+    :param report: Whether to print how fast it played once it is done
+    """
+
+    def __init__(self, telemetry, speed=1.0, report=True):
+        self.telemetry = telemetry
+        self.speed = speed
+        self.report = report
+        self.callbacks = {}
+        # The index of the next record to play, and how far into the
+        # recording it has been played in seconds
+        self.position = 0
+        self.time = 0.0
+        self.played = 0
+        # How long playing took in seconds, from the first sample to the last
+        self.elapsed = None
+        self._started = None
+        received = telemetry.records['received']
+        self._times = received - received[0] if len(received) else received
+        self._stopped = False
+        self._thread = None
+
+    def duration(self):
+        """ How long the recording is in seconds """
+        return float(self._times[-1]) if len(self._times) else 0.0
+
+    def finished(self):
+        return self.position >= len(self._times)
+
+    def add_callback(self, uri, block, callback):
+        """
+        Calls callback(timestamp, data, block) with every sample of one block
+        of one drone
+
+        :param uri: The uri of the drone, or the name of a tracker
+        :param block: The name of the block
+        """
+        key = (self.telemetry.uris.index(uri), self.telemetry.block_index(block))
+        self.callbacks.setdefault(key, []).append(callback)
+
+    def _play(self, end):
+        """ Plays the records from position up to end """
+        records = self.telemetry.records[self.position:end]
+        self.position = end
+        if not self.callbacks:
+            return
+        # Only the records that have callbacks, as lists so that each sample
+        # is not looked up in NumPy one field at a time
+        keys = records['drone'].astype(int) * len(self.telemetry.blocks) + records['block']
+        wanted = [drone * len(self.telemetry.blocks) + block for drone, block in self.callbacks]
+        records = records[np.isin(keys, wanted)]
+        for drone, block, timestamp, values in zip(records['drone'].tolist(),
+                                                   records['block'].tolist(),
+                                                   records['timestamp'].tolist(),
+                                                   records['values'].tolist()):
+            recorded = self.telemetry.blocks[block]
+            data = dict(zip(recorded.variables, values))
+            for callback in self.callbacks[(drone, block)]:
+                callback(timestamp, data, recorded)
+            self.played += 1
+
+    def play_until(self, t):
+        """
+        Plays what was recorded up to t seconds into the recording
+
+        :return: whether there is any of the recording left
+        """
+        if self._started is None:
+            self._started = time.monotonic()
+        if self.finished():
+            return False
+        self.time = max(self.time, t)
+        self._play(int(np.searchsorted(self._times, self.time, side='right')))
+        if self.finished():
+            self.elapsed = time.monotonic() - self._started
+            if self.report:
+                self.print_report()
+            return False
+        return True
+
+    def advance(self, seconds):
+        """ Plays what was recorded in the next seconds of the recording, see play_until """
+        return self.play_until(self.time + seconds)
+
+    def run(self):
+        """
+        Plays the rest of the recording at speed, returning when it is done
+        or stopped
+        """
+        start = time.monotonic()
+        if self._started is None:
+            self._started = start
+        offset = self.time
+        while not self._stopped and not self.finished():
+            if self.speed is None:
+                self.play_until(self.duration())
+                break
+            due = offset + (time.monotonic() - start) * self.speed
+            ahead = (self._times[self.position] - due) / self.speed
+            if ahead > MIN_SLEEP:
+                time.sleep(ahead)
+                due = offset + (time.monotonic() - start) * self.speed
+            self.play_until(max(due, self._times[self.position]))
+
+    def start(self):
+        """ Plays the recording from a thread, see run """
+        self._stopped = False
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stops playing from the thread """
+        self._stopped = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def print_report(self):
+        """ Prints how much was played, and how fast """
+        elapsed = self.elapsed if self.elapsed is not None else time.monotonic() - self._started
+        print("Replayed {} samples, {:.1f}s of recording in {:.2f}s ({:.1f}x)".format(
+            self.played, self.time, elapsed, self.time / elapsed if elapsed else float('inf')))
@@ -0,0 +1,293 @@
+"""
+This module contains statistics over a rolling window of the most recent
+values of a signal, such as the kalman variance of a drone.
+
+Every statistic is kept up to date as values come in, so pushing a value and
+reading the min, max, mean or variance all take constant time no matter how
+large the window is. Percentiles (RollingPercentiles) take time that grows
+with the logarithm of the size of the window.
+"""
+import math
+import random
+from collections import deque
+
+
+class RollingWindow:
+    """
+    The min, max, mean and variance of the last `size` values pushed.
+
+    The min and max are kept with monotonic deques: each holds the values in
+    the window that could still become the min (or max) once the values
+    before them leave the window. The mean and variance are updated with
+    Welford's algorithm, adding the new value and removing the old one.
+
+    use like the following:
+
+    window = RollingWindow(10)
+    for value in values:
+        window.push(value)
+        if window.full() and window.range() < 0.001:
+            break
+    """
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("Window size must be at least 1")
+        self.size = size
+        self._values = deque()
+        # (index, value) pairs, increasing values in _mins and decreasing in _maxs
+        self._mins = deque()
+        self._maxs = deque()
+        self._index = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def push(self, value):
+        """
+        Adds a value to the window, removing the oldest one if the window is full
+        """
+        index = self._index
+        self._index += 1
+
+        while self._mins and self._mins[-1][1] >= value:
+            self._mins.pop()
+        self._mins.append((index, value))
+        while self._maxs and self._maxs[-1][1] <= value:
+            self._maxs.pop()
+        self._maxs.append((index, value))
+
+        self._values.append(value)
+        if len(self._values) > self.size:
+            old = self._values.popleft()
+            oldest = index - self.size
+            if self._mins[0][0] <= oldest:
+                self._mins.popleft()
+            if self._maxs[0][0] <= oldest:
+                self._maxs.popleft()
+            mean = self._mean + (value - old) / self.size
+            self._m2 += (value - old) * (value - mean + old - self._mean)
+            self._mean = mean
+        else:
+            n = len(self._values)
+            delta = value - self._mean
+            self._mean += delta / n
+            self._m2 += delta * (value - self._mean)
+
+    def __len__(self):
+        return len(self._values)
+
+    def full(self):
+        """ Whether the window holds `size` values yet """
+        return len(self._values) == self.size
+
+    def min(self):
+        return self._mins[0][1]
+
+    def max(self):
+        return self._maxs[0][1]
+
+    def range(self):
+        """ The difference between the largest and smallest value in the window """
+        return self._maxs[0][1] - self._mins[0][1]
+
+    def mean(self):
+        return self._mean
+
+    def variance(self):
+        """ The population variance of the values in the window """
+        if not self._values:
+            return 0.0
+        # Rounding can leave a tiny negative number when all values are equal
+        return max(self._m2 / len(self._values), 0.0)
+
+
+class Convergence:
+    """
+    Detects when a set of signals has settled, meaning that each of them has
+    varied by less than threshold over the last `window` values.
+
+    This is how the position estimator is judged to have found its position,
+    with the signals being the kalman variance in x, y and z.
+
+    :param names: The names of the signals, as in the log data
+    :param window: How many values each signal has to be settled for
+    :param threshold: How much each signal can vary within the window
+    """
+
+    def __init__(self, names, window=10, threshold=0.001):
+        self.threshold = threshold
+        self.windows = {name: RollingWindow(window) for name in names}
+
+    def update(self, data):
+        """
+        Adds the latest values of the signals
+
+        :param data: a dictionary containing a value for every signal, such as
+                     the data of a log entry
+        :return: whether all of the signals have settled
+        """
+        converged = True
+        for name, window in self.windows.items():
+            window.push(data[name])
+            if not window.full() or window.range() >= self.threshold:
+                converged = False
+        return converged
+
+
+class _Node:
+    """ A value in a _SortedWindow, linked to the next node on each level """
+    __slots__ = ('value', 'next', 'width')
+
+    def __init__(self, value, levels):
+        self.value = value
+        self.next = [None] * levels
+        # How many values each link skips over, counting the one it lands on
+        self.width = [1] * levels
+
+
+class _SortedWindow:
+    """
+    Values kept in order, in an indexable skip list: adding one, removing one
+    and finding the one at an index all take O(log n).
+
+    Each node is linked to the next one on the bottom level, and on the
+    levels above to nodes further and further along, chosen at random with
+    half as many on each level as on the one below. Each link knows how many
+    values it skips, so the value at an index is found by taking the longest
+    links that do not go past it.
+
+    :param size: The most values it holds, which sets how many levels it has
+    """
+
+    def __init__(self, size):
+        self.levels = max(int(math.log2(max(size, 1))) + 1, 1)
+        # The end of every level, found by identity so any value can be held
+        self._end = _Node(None, 0)
+        self._head = _Node(None, self.levels)
+        self._head.next = [self._end] * self.levels
+        self._random = random.Random(0)
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._len:
+            raise IndexError("Index {} out of range".format(index))
+        node = self._head
+        # Counting the head as position 0
+        remaining = index + 1
+        for level in reversed(range(self.levels)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node.value
+
+    def insert(self, value):
+        # The last node before value on each level, and how far along it is
+        before = [None] * self.levels
+        steps = [0] * self.levels
+        node = self._head
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not self._end and node.next[level].value <= value:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            before[level] = node
+
+        # Each level up has half the chance of the one below
+        height = 1
+        while height < self.levels and self._random.random() < 0.5:
+            height += 1
+        new = _Node(value, height)
+        skipped = 0
+        for level in range(height):
+            previous = before[level]
+            new.next[level] = previous.next[level]
+            previous.next[level] = new
+            new.width[level] = previous.width[level] - skipped
+            previous.width[level] = skipped + 1
+            skipped += steps[level]
+        for level in range(height, self.levels):
+            before[level].width[level] += 1
+        self._len += 1
+
+    def remove(self, value):
+        before = [None] * self.levels
+        node = self._head
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not self._end and node.next[level].value < value:
+                node = node.next[level]
+            before[level] = node
+        removed = before[0].next[0]
+        if removed is self._end or removed.value != value:
+            raise KeyError("{} is not in the window".format(value))
+        for level in range(len(removed.next)):
+            previous = before[level]
+            previous.width[level] += removed.width[level] - 1
+            previous.next[level] = removed.next[level]
+        for level in range(len(removed.next), self.levels):
+            before[level].width[level] -= 1
+        self._len -= 1
+
+
+class RollingPercentiles:
+    """
+    Percentiles of the last `size` values pushed, like the 5th and 95th to
+    find the range a signal usually stays within, ignoring the odd value far
+    outside it.
+
+    The values in the window are kept both in the order they came, to know
+    which to remove, and sorted, in a skip list, so pushing a value and
+    reading a percentile take O(log size) rather than sorting the window.
+
+    use like the following:
+
+    window = RollingPercentiles(300)
+    for value in values:
+        window.push(value)
+        low, high = window.percentile(5), window.percentile(95)
+    """
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("Window size must be at least 1")
+        self.size = size
+        self._values = deque()
+        self._sorted = _SortedWindow(size)
+
+    def push(self, value):
+        """
+        Adds a value to the window, removing the oldest one if the window is full
+
+        :raises ValueError: if value is NaN or infinite, which cannot be put
+                            in order, leaving the window as it was
+        """
+        if not math.isfinite(value):
+            raise ValueError("{} cannot be added to the window".format(value))
+        self._values.append(value)
+        self._sorted.insert(value)
+        if len(self._values) > self.size:
+            self._sorted.remove(self._values.popleft())
+
+    def __len__(self):
+        return len(self._values)
+
+    def full(self):
+        """ Whether the window holds `size` values yet """
+        return len(self._values) == self.size
+
+    def percentile(self, percent):
+        """
+        The value below which percent of the window lies, interpolating
+        between the two values either side of it
+
+        :param percent: From 0 (the min) to 100 (the max)
+        """
+        if not self._values:
+            raise ValueError("The window is empty")
+        position = percent / 100 * (len(self._sorted) - 1)
+        below = int(position)
+        value = self._sorted[below]
+        if below + 1 < len(self._sorted):
+            value += (position - below) * (self._sorted[below + 1] - value)
+        return value
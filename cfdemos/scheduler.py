@@ -0,0 +1,179 @@
+"""
+This module contains a scheduler for streaming setpoints to a drone at a
+fixed rate.
+
+The demos used to pace setpoints by sleeping after every send, like
+
+for i in range(20):
+    cf.commander.send_position_setpoint(0, 0, 1, 0)
+    time.sleep(0.2)
+
+This sends less often than intended, because the time taken to send is added
+to every sleep, and the error builds up over the sequence. Instead the
+scheduler works out when every tick is due from the monotonic clock when it
+started, and sleeps until then. If a tick is late, the next one is still due
+at its original time, and ticks that have been missed completely are skipped
+rather than sent in a burst.
+
+Use like the following:
+
+scheduler = Scheduler(rate=20, name=scf.cf.link_uri)
+for t in scheduler.ticks(4):
+    cf.commander.send_position_setpoint(0, 0, t / 4, 0)
+
+The ticks are given as the time in seconds since the start of the sequence,
+so that the same sequence can be flown at any rate. In a coroutine, use
+async_ticks instead, like
+
+async for t in scheduler.async_ticks(4):
+    cf.commander.send_position_setpoint(0, 0, t / 4, 0)
+"""
+import asyncio
+import math
+import time
+
+# The fastest rate setpoints can be sent at, in Hz
+MAX_RATE = 100
+
+# The statistics of every named scheduler, keyed by name. See print_stats
+stats = {}
+
+
+class TickStats:
+    """
+    How well a scheduler is keeping to its rate.
+
+    Jitter is how long after its deadline a tick actually ran.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.ticks = 0
+        self.skipped = 0
+        self.late = 0
+        self.max_jitter = 0.0
+        self._jitter_sum = 0.0
+        self._jitter_squared_sum = 0.0
+
+    def record(self, jitter, late):
+        self.ticks += 1
+        self._jitter_sum += jitter
+        self._jitter_squared_sum += jitter * jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+        if late:
+            self.late += 1
+
+    def mean_jitter(self):
+        if self.ticks == 0:
+            return 0.0
+        return self._jitter_sum / self.ticks
+
+    def jitter_deviation(self):
+        if self.ticks == 0:
+            return 0.0
+        mean = self.mean_jitter()
+        return math.sqrt(max(self._jitter_squared_sum / self.ticks - mean * mean, 0.0))
+
+    def __str__(self):
+        return ("{} ticks at {}Hz, {} late, {} skipped, jitter mean {:.2f}ms "
+                "sd {:.2f}ms max {:.2f}ms").format(
+                    self.ticks, self.rate, self.late, self.skipped,
+                    self.mean_jitter() * 1000, self.jitter_deviation() * 1000,
+                    self.max_jitter * 1000)
+
+
+class Scheduler:
+    """
+    Runs ticks at a fixed rate against deadlines on the monotonic clock.
+
+    Successive calls to ticks carry on from each other, so the last tick of
+    one sequence is held for a full period before the next sequence starts.
+
+    :param rate: How many ticks per second, up to MAX_RATE
+    :param name: If given, the stats are kept in stats under this name (the
+                 uri of the drone is a good choice)
+    :param overrun: How late a tick can be, as a fraction of the period, before
+                    it counts as late
+    """
+
+    def __init__(self, rate=20, name=None, overrun=0.5):
+        if rate <= 0 or rate > MAX_RATE:
+            raise ValueError("Rate must be between 0 and {}Hz".format(MAX_RATE))
+        self.rate = rate
+        self.period = 1 / rate
+        self.overrun = overrun
+        self.stats = TickStats(rate)
+        if name is not None:
+            stats[name] = self.stats
+        self._start = None
+        self._tick = 0
+        self._first = 0
+
+    def ticks(self, duration=None):
+        """
+        Yields once per tick for duration seconds, with the time since the
+        first tick of this sequence.
+
+        If the code run on a tick takes longer than a period, the ticks that
+        were missed are skipped.
+
+        :param duration: How long the sequence lasts in seconds, or None to
+                         go on until the loop is broken out of
+        """
+        end = self._begin(duration)
+        while self._tick < end:
+            delay = self._delay()
+            if delay > 0:
+                time.sleep(delay)
+            yield self._run_tick()
+            self._advance(end)
+
+    async def async_ticks(self, duration=None):
+        """
+        The same as ticks, but waits for each tick with asyncio, so that many
+        drones can be paced on one event loop. Use with async for
+        """
+        end = self._begin(duration)
+        while self._tick < end:
+            delay = self._delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield self._run_tick()
+            self._advance(end)
+
+    def _begin(self, duration):
+        """ Starts a sequence, returning the tick it ends before """
+        if self._start is None:
+            self._start = time.monotonic()
+        self._first = self._tick
+        if duration is None:
+            return math.inf
+        return self._tick + int(round(duration * self.rate))
+
+    def _deadline(self):
+        return self._start + self._tick * self.period
+
+    def _delay(self):
+        """ How long until the next tick is due """
+        return self._deadline() - time.monotonic()
+
+    def _run_tick(self):
+        """ Records how late the tick is, returning its time in the sequence """
+        jitter = max(time.monotonic() - self._deadline(), 0.0)
+        self.stats.record(jitter, jitter > self.period * self.overrun)
+        return (self._tick - self._first) * self.period
+
+    def _advance(self, end):
+        """ Moves on to the latest tick that is already due, skipping any before it """
+        due = int((time.monotonic() - self._start) / self.period)
+        next_tick = min(max(self._tick + 1, due), end)
+        self.stats.skipped += next_tick - self._tick - 1
+        self._tick = next_tick
+
+
+def print_stats():
+    """
+    Prints the statistics of every named scheduler
+    """
+    for name, tick_stats in sorted(stats.items()):
+        print("{}: {}".format(name, tick_stats))
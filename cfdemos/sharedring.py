@@ -0,0 +1,117 @@
+"""
+This module passes samples from one process to another through a ring buffer
+in shared memory.
+
+It is used to draw plots in a process of their own, so that however long the
+plot takes to draw, the process flying the drone is never held up by it.
+Writing a sample copies a row of floats into the shared memory and counts it,
+with no locks, pickling or pipes, so the writer always takes the same short
+time. There is one writer. Any number of readers can look at the latest rows
+whenever they like, and if the writer is faster than them, the oldest rows
+they have not read are overwritten.
+
+The memory is a multiprocessing.RawArray, which has no lock, so the ring
+works back to Python 3.7 (multiprocessing.shared_memory needs 3.8). Like a
+multiprocessing.Queue, it is shared by passing the ring to the Process that
+reads it, rather than by name.
+
+Use like the following:
+
+ring = SharedRing(['time', 'distance'])
+process = multiprocessing.Process(target=plot, args=(ring,))
+process.start()
+ring.push([t, d])
+
+and in the other process
+
+rows = ring.latest(100)
+"""
+import ctypes
+import multiprocessing
+
+import numpy as np
+
+# How many rows a ring holds by default
+RING_CAPACITY = 4096
+
+
+class SharedRing:
+    """
+    A ring buffer of rows of floats in shared memory
+
+    :param columns: The names of the values in each row
+    :param capacity: How many rows the ring holds before they are overwritten
+    """
+
+    def __init__(self, columns, capacity=RING_CAPACITY):
+        self.columns = list(columns)
+        self.capacity = capacity
+        # How many rows have been pushed, and the rows
+        self._memory = (multiprocessing.RawArray(ctypes.c_int64, 1),
+                        multiprocessing.RawArray(ctypes.c_double, capacity * len(self.columns)))
+        self._view()
+
+    def _view(self):
+        count, rows = self._memory
+        self._count = np.frombuffer(count, dtype=np.int64)
+        self._rows = np.frombuffer(rows, dtype=np.float64).reshape(self.capacity,
+                                                                   len(self.columns))
+
+    def __getstate__(self):
+        # Only the arrays are sent to the other process, which views them again
+        return self.columns, self.capacity, self._memory
+
+    def __setstate__(self, state):
+        self.columns, self.capacity, self._memory = state
+        self._view()
+
+    def count(self):
+        """ How many rows have been pushed, ever """
+        return int(self._count[0])
+
+    def push(self, values):
+        """
+        Adds a row, overwriting the oldest once the ring is full. Only one
+        process may push
+
+        :param values: a value for every column, in order
+        """
+        count = int(self._count[0])
+        self._rows[count % self.capacity] = values
+        # Counted only once it is written, so readers never see half a row
+        self._count[0] = count + 1
+
+    def read(self, since=0):
+        """
+        The rows pushed since a count, or as many of them as are still in the
+        ring
+
+        :param since: The count returned by the last read, 0 for everything
+        :return: an array of shape (rows, columns), and the count to read
+                 from next time
+        """
+        count = int(self._count[0])
+        start = max(since, count - self.capacity)
+        rows = self._rows[np.arange(start, count) % self.capacity]
+        # The writer may have come round to the oldest rows while they were
+        # copied, including the one it is writing now
+        overwritten = int(self._count[0]) + 1 - self.capacity
+        if overwritten > start:
+            rows = rows[overwritten - start:]
+        return rows, count
+
+    def latest(self, n):
+        """ The last n rows pushed, or fewer if there are not that many """
+        return self.read(max(self.count() - n, 0))[0]
+
+    def column(self, rows, name):
+        """ One column of rows from read or latest, by name """
+        return rows[:, self.columns.index(name)]
+
+    def close(self):
+        """
+        Stops using the ring. The memory is freed once no process uses it
+        """
+        self._count = None
+        self._rows = None
+        self._memory = None
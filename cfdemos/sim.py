@@ -0,0 +1,797 @@
+"""
+This module contains a simulated Crazyflie, so that the demos can be run,
+profiled and tested on a computer without any radios or drones.
+
+The simulated objects have the same names and methods as the parts of cflib
+that the demos use (SyncCrazyflie, Crazyflie, commander, high level commander,
+param, log with LogConfig and SyncLogger, the LED memory and the console).
+Their signatures are those of cflib 0.1.8, the version cflib.nix installs,
+so a demo that calls a newer cflib API fails in the simulation too.
+Simulated drones are selected with a sim:// uri, like
+
+sim://0/80/2M/A0A0A0A0AA
+
+cfdemos.util.connect and cfdemos.util.CfFactory construct simulated drones for
+these uris, so the demos only need their uris changed. Setting the CFDEMOS_SIM
+environment variable simulates every uri instead.
+
+The drone itself is a point mass that is pulled towards its setpoint by a
+critically damped controller. The kalman variance starts high on a reset and
+decays towards a small noise floor, which is roughly what the lighthouse
+estimator does.
+
+Time in the simulation runs off a clock that can be sped up. To benchmark a
+whole demo faster than real time, run it through this module:
+
+python -m cfdemos.sim --speedup 20 cfdemos/tetrahedron.py
+
+which simulates every uri and makes time.sleep and time.time follow the
+simulation clock, as well as asyncio's event loop.
+"""
+import asyncio
+import math
+import os
+import queue
+import random
+import runpy
+import selectors
+import sys
+import threading
+import time
+import zlib
+
+# The real time functions. These are kept so that the clock still works when
+# run() replaces the ones in the time module.
+_real_sleep = time.sleep
+_real_monotonic = time.monotonic
+_real_time = time.time
+_real_perf_counter = time.perf_counter
+
+SIM_SCHEME = 'sim://'
+SIM_ENV = 'CFDEMOS_SIM'
+
+# Physics constants
+STEP = 0.005
+POSITION_GAIN = 16.0
+VELOCITY_GAIN = 8.0
+MAX_ACCELERATION = 15.0
+MAX_VELOCITY = 2.0
+GRAVITY = 9.81
+# The firmware stops the motors if it stops receiving setpoints
+SETPOINT_TIMEOUT = 2.0
+
+# Kalman variance model
+VARIANCE_START = 1.0
+VARIANCE_FLOOR = 0.0001
+VARIANCE_DECAY = 0.4
+POSITION_NOISE = 0.002
+
+# Battery model
+BATTERY_FULL = 4.15
+BATTERY_DRAIN = 0.002
+
+
+class SimClock:
+    """
+    The clock that the simulation runs off.
+
+    The simulation runs speedup times faster than real time. Sleeping on this
+    clock sleeps for the equivalent simulated time.
+    """
+
+    def __init__(self, speedup=1):
+        self._lock = threading.Lock()
+        self._real_start = _real_monotonic()
+        self._sim_start = 0.0
+        self.speedup = speedup
+
+    def time(self):
+        """ The simulated time in seconds """
+        return self._sim_start + (_real_monotonic() - self._real_start) * self.speedup
+
+    def sleep(self, seconds):
+        """ Sleeps for the given number of simulated seconds """
+        if seconds > 0:
+            _real_sleep(seconds / self.speedup)
+
+    def set_speedup(self, speedup):
+        """ Changes the speedup without making the simulated time jump """
+        with self._lock:
+            now = self.time()
+            self._real_start = _real_monotonic()
+            self._sim_start = now
+            self.speedup = speedup
+
+
+clock = SimClock()
+
+
+class _SimSelector(selectors.DefaultSelector):
+    """
+    Waits for simulated rather than real seconds. asyncio's event loop waits
+    for its next timer in select, and already reads the time from
+    time.monotonic
+    """
+
+    def select(self, timeout=None):
+        if timeout is not None and timeout > 0:
+            timeout = timeout / clock.speedup
+        return super().select(timeout)
+
+
+class SimEventLoopPolicy(asyncio.DefaultEventLoopPolicy):
+    """ Makes event loops that run off the simulation clock """
+
+    def new_event_loop(self):
+        return asyncio.SelectorEventLoop(_SimSelector())
+
+
+def is_sim_uri(uri):
+    """ Returns whether uri addresses a simulated drone """
+    return uri.startswith(SIM_SCHEME)
+
+
+def enabled():
+    """ Returns whether every uri should be simulated (CFDEMOS_SIM is set) """
+    return os.environ.get(SIM_ENV, '') not in ('', '0')
+
+
+def simulated_uri(uri):
+    """
+    Turns a radio uri into the sim uri of the same drone, like
+    radio://0/80/2M/A0A0A0A0AA -> sim://0/80/2M/A0A0A0A0AA
+    """
+    if is_sim_uri(uri):
+        return uri
+    return SIM_SCHEME + uri.split('://', 1)[-1]
+
+
+def start_position(uri):
+    """
+    Where a simulated drone starts on the floor.
+
+    Drones are spread over a 4x4 grid with 0.5m spacing, picked from their uri
+    so that the same drone always starts in the same place.
+    """
+    slot = zlib.crc32(uri.split('://', 1)[-1].encode()) % 16
+    return [(slot % 4 - 1.5) * 0.5, (slot // 4 - 1.5) * 0.5, 0.0]
+
+
+class Caller:
+    """ The same as cflib.utils.callbacks.Caller """
+
+    def __init__(self):
+        self.callbacks = []
+
+    def add_callback(self, cb):
+        if cb not in self.callbacks:
+            self.callbacks.append(cb)
+
+    def remove_callback(self, cb):
+        self.callbacks.remove(cb)
+
+    def call(self, *args):
+        for cb in list(self.callbacks):
+            cb(*args)
+
+
+class _Physics:
+    """
+    The state of a simulated drone.
+
+    The state is integrated lazily, whenever it is looked at it is first
+    brought up to the current simulated time.
+    """
+
+    def __init__(self, position, clock):
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.time = clock.time()
+        self.position = list(position)
+        self.velocity = [0.0, 0.0, 0.0]
+        self.yaw = 0.0
+        self.vbat = BATTERY_FULL
+        # The low level setpoint, either ('position', [x, y, z]) or
+        # ('velocity', [vx, vy, vz]), and when it was last sent
+        self.setpoint = None
+        self.setpoint_time = -math.inf
+        # A function of time returning the high level commander position
+        self.plan = None
+        self.reset_time = self.time
+
+    def update(self):
+        now = self.clock.time()
+        with self.lock:
+            while self.time + STEP <= now:
+                self._step(STEP)
+                self.time += STEP
+
+    def _target(self):
+        """ The position and velocity the controller is trying to reach """
+        if self.setpoint is not None and self.time - self.setpoint_time < SETPOINT_TIMEOUT:
+            mode, value = self.setpoint
+            if mode == 'position':
+                return value, [0.0, 0.0, 0.0]
+            if mode == 'velocity':
+                return None, value
+            if mode == 'stop':
+                return None, None
+        if self.plan is not None:
+            return self.plan(self.time), [0.0, 0.0, 0.0]
+        return None, None
+
+    def _step(self, dt):
+        position, velocity = self._target()
+        if velocity is None:
+            # Motors off, fall to the ground
+            acceleration = [0.0, 0.0, -GRAVITY]
+        else:
+            acceleration = []
+            for i in range(3):
+                a = VELOCITY_GAIN * (velocity[i] - self.velocity[i])
+                if position is not None:
+                    a += POSITION_GAIN * (position[i] - self.position[i])
+                acceleration.append(a)
+            norm = math.sqrt(sum(a * a for a in acceleration))
+            if norm > MAX_ACCELERATION:
+                acceleration = [a * MAX_ACCELERATION / norm for a in acceleration]
+            self.vbat -= BATTERY_DRAIN * dt
+
+        for i in range(3):
+            self.velocity[i] += acceleration[i] * dt
+        speed = math.sqrt(sum(v * v for v in self.velocity))
+        if speed > MAX_VELOCITY:
+            self.velocity = [v * MAX_VELOCITY / speed for v in self.velocity]
+        for i in range(3):
+            self.position[i] += self.velocity[i] * dt
+
+        if self.position[2] <= 0 and self.velocity[2] <= 0:
+            self.position[2] = 0.0
+            self.velocity = [0.0, 0.0, 0.0]
+
+    def variance(self):
+        """ The kalman position variance, for one axis """
+        since_reset = self.time - self.reset_time
+        decay = VARIANCE_START * math.exp(-since_reset / VARIANCE_DECAY)
+        return VARIANCE_FLOOR * (1 + 0.05 * random.gauss(0, 1)) + decay
+
+    def estimate(self, axis):
+        """ The kalman position estimate, for one axis """
+        return self.position[axis] + random.gauss(0, POSITION_NOISE)
+
+    def target(self, axis):
+        """ The position the controller is flying to, for one axis """
+        position, velocity = self._target()
+        return position[axis] if position is not None else 0.0
+
+    def sample(self, name):
+        """ The value of a log variable """
+        if name in _LOG_VARIABLES:
+            return _LOG_VARIABLES[name](self)
+        raise KeyError('Variable {} not in TOC'.format(name))
+
+
+_LOG_VARIABLES = {
+    'kalman.stateX': lambda p: p.estimate(0),
+    'kalman.stateY': lambda p: p.estimate(1),
+    'kalman.stateZ': lambda p: p.estimate(2),
+    'kalman.varPX': lambda p: p.variance(),
+    'kalman.varPY': lambda p: p.variance(),
+    'kalman.varPZ': lambda p: p.variance(),
+    'stateEstimate.x': lambda p: p.estimate(0),
+    'stateEstimate.y': lambda p: p.estimate(1),
+    'stateEstimate.z': lambda p: p.estimate(2),
+    'stateEstimate.vx': lambda p: p.velocity[0],
+    'stateEstimate.vy': lambda p: p.velocity[1],
+    'stateEstimate.vz': lambda p: p.velocity[2],
+    'stateEstimate.yaw': lambda p: p.yaw,
+    'stabilizer.yaw': lambda p: p.yaw,
+    'lighthouse.x': lambda p: p.estimate(0),
+    'lighthouse.y': lambda p: p.estimate(1),
+    'lighthouse.z': lambda p: p.estimate(2),
+    'ctrltarget.x': lambda p: p.target(0),
+    'ctrltarget.y': lambda p: p.target(1),
+    'ctrltarget.z': lambda p: p.target(2),
+    'pm.vbat': lambda p: p.vbat,
+}
+
+
+def _smoothstep(start, end, duration, start_time):
+    """
+    A high level commander plan that moves from start to end over duration,
+    speeding up and slowing down smoothly
+    """
+    def plan(t):
+        s = min(max((t - start_time) / duration, 0.0), 1.0) if duration > 0 else 1.0
+        s = s * s * (3 - 2 * s)
+        return [a + (b - a) * s for a, b in zip(start, end)]
+    return plan
+
+
+def _polynomial(pieces, start_time, time_scale, offset):
+    """
+    A high level commander plan that follows an uploaded trajectory. Each
+    piece is a Poly4D, a 7th order polynomial in x, y and z (and yaw).
+
+    :param offset: where to shift the trajectory to start from, if it is
+                   relative
+    """
+    if offset is not None:
+        first = [piece.values[0] for piece in (pieces[0].x, pieces[0].y, pieces[0].z)]
+        offset = [o - f for o, f in zip(offset, first)]
+    else:
+        offset = [0.0, 0.0, 0.0]
+
+    def plan(t):
+        t = (t - start_time) / time_scale
+        for piece in pieces:
+            if t <= piece.duration or piece is pieces[-1]:
+                t = min(max(t, 0.0), piece.duration)
+                return [sum(c * t ** i for i, c in enumerate(poly.values)) + o
+                        for poly, o in zip((piece.x, piece.y, piece.z), offset)]
+            t -= piece.duration
+    return plan
+
+
+class Commander:
+    """ The low level commander (cflib.crazyflie.commander.Commander) """
+
+    def __init__(self, crazyflie):
+        self._cf = crazyflie
+
+    def _send(self, mode, value):
+        physics = self._cf.physics
+        physics.update()
+        with physics.lock:
+            physics.setpoint = (mode, value)
+            physics.setpoint_time = physics.time
+        self._cf.packets_sent += 1
+
+    def send_position_setpoint(self, x, y, z, yaw):
+        self._cf.physics.yaw = yaw
+        self._send('position', [x, y, z])
+
+    def send_velocity_world_setpoint(self, vx, vy, vz, yawrate):
+        self._send('velocity', [vx, vy, vz])
+
+    def send_hover_setpoint(self, vx, vy, yawrate, zdistance):
+        position = self._cf.physics.position
+        self._send('position', [position[0] + vx * 0.1, position[1] + vy * 0.1, zdistance])
+
+    def send_stop_setpoint(self):
+        self._send('stop', None)
+
+
+class HighLevelCommander:
+    """ The high level commander (cflib.crazyflie.high_level_commander) """
+
+    ALL_GROUPS = 0
+
+    def __init__(self, crazyflie):
+        self._cf = crazyflie
+        # id to (offset, number of pieces) in the trajectory memory
+        self.trajectories = {}
+
+    def _go(self, end, duration_s):
+        physics = self._cf.physics
+        physics.update()
+        with physics.lock:
+            start = physics.plan(physics.time) if physics.plan else list(physics.position)
+            physics.plan = _smoothstep(start, end, duration_s, physics.time)
+            # Low level setpoints take priority, so the last one is dropped
+            physics.setpoint = None
+        self._cf.packets_sent += 1
+
+    def set_group_mask(self, group_mask=ALL_GROUPS):
+        self._cf.packets_sent += 1
+
+    def takeoff(self, absolute_height_m, duration_s, group_mask=ALL_GROUPS):
+        position = self._cf.physics.position
+        self._go([position[0], position[1], absolute_height_m], duration_s)
+
+    def land(self, absolute_height_m, duration_s, group_mask=ALL_GROUPS):
+        physics = self._cf.physics
+        current = physics.plan(physics.time) if physics.plan else physics.position
+        self._go([current[0], current[1], absolute_height_m], duration_s)
+
+    def stop(self, group_mask=ALL_GROUPS):
+        physics = self._cf.physics
+        physics.update()
+        with physics.lock:
+            physics.plan = None
+            physics.setpoint = None
+        self._cf.packets_sent += 1
+
+    def go_to(self, x, y, z, yaw, duration_s, relative=False, group_mask=ALL_GROUPS):
+        if relative:
+            physics = self._cf.physics
+            current = physics.plan(physics.time) if physics.plan else physics.position
+            x, y, z = current[0] + x, current[1] + y, current[2] + z
+        self._go([x, y, z], duration_s)
+
+    def define_trajectory(self, trajectory_id, offset, n_pieces):
+        self.trajectories[trajectory_id] = (offset, n_pieces)
+        self._cf.packets_sent += 1
+
+    def start_trajectory(self, trajectory_id, time_scale=1.0, relative=False,
+                         reversed=False, group_mask=ALL_GROUPS):
+        offset, n_pieces = self.trajectories[trajectory_id]
+        memory = self._cf.mem.get_mems(MemoryElement.TYPE_TRAJ)[0]
+        pieces = memory.pieces[offset:offset + n_pieces]
+        physics = self._cf.physics
+        physics.update()
+        with physics.lock:
+            start = physics.plan(physics.time) if physics.plan else list(physics.position)
+            physics.plan = _polynomial(pieces, physics.time, time_scale,
+                                       start if relative else None)
+            physics.setpoint = None
+        self._cf.packets_sent += 1
+
+
+class Param:
+    """ Parameters (cflib.crazyflie.param.Param) """
+
+    def __init__(self, crazyflie):
+        self._cf = crazyflie
+        self.values = {}
+
+    def set_value(self, complete_name, value):
+        self.values[complete_name] = str(value)
+        self._cf.packets_sent += 1
+        if complete_name == 'kalman.resetEstimation' and str(value) == '1':
+            physics = self._cf.physics
+            physics.update()
+            physics.reset_time = physics.time
+
+
+class LogVariable:
+    def __init__(self, name, fetch_as):
+        self.name = name
+        self.fetch_as = fetch_as
+
+
+class LogConfig:
+    """
+    A log block (cflib.crazyflie.log.LogConfig). Once started it calls
+    data_received_cb every period_in_ms with a dict of the variables.
+    """
+
+    def __init__(self, name, period_in_ms):
+        self.name = name
+        self.period_in_ms = period_in_ms
+        self.variables = []
+        self.data_received_cb = Caller()
+        self.error_cb = Caller()
+        self.started_cb = Caller()
+        self.added_cb = Caller()
+        self.cf = None
+        self.valid = False
+        self._started = False
+        self._thread = None
+
+    def add_variable(self, name, fetch_as=None):
+        self.variables.append(LogVariable(name, fetch_as))
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.started_cb.call(self, True)
+
+    def stop(self):
+        self._started = False
+
+    def delete(self):
+        self.stop()
+        if self.cf is not None:
+            self.cf.log.remove_config(self)
+
+    def _run(self):
+        physics = self.cf.physics
+        period = self.period_in_ms / 1000
+        next_time = clock.time() + period
+        while self._started and self.cf.is_connected():
+            clock.sleep(next_time - clock.time())
+            next_time += period
+            if not self._started:
+                break
+            physics.update()
+            with physics.lock:
+                data = {v.name: physics.sample(v.name) for v in self.variables}
+                timestamp = int(physics.time * 1000)
+            self.cf.packets_received += 1
+            self.data_received_cb.call(timestamp, data, self)
+
+
+class Log:
+    """ The log subsystem (cflib.crazyflie.log.Log) """
+
+    def __init__(self, crazyflie):
+        self._cf = crazyflie
+        self.log_blocks = []
+
+    def add_config(self, logconf):
+        for variable in logconf.variables:
+            if variable.name not in _LOG_VARIABLES:
+                raise KeyError('Variable {} not in TOC'.format(variable.name))
+        logconf.cf = self._cf
+        logconf.valid = True
+        self.log_blocks.append(logconf)
+        logconf.added_cb.call(logconf, True)
+
+    def remove_config(self, logconf):
+        if logconf in self.log_blocks:
+            self.log_blocks.remove(logconf)
+
+
+class SyncLogger:
+    """ Synchronous access to a log block (cflib.crazyflie.syncLogger) """
+    DISCONNECT_EVENT = 'DISCONNECT_EVENT'
+
+    def __init__(self, crazyflie, log_config):
+        if isinstance(crazyflie, SyncCrazyflie):
+            self._cf = crazyflie.cf
+        else:
+            self._cf = crazyflie
+        self._log_config = log_config
+        self._queue = queue.Queue()
+        self._is_connected = False
+
+    def connect(self):
+        if self._is_connected:
+            raise Exception('Already connected')
+        self._cf.disconnected.add_callback(self._disconnected)
+        self._cf.log.add_config(self._log_config)
+        self._log_config.data_received_cb.add_callback(self._log_callback)
+        self._log_config.start()
+        self._is_connected = True
+
+    def disconnect(self):
+        if self._is_connected:
+            self._log_config.stop()
+            self._log_config.delete()
+            self._log_config.data_received_cb.remove_callback(self._log_callback)
+            self._cf.disconnected.remove_callback(self._disconnected)
+            self._queue = queue.Queue()
+            self._is_connected = False
+
+    def is_connected(self):
+        return self._is_connected
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._is_connected:
+            raise StopIteration
+        data = self._queue.get()
+        if data == self.DISCONNECT_EVENT:
+            raise StopIteration
+        return data
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.disconnect()
+
+    def _log_callback(self, ts, data, logblock):
+        self._queue.put((ts, data, logblock))
+
+    def _disconnected(self, link_uri):
+        self._queue.put(self.DISCONNECT_EVENT)
+        self.disconnect()
+
+
+class MemoryElement:
+    """ Memory types, with the same values as cflib.crazyflie.mem """
+    TYPE_DRIVER_LED = 0x10
+    TYPE_TRAJ = 0x12
+
+
+class LED:
+    """ One LED in the LED ring """
+
+    def __init__(self):
+        self.r = 0
+        self.g = 0
+        self.b = 0
+        self.intensity = 100
+
+    def set(self, r, g, b, intensity=None):
+        self.r = r
+        self.g = g
+        self.b = b
+        if intensity:
+            self.intensity = intensity
+
+
+class LEDDriverMemory:
+    """
+    The LED ring memory. Every write is kept in frames so that the LED
+    effects of a run can be checked afterwards.
+    """
+
+    def __init__(self, crazyflie):
+        self._cf = crazyflie
+        self.type = MemoryElement.TYPE_DRIVER_LED
+        self.leds = [LED() for i in range(12)]
+        self.frames = []
+
+    def write_data(self, write_finished_cb):
+        self._cf.packets_sent += 1
+        self.frames.append((clock.time(), [(led.r, led.g, led.b) for led in self.leds]))
+        if write_finished_cb:
+            write_finished_cb(self, 0)
+
+
+class TrajectoryMemory:
+    """
+    The trajectory memory of the high level commander. Takes Poly4D pieces
+    from cflib.crazyflie.mem
+    """
+
+    # The memory is 4kB and each piece takes 132 bytes
+    MAX_PIECES = 4096 // 132
+
+    def __init__(self, crazyflie):
+        self._cf = crazyflie
+        self.type = MemoryElement.TYPE_TRAJ
+        self.poly4Ds = []
+        # What has been written to the drone
+        self.pieces = []
+
+    def write_data(self, write_finished_cb):
+        # cflib 0.1.8 has no callback for a failed write, so one that does
+        # not fit is never answered
+        if len(self.poly4Ds) > self.MAX_PIECES:
+            return
+        self.pieces = list(self.poly4Ds)
+        # Each radio packet carries 24 bytes of memory
+        self._cf.packets_sent += math.ceil(len(self.poly4Ds) * 132 / 24)
+        if write_finished_cb:
+            write_finished_cb(self, 0)
+
+
+class Memory:
+    """ The memory subsystem (cflib.crazyflie.mem.Memory) """
+
+    def __init__(self, crazyflie):
+        self.mems = [LEDDriverMemory(crazyflie), TrajectoryMemory(crazyflie)]
+
+    def get_mems(self, type):
+        return [mem for mem in self.mems if mem.type == type]
+
+
+class Console:
+    """ Console messages from the drone (cflib.crazyflie.console.Console) """
+
+    def __init__(self, crazyflie):
+        self.cf = crazyflie
+        self.receivedChar = Caller()
+        crazyflie.console_text.add_callback(self.receivedChar.call)
+
+
+class Crazyflie:
+    """ A simulated cflib.crazyflie.Crazyflie """
+
+    def __init__(self, link=None, ro_cache=None, rw_cache=None):
+        self.link_uri = ''
+        self.connected = Caller()
+        self.disconnected = Caller()
+        self.connection_failed = Caller()
+        self.connection_lost = Caller()
+        self.console_text = Caller()
+        self.physics = None
+        self.commander = Commander(self)
+        self.high_level_commander = HighLevelCommander(self)
+        self.param = Param(self)
+        self.log = Log(self)
+        self.mem = Memory(self)
+        self.packets_sent = 0
+        self.packets_received = 0
+        self._connected = False
+
+    def open_link(self, link_uri):
+        self.link_uri = link_uri
+        self.physics = _Physics(start_position(link_uri), clock)
+        self._connected = True
+        self.connected.call(link_uri)
+        self.console_text.call('SYS: Crazyflie (simulated) is up and running!\n')
+
+    def close_link(self):
+        if self._connected:
+            self._connected = False
+            for block in list(self.log.log_blocks):
+                block.stop()
+            self.disconnected.call(self.link_uri)
+
+    def is_connected(self):
+        return self._connected
+
+
+class SyncCrazyflie:
+    """ A simulated cflib.crazyflie.syncCrazyflie.SyncCrazyflie """
+
+    def __init__(self, link_uri, cf=None):
+        self._link_uri = link_uri
+        self.cf = cf if cf is not None else Crazyflie()
+
+    def open_link(self):
+        if self.is_link_open():
+            raise Exception('Link already open')
+        self.cf.open_link(self._link_uri)
+
+    def close_link(self):
+        self.cf.close_link()
+
+    def is_link_open(self):
+        return self.cf.is_connected()
+
+    def __enter__(self):
+        self.open_link()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_link()
+
+
+class SimFactory:
+    """ A factory for cflib's Swarm that only makes simulated drones """
+
+    def construct(self, uri):
+        return SyncCrazyflie(uri)
+
+
+def run(script, args=(), speedup=20):
+    """
+    Runs a demo script with every drone simulated, with the simulation running
+    speedup times faster than real time.
+
+    time.sleep, time.time, time.monotonic and time.perf_counter follow the
+    simulation clock while the script runs, as do asyncio event loops, so the
+    demos themselves do not need changing.
+
+    :param script: path to the demo script
+    :param args: command line arguments for the script
+    :param speedup: how much faster than real time to run
+    :return: the (real, simulated) seconds the script took
+    """
+    os.environ[SIM_ENV] = '1'
+    clock.set_speedup(speedup)
+    sim_start = clock.time()
+    real_start = _real_perf_counter()
+    epoch = _real_time() - sim_start
+    sys.argv = [script] + list(args)
+    time.sleep = clock.sleep
+    time.time = lambda: epoch + clock.time()
+    time.monotonic = clock.time
+    time.perf_counter = clock.time
+    policy = asyncio.get_event_loop_policy()
+    asyncio.set_event_loop_policy(SimEventLoopPolicy())
+    try:
+        runpy.run_path(script, run_name='__main__')
+    finally:
+        asyncio.set_event_loop_policy(policy)
+        time.sleep = _real_sleep
+        time.time = _real_time
+        time.monotonic = _real_monotonic
+        time.perf_counter = _real_perf_counter
+    return _real_perf_counter() - real_start, clock.time() - sim_start
+
+
+if __name__ == '__main__':
+    import argparse
+    # Run through the imported module, so that the script shares its clock
+    from cfdemos import sim
+    parser = argparse.ArgumentParser(description='Runs a demo against simulated drones')
+    parser.add_argument('--speedup', type=float, default=20,
+                        help='how many times faster than real time to run')
+    parser.add_argument('script', help='the demo script to run')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='arguments for the script')
+    options = parser.parse_args()
+    real, simulated = sim.run(options.script, options.args, options.speedup)
+    print('Ran {:.1f}s of flight in {:.1f}s'.format(simulated, real))
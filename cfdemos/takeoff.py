@@ -0,0 +1,318 @@
+"""
+This module plans how a swarm takes off into a formation, and lands again,
+without the drones flying into each other.
+
+Sending every drone its first setpoint at once makes them all fly straight
+there together, and their paths can cross (flight.py notes how that went with
+the high level commander). Taking off one at a time is safe but slow. Instead
+each drone is given a leg from where it is to where it needs to be, and its
+leg is only changed where it would come too close to another drone:
+
+  - first the drone can climb to a higher altitude to pass over the others
+    and come back down,
+  - or it can wait before setting off.
+
+Of the options that keep clear of everyone else, the one that gets the drone
+there soonest is taken. Drones with the furthest to go are planned first, as
+they decide how long the whole takeoff takes. If a drone has no option left,
+planning starts over with whoever was in its way going first.
+
+Drones are kept apart by an ellipsoid, taller than it is wide, as the air
+pushed down by a drone makes flying close underneath it unsafe. Drones can
+sit on the ground closer together than that, so two drones that start (or
+end) too close are let be while both are still within the ellipsoid around
+where they start (or end), which is enough room to climb out of it. A leg is
+checked against every other drone at every moment in one vectorised numpy
+pass, which for a swarm of tens of drones is quicker than sorting them into
+a grid at every moment in python. close_pairs, which checks a single moment,
+puts the drones on a grid of cells the size of the ellipsoid so that only
+neighbours are compared.
+
+Use like the following:
+
+takeoff = plan_moves(ground_positions, trajectory.first_positions(), rate=20)
+landing = plan_moves(trajectory.last_positions(), landing_spots, rate=20)
+trajectory = trajectory.between(takeoff, landing)
+"""
+import math
+
+import numpy as np
+
+# How close drones can come side by side, and one above the other, in meters
+MIN_SEPARATION = 0.3
+VERTICAL_SEPARATION = 0.5
+
+# How fast the legs are flown in m/s
+SPEED = 0.5
+
+# The steps to try waiting in, and the most to wait, in seconds
+DELAY_STEP = 0.5
+MAX_DELAY = 30
+
+# How many altitudes above the direct route to try, and the highest to climb
+LAYERS = 3
+CEILING = 2.0
+
+
+class Leg:
+    """
+    The flight of one drone from one point to another, through waypoints.
+    Before it starts the drone waits where it is, and afterwards it stays
+    where it ended
+
+    :param waypoints: an array of shape (n, 3), from the start to the target
+    :param delay: How long to wait before setting off in seconds
+    :param speed: How fast to fly in m/s
+    :param layer: Which altitude the leg climbs to, 0 for the direct route
+    """
+
+    def __init__(self, waypoints, delay=0.0, speed=SPEED, layer=0):
+        self.waypoints = np.asarray(waypoints, dtype=float)
+        self.delay = delay
+        self.speed = speed
+        self.layer = layer
+        lengths = np.linalg.norm(np.diff(self.waypoints, axis=0), axis=1)
+        self.times = delay + np.concatenate([[0], np.cumsum(lengths)]) / speed
+
+    def start(self):
+        return self.waypoints[0]
+
+    def target(self):
+        return self.waypoints[-1]
+
+    def end(self):
+        """ When the drone arrives, in seconds from the start """
+        return self.times[-1]
+
+    def moving(self, times):
+        """ Whether the drone is on its way at each of times """
+        return (times >= self.delay) & (times < self.end())
+
+    def positions(self, times):
+        """ Where the drone is at each of times, shape (len(times), 3) """
+        if len(self.waypoints) < 2 or self.end() <= self.delay:
+            return np.broadcast_to(self.waypoints[-1], (len(times), 3)).copy()
+        return np.stack([np.interp(times, self.times, self.waypoints[:, axis])
+                         for axis in range(3)], axis=1)
+
+
+def _routes(start, target, speed, vertical_separation, layers, ceiling):
+    """
+    The legs a drone could take, with no delay: straight there, or up to a
+    higher altitude, across and down
+    """
+    start = np.asarray(start, dtype=float)
+    target = np.asarray(target, dtype=float)
+    routes = [Leg([start, target], speed=speed)]
+    for layer in range(1, layers + 1):
+        altitude = max(start[2], target[2]) + layer * vertical_separation
+        if altitude > ceiling:
+            break
+        routes.append(Leg([start, [start[0], start[1], altitude],
+                           [target[0], target[1], altitude], target],
+                          speed=speed, layer=layer))
+    return routes
+
+
+def _within(scaled, point):
+    """ Whether each of the scaled positions is too close to a scaled point """
+    return np.sum((scaled - point) ** 2, axis=-1) < 1
+
+
+def _conflicts(scaled, moving, others_scaled, others_moving, exempt):
+    """
+    Finds the others that a drone comes too close to, comparing it with every
+    other at every time
+
+    Positions are divided by the separation along each axis, so that too
+    close means a distance below 1.
+
+    :param scaled: an array of shape (times, 3), where the drone is
+    :param moving: an array of shape (times,), whether the drone is moving
+    :param others_scaled: an array of shape (others, times, 3)
+    :param others_moving: an array of shape (others, times)
+    :param exempt: an array of shape (others, times), where being too close
+                   does not count
+    :return: an array of the indices of the others it comes too close to
+    """
+    close = _within(others_scaled, scaled) & ~exempt
+    # Only pairs where one of them is moving can be changed by planning
+    others, _ = np.nonzero(close & (others_moving | moving))
+    return np.unique(others)
+
+
+def close_pairs(positions, min_separation=MIN_SEPARATION,
+                vertical_separation=VERTICAL_SEPARATION):
+    """
+    Finds the pairs of drones that are too close at one moment, using a grid
+    so that only neighbouring drones are compared
+
+    :param positions: an array of shape (drones, 3)
+    :return: a list of (first, second) indices
+    """
+    scaled = np.asarray(positions, dtype=float) / [min_separation, min_separation,
+                                                   vertical_separation]
+    grid = {}
+    for i, cell in enumerate(map(tuple, np.floor(scaled).astype(int))):
+        grid.setdefault(cell, []).append(i)
+
+    pairs = []
+    for cell, drones in grid.items():
+        neighbours = [j for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                      for j in grid.get((cell[0] + dx, cell[1] + dy, cell[2] + dz), [])]
+        for i in drones:
+            for j in neighbours:
+                if i < j and np.linalg.norm(scaled[i] - scaled[j]) < 1:
+                    pairs.append((i, j))
+    return pairs
+
+
+class MovePlan:
+    """
+    The legs of every drone for a takeoff or landing
+
+    :param legs: a dictionary of uri to Leg
+    :param rate: how many setpoints per second
+    """
+
+    def __init__(self, legs, rate):
+        self.legs = legs
+        self.rate = rate
+
+    def duration(self):
+        return max(leg.end() for leg in self.legs.values())
+
+    def setpoints(self, uris, yaw=0.0):
+        """
+        The setpoints of every drone, all the same length
+
+        :param uris: the order of the drones
+        :param yaw: The yaw of every drone, or one for each
+        :return: an array of shape (drones, ticks, 4)
+        """
+        ticks = int(math.ceil(self.duration() * self.rate)) + 1
+        times = np.arange(ticks) / self.rate
+        setpoints = np.empty((len(uris), ticks, 4))
+        for i, uri in enumerate(uris):
+            setpoints[i, :, :3] = self.legs[uri].positions(times)
+        setpoints[:, :, 3] = np.reshape(yaw, (-1, 1))
+        return setpoints
+
+    def print_report(self, name='Takeoff'):
+        """
+        Prints how each drone was kept clear and how long it all takes,
+        against every drone going at once and one at a time
+        """
+        for uri, leg in sorted(self.legs.items()):
+            changes = []
+            if leg.delay:
+                changes.append("waits {:.1f}s".format(leg.delay))
+            if leg.layer:
+                changes.append("climbs to {:.2f}m".format(leg.waypoints[1][2]))
+            print("{}: {}".format(uri, ", ".join(changes) or "goes straight"))
+
+        direct = [np.linalg.norm(leg.target() - leg.start()) / leg.speed
+                  for leg in self.legs.values()]
+        print("{} takes {:.1f}s (at once {:.1f}s, one at a time {:.1f}s)"
+              .format(name, self.duration(), max(direct), sum(direct)))
+
+
+def plan_moves(starts, targets, rate=20, speed=SPEED, min_separation=MIN_SEPARATION,
+               vertical_separation=VERTICAL_SEPARATION, delay_step=DELAY_STEP,
+               max_delay=MAX_DELAY, layers=LAYERS, ceiling=CEILING):
+    """
+    Plans how every drone gets from where it starts to its target without
+    coming too close to the others. Drones that start or end too close to
+    each other are only kept apart once one of them has left the ellipsoid
+    around its start or end
+
+    :param starts: a dictionary of uri to where the drone starts
+    :param targets: a dictionary of uri to where the drone needs to be
+    :param rate: How many setpoints per second
+    :param speed: How fast to fly in m/s
+    :param min_separation: How close drones can come side by side in meters
+    :param vertical_separation: How close drones can come one above the other
+    :param delay_step: The steps to try waiting in, in seconds
+    :param max_delay: The longest a drone can be made to wait
+    :param layers: How many altitudes above the direct route to try
+    :param ceiling: The highest a drone can climb to, in meters
+    :return: a MovePlan
+    """
+    uris = sorted(targets)
+    scale = np.array([min_separation, min_separation, vertical_separation])
+    routes = {uri: _routes(starts[uri], targets[uri], speed, vertical_separation,
+                           layers, ceiling)
+              for uri in uris}
+    delays = np.arange(0, max_delay + delay_step / 2, delay_step)
+
+    # The furthest to go first. When a drone cannot be planned, planning
+    # starts again with the drones in its way first: the ones not planned yet
+    # that it would have to wait for forever (like one hovering over where it
+    # lands), or else the drone itself, if those planned before box it in
+    # (like one arriving right above where it is waiting)
+    order = sorted(uris, key=lambda uri: -routes[uri][0].end())
+    for attempt in range(2 * len(uris)):
+        legs, stuck, blockers = _plan_in_order(order, starts, targets, routes, delays,
+                                               rate, scale)
+        if stuck is None:
+            return MovePlan(legs, rate)
+        first = blockers or [stuck]
+        order = first + [uri for uri in order if uri not in first]
+    raise ValueError("{} cannot get to {} without coming too close to the others"
+                     .format(stuck, targets[stuck]))
+
+
+def _plan_in_order(order, starts, targets, routes, delays, rate, scale):
+    """
+    Plans each drone in turn around the ones planned before it
+
+    :return: a dictionary of uri to Leg, the uri of the first drone that
+             could not be planned (None if they all were), and the drones not
+             planned yet that were in its way
+    """
+    # Drones that have not been planned yet wait where they start
+    legs = {uri: Leg([starts[uri]], delay=math.inf) for uri in order}
+    planned = []
+    starts_scaled = {uri: np.asarray(starts[uri], dtype=float) / scale for uri in order}
+    targets_scaled = {uri: np.asarray(targets[uri], dtype=float) / scale for uri in order}
+
+    for uri in order:
+        options = sorted(((route.end() + delay, route.layer, delay, route)
+                          for delay in delays for route in routes[uri]),
+                         key=lambda option: option[:3])
+
+        # Where everyone else is, long enough for the slowest option
+        others = [other for other in order if other != uri]
+        horizon = max([options[-1][0]] + [legs[other].end() for other in planned])
+        times = np.arange(0, horizon + 1 / rate, 1 / rate)
+        others_scaled = np.reshape([legs[other].positions(times) for other in others],
+                                   (len(others), len(times), 3)) / scale
+        others_moving = np.array([legs[other].moving(times) for other in others],
+                                 dtype=bool).reshape(len(others), len(times))
+        # The others this drone starts or ends too close to, and when they
+        # are still near where they start or end
+        others_starts = np.reshape([starts_scaled[other] for other in others], (-1, 1, 3))
+        others_targets = np.reshape([targets_scaled[other] for other in others], (-1, 1, 3))
+        start_close = _within(others_starts, starts_scaled[uri])
+        target_close = _within(others_targets, targets_scaled[uri])
+        others_at_start = _within(others_scaled, others_starts) & start_close
+        others_at_target = _within(others_scaled, others_targets) & target_close
+
+        fewest = None
+        for end, layer, delay, route in options:
+            leg = Leg(route.waypoints, delay=delay, speed=route.speed, layer=layer)
+            scaled = leg.positions(times) / scale
+            exempt = ((others_at_start & _within(scaled, starts_scaled[uri])) |
+                      (others_at_target & _within(scaled, targets_scaled[uri])))
+            conflicts = _conflicts(scaled, leg.moving(times), others_scaled, others_moving,
+                                   exempt)
+            if len(conflicts) == 0:
+                legs[uri] = leg
+                planned.append(uri)
+                break
+            if fewest is None or len(conflicts) < len(fewest):
+                fewest = conflicts
+        else:
+            blockers = [others[i] for i in fewest if others[i] not in planned]
+            return legs, uri, blockers
+    return legs, None, []
@@ -0,0 +1,344 @@
+"""
+This module records telemetry from every drone in a swarm to a binary file,
+and reads it back.
+
+Telemetry has so far only been printed (see position_callback in
+cfdemos.util and basiclog.py), and printing from cflib's callback thread at
+100Hz slows that thread down, and the data is gone once it has scrolled
+past. Here each log packet is written straight into a memory-mapped file as
+one fixed-width record:
+
+  received   when the packet arrived, time.time() on this computer
+  timestamp  the drone's own timestamp of the packet in ms
+  drone      which drone it came from, an index into the uris in the header
+  block      which log block it is, an index into the blocks in the header
+  values     the values of the block's variables, as float32
+
+The callback copies the values into the mapped record and nothing else, so no
+objects are kept per sample. The file is mapped a chunk of records at a time,
+and grows by a chunk when one fills up, so a long flight never needs more
+memory than one chunk. The header at the start of the file says which drones
+and blocks the records refer to.
+
+Use like the following:
+
+with TelemetryRecorder('flight.telemetry', uris) as recorder:
+    swarm.parallel_safe(recorder.start)
+    swarm.parallel_safe(fly, args_dict=trajectory.args_dict())
+
+telemetry = read_telemetry('flight.telemetry')
+received, timestamps, values = telemetry.series(uri, 'state')
+plt.plot(received, values['kalman.stateZ'])
+"""
+import json
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from cfdemos.util import log_api
+
+# A log block to record from every drone
+#
+# name: The name of the block, used to select it when reading
+# variables: The log variables in the block, all logged as floats
+# period_in_ms: How often the drone sends the block, or None for a block that
+#               is not logged from the drone but appended with
+#               TelemetryRecorder.append, like the position of a VIVE tracker
+Block = namedtuple('Block', 'name variables period_in_ms')
+
+# What is recorded by default: the position at 100Hz along with the setpoint
+# the drone is flying to, and the battery and kalman variance, which change
+# slowly, at 10Hz. A log packet carries at most 26 bytes, so a block can have
+# at most 6 floats
+BLOCKS = [
+    Block('state', ['kalman.stateX', 'kalman.stateY', 'kalman.stateZ'], 10),
+    Block('setpoint', ['ctrltarget.x', 'ctrltarget.y', 'ctrltarget.z'], 10),
+    Block('health', ['pm.vbat', 'kalman.varPX', 'kalman.varPY', 'kalman.varPZ'], 100),
+]
+
+# The most variables in a block
+VALUES = 6
+
+# One record, 40 bytes
+RECORD = np.dtype([
+    ('received', '<f8'),
+    ('timestamp', '<u4'),
+    ('drone', '<u2'),
+    ('block', '<u2'),
+    ('values', '<f4', (VALUES,)),
+])
+
+# The file starts with the magic bytes, the version, the size of a record and
+# the length of a JSON description, padded to HEADER_SIZE
+MAGIC = b'CFTELEM\0'
+VERSION = 1
+HEADER = struct.Struct('<8sHHI')
+HEADER_SIZE = 4096
+
+# How many records to map at a time, 2.5MB
+CHUNK_RECORDS = 65536
+
+
+def packet_rate(blocks=BLOCKS):
+    """
+    How many log packets per second each drone sends to record blocks, as the
+    log_rate of cfdemos.radios.plan_radios
+    """
+    return sum(1000 / block.period_in_ms for block in blocks
+               if block.period_in_ms is not None)
+
+
+class TelemetryRecorder:
+    """
+    Records log blocks from drones to a file. Use with a with block, or call
+    close when done
+
+    :param path: The file to record to, which is overwritten
+    :param uris: The uris of every drone that will be recorded, or the names
+                 of anything else that is appended, like trackers
+    :param blocks: The Blocks to record from each drone
+    :param chunk_records: How many records the file grows by at a time
+    """
+
+    def __init__(self, path, uris, blocks=BLOCKS, chunk_records=CHUNK_RECORDS):
+        for block in blocks:
+            if len(block.variables) > VALUES:
+                raise ValueError("Block {} has more than {} variables"
+                                 .format(block.name, VALUES))
+        self.path = path
+        self.uris = sorted(uris)
+        self.blocks = list(blocks)
+        self._drones = {uri: i for i, uri in enumerate(self.uris)}
+        self._blocks = {block.name: i for i, block in enumerate(self.blocks)}
+        self.chunk_records = chunk_records
+        self.count = 0
+        self._lock = threading.Lock()
+        self._log_configs = []
+
+        description = json.dumps({
+            'uris': self.uris,
+            'blocks': [block._asdict() for block in self.blocks],
+            'started': time.time(),
+        }).encode()
+        header = HEADER.pack(MAGIC, VERSION, RECORD.itemsize, len(description)) + description
+        if len(header) > HEADER_SIZE:
+            raise ValueError("Too many drones and blocks to fit in the header")
+
+        self._file = open(path, 'w+b')
+        self._file.write(header.ljust(HEADER_SIZE, b'\0'))
+        self._chunk = None
+        self._map_chunk(0)
+
+    def _map_chunk(self, start):
+        """ Grows the file by a chunk, and maps it from record start """
+        if self._chunk is not None:
+            self._chunk.flush()
+        self._file.truncate(HEADER_SIZE + (start + self.chunk_records) * RECORD.itemsize)
+        self._chunk = np.memmap(self._file, dtype=RECORD, mode='r+',
+                                offset=HEADER_SIZE + start * RECORD.itemsize,
+                                shape=(self.chunk_records,))
+        self._chunk_start = start
+        # Each field on its own, so a sample is written without making a record
+        self._received = self._chunk['received']
+        self._timestamp = self._chunk['timestamp']
+        self._drone = self._chunk['drone']
+        self._block = self._chunk['block']
+        self._values = self._chunk['values']
+
+    def _next(self, timestamp, drone, block):
+        """
+        Fills in the next record apart from its values, with the lock held
+
+        :return: the index of the record in the chunk, or None once closed
+        """
+        if self._chunk is None:
+            return None
+        i = self.count - self._chunk_start
+        if i == self.chunk_records:
+            self._map_chunk(self.count)
+            i = 0
+        self._received[i] = time.time()
+        self._timestamp[i] = timestamp
+        self._drone[i] = drone
+        self._block[i] = block
+        self.count += 1
+        return i
+
+    def _callback(self, drone, block):
+        """ The data_received_cb of one block of one drone """
+        columns = list(enumerate(self.blocks[block].variables))
+
+        def received(timestamp, data, logconf):
+            with self._lock:
+                i = self._next(timestamp, drone, block)
+                if i is not None:
+                    for column, variable in columns:
+                        self._values[i, column] = data[variable]
+        return received
+
+    def append(self, uri, block, values, timestamp=0):
+        """
+        Records a sample that is not logged from a drone, like the position
+        of a VIVE tracker
+
+        :param uri: Which of uris the sample is from
+        :param block: The name of the Block, which has no period_in_ms
+        :param values: The values of the block's variables, in order
+        :param timestamp: The source's own timestamp in ms, if it has one
+        """
+        with self._lock:
+            i = self._next(timestamp, self._drones[uri], self._blocks[block])
+            if i is not None:
+                self._values[i, :len(values)] = values
+
+    def start(self, scf):
+        """
+        Starts recording a drone. Use with swarm.parallel_safe(recorder.start)
+
+        :param scf: The SyncCrazyflie of a drone in uris
+        """
+        drone = self._drones[scf.cf.link_uri]
+        LogConfig, _ = log_api(scf)
+        for i, block in enumerate(self.blocks):
+            if block.period_in_ms is None:
+                continue
+            log_config = LogConfig(name=block.name, period_in_ms=block.period_in_ms)
+            for variable in block.variables:
+                log_config.add_variable(variable, 'float')
+            scf.cf.log.add_config(log_config)
+            log_config.data_received_cb.add_callback(self._callback(drone, i))
+            log_config.start()
+            with self._lock:
+                self._log_configs.append(log_config)
+
+    def stop(self):
+        """ Stops the log blocks of every drone """
+        with self._lock:
+            log_configs, self._log_configs = self._log_configs, []
+        for log_config in log_configs:
+            log_config.stop()
+
+    def close(self):
+        """ Stops recording, and cuts the file down to the records written """
+        self.stop()
+        with self._lock:
+            if self._chunk is None:
+                return
+            self._chunk.flush()
+            self._chunk = None
+            self._received = self._timestamp = self._drone = self._block = self._values = None
+            self._file.truncate(HEADER_SIZE + self.count * RECORD.itemsize)
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Telemetry:
+    """
+    A recording read back by read_telemetry
+
+    :param uris: The uris of the drones, indexed by the drone of a record
+    :param blocks: The Blocks, indexed by the block of a record
+    :param started: When recording started, as time.time()
+    :param records: an array of RECORD, in the order they arrived
+    """
+
+    def __init__(self, uris, blocks, started, records):
+        self.uris = uris
+        self.blocks = blocks
+        self.started = started
+        self.records = records
+
+    def block_index(self, name):
+        for i, block in enumerate(self.blocks):
+            if block.name == name:
+                return i
+        raise KeyError("No block named {}".format(name))
+
+    def select(self, uri=None, block=None):
+        """ The records of one drone and/or one block, by uri and block name """
+        selected = np.ones(len(self.records), dtype=bool)
+        if uri is not None:
+            selected &= self.records['drone'] == self.uris.index(uri)
+        if block is not None:
+            selected &= self.records['block'] == self.block_index(block)
+        return self.records[selected]
+
+    def series(self, uri, block):
+        """
+        The values of one block of one drone over time
+
+        :return: the received times in seconds since recording started, the
+                 drone's timestamps in ms, and a dictionary of variable name
+                 to an array of its values
+        """
+        records = self.select(uri, block)
+        variables = self.blocks[self.block_index(block)].variables
+        values = {variable: records['values'][:, i] for i, variable in enumerate(variables)}
+        return records['received'] - self.started, records['timestamp'], values
+
+    def print_report(self):
+        """
+        Prints how many records there are of each block of each drone, at
+        what rate they arrived and the longest gap between them
+        """
+        print("{} records over {} drones".format(len(self.records), len(self.uris)))
+        for uri in self.uris:
+            for block in self.blocks:
+                received = self.select(uri, block.name)['received']
+                if len(received) < 2:
+                    print("{} {}: {} records".format(uri, block.name, len(received)))
+                    continue
+                gaps = np.diff(received)
+                print("{} {}: {} records at {:.1f}Hz, longest gap {:.0f}ms".format(
+                    uri, block.name, len(received), (len(received) - 1) / gaps.sum(),
+                    gaps.max() * 1000))
+
+
+def read_telemetry(path):
+    """
+    Reads a recording made by TelemetryRecorder. The records are mapped from
+    the file rather than read into memory
+
+    :param path: The file recorded to
+    :return: a Telemetry
+    """
+    with open(path, 'rb') as file:
+        header = file.read(HEADER_SIZE)
+        file.seek(0, 2)
+        size = file.tell()
+    if len(header) < HEADER.size:
+        raise ValueError("{} is not a telemetry recording".format(path))
+    magic, version, record_size, length = HEADER.unpack_from(header)
+    if magic != MAGIC:
+        raise ValueError("{} is not a telemetry recording".format(path))
+    if version != VERSION or record_size != RECORD.itemsize:
+        raise ValueError("{} was recorded with another version ({}) of the format"
+                         .format(path, version))
+    description = json.loads(header[HEADER.size:HEADER.size + length].decode())
+
+    count = (size - HEADER_SIZE) // RECORD.itemsize
+    if count > 0:
+        records = np.memmap(path, dtype=RECORD, mode='r', offset=HEADER_SIZE, shape=(count,))
+    else:
+        records = np.zeros(0, dtype=RECORD)
+    # A recording that was not closed ends in records that were never written
+    written = np.flatnonzero(records['received'])
+    records = records[:written[-1] + 1] if len(written) else records[:0]
+
+    blocks = [Block(**block) for block in description['blocks']]
+    return Telemetry(description['uris'], blocks, description['started'], records)
+
+
+if __name__ == '__main__':
+    # Prints a summary of a recording, like
+    # python -m cfdemos.telemetry flight.telemetry
+    read_telemetry(sys.argv[1]).print_report()
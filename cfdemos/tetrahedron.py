@@ -7,50 +7,30 @@ shape along the x axis. It currently uses 4 drones to mark the corners of the
 tetrahedron.
 
 """
+import asyncio
+import sys
 import time
 
 import cflib.crtp
 from cflib.crazyflie.log import LogConfig
 from cflib.crazyflie.console import Console
-from cflib.crazyflie.swarm import CachedCfFactory
 from cflib.crazyflie.swarm import Swarm
 from cflib.crazyflie.syncLogger import SyncLogger
 from cflib.positioning.position_hl_commander import PositionHlCommander
 import math
-from cfdemos.util import wait_for_position_estimator, reset_estimator, check_battery, start_console, print_errors
+from cfdemos import aioswarm
+from cfdemos.assignment import assign_slots, get_positions, start_targets
+from cfdemos.latency import STATE_PERIOD_IN_MS, LatencyMonitor
+from cfdemos.radios import plan_radios
+from cfdemos.scheduler import print_stats
+from cfdemos.takeoff import plan_moves
+from cfdemos.telemetry import TelemetryRecorder, packet_rate, read_telemetry
+from cfdemos.trajectory import Segment, compile_formation, fly
+from cfdemos.util import wait_for_position_estimator, reset_estimator, check_battery, start_console, print_errors, CfFactory, preflight
 
 
-def run_shared_sequence(scf, x, y, z):
-    print("Running sequence")
-    cf = scf.cf
-
-    try:
-        box_size = 0.5
-        
-        for i in range(20):
-            cf.commander.send_position_setpoint(x * box_size,
-                                                y * box_size,
-                                                z * box_size + 1,
-                                                0)
-            time.sleep(0.2)
-
-        # This particular combination of sin and cosine is a rotation matrix, and will rotate the drones around the x axis
-        for i in range(50):
-            cf.commander.send_position_setpoint(x * box_size,
-                                                y * box_size * math.cos(2 * math.pi / 50 * i) + z*box_size * math.sin(2*math.pi / 50 * i),
-                                                -y* box_size * math.sin(2*math.pi / 50 * i) +z * box_size * math.cos(2 * math.pi / 50 * i) + 1,
-                                                0)
-            time.sleep(0.2)
-
-        for i in range(20):
-            cf.commander.send_position_setpoint(x * box_size,
-                                                y * box_size,
-                                                0.1,
-                                                0)
-            time.sleep(0.2)
-    except Exception as e:
-        print(e)
-
+# How many setpoints are sent to each drone per second
+SETPOINT_RATE = 20
 
 # Addresses for the drones
 URI1 = 'radio://0/80/2M/A0A0A0A0AA'
@@ -58,11 +38,12 @@ URI2 = 'radio://0/80/2M/A0A0A0A0AB'
 URI3 = 'radio://0/80/2M/A0A0A0A0AC'
 URI4 = 'radio://0/80/2M/A0A0A0A0AD'
 
-# Positions for the drones to fly to. This dictionary is passed to args_dict in
-# parallel_safe. The array maps to the 2nd, 3rd and 4th arguments to the function
-# (x, y and z above)
+# Positions for the drones to fly to. This dictionary is compiled together with
+# the sequence below into the setpoints of each drone
 #
-# These positions map out a tetrahedron
+# These positions map out a tetrahedron. They are only where each drone goes
+# by default: once the drones are ready, each is given the corner that gets
+# the tetrahedron together soonest from where they are sitting
 
 positions = {
   URI4: [0, (math.sqrt(2))/2, 0],
@@ -71,6 +52,20 @@ positions = {
   URI1: [0, 0, math.sqrt(2)/2]
 }
 
+box_size = 0.5
+
+# The tetrahedron is held at 1m, then rotates around the x axis over 10
+# seconds. This particular combination of sin and cosine is a rotation matrix,
+# done in Segment. The drones take off into it and land from it as planned by
+# cfdemos.takeoff, which keeps them clear of each other on the way
+sequence = [
+  Segment(4, scale=box_size, translate=[0, 0, 1]),
+  Segment(10, scale=box_size, translate=[0, 0, 1], rotate=2 * math.pi, axis='x'),
+]
+
+# How high above where it took off each drone comes down to before it stops
+LANDING_HEIGHT = 0.1
+
 # The drones you wish to include within the test. If you wish to not include
 # a drone, simply remove them from this set
 uris = {
@@ -88,12 +83,124 @@ names = {
   URI4: ["Doug"]
 }
 
+# How drones are given corners, 'max' to get the tetrahedron together soonest
+# or 'total' for the least flying overall. See cfdemos.assignment
+ASSIGNMENT = 'max'
+
+# The Crazyradio dongles and channels to spread the drones over. Add a dongle
+# and a channel for every few drones, see cfdemos.radios
+DONGLES = [0]
+CHANNELS = [80]
+
+# Where the telemetry of every drone is recorded when run with --record. See
+# cfdemos.telemetry
+RECORDING = 'tetrahedron.telemetry'
+
+# Where the latency of every drone's setpoints is saved when run with
+# --latency. See cfdemos.latency
+LATENCY_REPORT = 'tetrahedron.latency.json'
+
+def validated(trajectory):
+    """ Exits if the trajectory is not safe to fly """
+    problems = trajectory.validate()
+    if problems:
+        sys.exit("\n".join(problems))
+    return trajectory
+
+
+def compile_trajectory(positions):
+    """ Compiles the formation part of the flight """
+    return validated(compile_formation(positions, sequence, rate=SETPOINT_RATE, uris=uris))
+
+
+def plan_flight(current):
+    """
+    Gives each drone a corner from where it is now (see cfdemos.assignment),
+    then plans the takeoff to it and the landing back where it started (see
+    cfdemos.takeoff)
+    """
+    corners = list(positions.values())
+    formation = compile_trajectory(assign_slots(current, corners, ASSIGNMENT,
+                                                targets=start_targets(corners, sequence[0])))
+
+    # The estimate of a drone sitting on the ground can be a little below it
+    ground = {uri: [x, y, max(z, 0)] for uri, (x, y, z) in current.items()}
+    landing_spots = {uri: [x, y, z + LANDING_HEIGHT] for uri, (x, y, z) in ground.items()}
+    try:
+        takeoff = plan_moves(ground, formation.first_positions(), rate=SETPOINT_RATE)
+        landing = plan_moves(formation.last_positions(), landing_spots, rate=SETPOINT_RATE)
+    except ValueError as e:
+        sys.exit(str(e))
+    takeoff.print_report('Takeoff')
+    landing.print_report('Landing')
+    return validated(formation.between(takeoff, landing))
+
+
+async def run_async(factory, recorder=None, monitor=None):
+    """ The same flight as below, on one event loop with cfdemos.aioswarm """
+    async with aioswarm.AsyncSwarm(uris, factory) as swarm:
+        report = await aioswarm.preflight(swarm, names)
+        if not all(readiness.ready for readiness in report.values()):
+            sys.exit("Not all drones are ready to fly")
+        trajectory = plan_flight(await aioswarm.get_positions(swarm))
+        if recorder is not None:
+            for drone in swarm.drones.values():
+                recorder.start(drone.scf)
+        if monitor is not None:
+            for drone in swarm.drones.values():
+                monitor.start(drone.scf)
+        await swarm.run(aioswarm.fly, args_dict=trajectory.args_dict())
+        print_stats()
+
+
 if __name__ == '__main__':
+    record = '--record' in sys.argv
+    latency = '--latency' in sys.argv
+    log_rate = (packet_rate() if record else 10) + (1000 / STATE_PERIOD_IN_MS if latency else 0)
+    radio_plan = plan_radios(uris, DONGLES, CHANNELS, setpoint_rate=SETPOINT_RATE,
+                             log_rate=log_rate)
+    radio_plan.print_report()
+    uris = radio_plan.rewrite(uris)
+    names = radio_plan.rewrite(names)
+    positions = radio_plan.rewrite(positions)
+
+    # Run with --plot to see the paths before flying, from the default corners
+    if '--plot' in sys.argv:
+        compile_trajectory(positions).plot()
+
     cflib.crtp.init_drivers(enable_debug_driver=False)
-    factory = CachedCfFactory(rw_cache='./cache')
-    with Swarm(uris, factory=factory) as swarm:
-        swarm.parallel_safe(start_console, args_dict=names)
-        swarm.parallel_safe(check_battery, args_dict=names)
-        swarm.parallel_safe(reset_estimator)
-        swarm.parallel_safe(run_shared_sequence, args_dict=positions)
-        time.sleep(200)
+    factory = CfFactory(rw_cache='./cache')
+
+    # Run with --record to record the telemetry of the flight to RECORDING
+    recorder = TelemetryRecorder(RECORDING, uris) if record else None
+    # Run with --latency to measure how long each drone takes to respond to
+    # its setpoints, saved to LATENCY_REPORT
+    monitor = LatencyMonitor() if latency else None
+
+    # Run with --asyncio to drive every drone from one event loop rather than
+    # a thread each
+    if '--asyncio' in sys.argv:
+        asyncio.run(run_async(factory, recorder, monitor))
+    else:
+        with Swarm(uris, factory=factory) as swarm:
+            # Run with --compare-preflight to also time the checks done one after
+            # the other, and print how much preflight saves
+            report = preflight(swarm, names, compare='--compare-preflight' in sys.argv)
+            if not all(readiness.ready for readiness in report.values()):
+                sys.exit("Not all drones are ready to fly")
+            trajectory = plan_flight(get_positions(swarm))
+            if recorder is not None:
+                swarm.parallel_safe(recorder.start)
+            if monitor is not None:
+                swarm.parallel_safe(monitor.start)
+            swarm.parallel_safe(fly, args_dict=trajectory.args_dict())
+            print_stats()
+            time.sleep(200)
+
+    if recorder is not None:
+        recorder.close()
+        read_telemetry(RECORDING).print_report()
+    if monitor is not None:
+        monitor.stop()
+        monitor.print_report()
+        monitor.save(LATENCY_REPORT)
@@ -0,0 +1,286 @@
+"""
+This module compiles swarm formations into arrays of setpoints before flying.
+
+A formation is a dictionary of uri to a position, like the positions in
+tetrahedron.py. The formation is moved through a list of segments, each of
+which scales, rotates and translates it over some time. All the setpoints for
+every drone at every tick are worked out at once with NumPy, so that the
+flight loop only has to look up the next setpoint and send it, and so the
+whole flight can be checked and plotted before taking off.
+
+Use like the following:
+
+trajectory = compile_formation(positions, [
+    Segment(4, scale=0.5, translate=[0, 0, 1]),
+    Segment(10, scale=0.5, translate=[0, 0, 1], rotate=2 * math.pi, axis='x'),
+], rate=20)
+swarm.parallel_safe(fly, args_dict=trajectory.args_dict())
+"""
+import numpy as np
+
+from cfdemos.scheduler import Scheduler
+from cfdemos.util import print_errors
+
+AXES = {'x': 0, 'y': 1, 'z': 2}
+
+
+class Segment:
+    """
+    One part of a formation's flight.
+
+    Each position p in the formation becomes R(angle) @ (scale * p) + translate,
+    where R rotates about axis. The angle goes from 0 to rotate over the
+    segment, and the scale and translation go from their start to end values.
+
+    :param duration: How long the segment lasts in seconds
+    :param scale: How much to scale the formation by, either a single number
+                  or one per axis
+    :param translate: Where to move the centre of the formation to
+    :param rotate: How far to rotate the formation over the segment, in radians
+    :param axis: Which axis to rotate about, 'x', 'y' or 'z'
+    :param scale_end: The scale at the end of the segment, the same as scale if
+                      not given
+    :param translate_end: The translation at the end of the segment, the same
+                          as translate if not given
+    :param yaw: The yaw of every drone in degrees
+    """
+
+    def __init__(self, duration, scale=1.0, translate=(0, 0, 0), rotate=0.0,
+                 axis='x', scale_end=None, translate_end=None, yaw=0.0):
+        if axis not in AXES:
+            raise ValueError("Axis must be one of x, y or z, not {}".format(axis))
+        self.duration = duration
+        self.scale = scale
+        self.scale_end = scale if scale_end is None else scale_end
+        self.translate = translate
+        self.translate_end = translate if translate_end is None else translate_end
+        self.rotate = rotate
+        self.axis = axis
+        self.yaw = yaw
+
+    def compile(self, formation, rate):
+        """
+        Works out the setpoints of this segment
+
+        :param formation: an array of shape (drones, 3) of formation positions
+        :param rate: how many ticks per second
+        :return: an array of shape (drones, ticks, 4) of x, y, z and yaw
+        """
+        ticks = int(round(self.duration * rate))
+        # How far through the segment each tick is, from 0 up to (not including) 1
+        progress = np.arange(ticks) / max(ticks, 1)
+
+        scale = _interpolate(self.scale, self.scale_end, progress)
+        translate = _interpolate(self.translate, self.translate_end, progress)
+
+        # A rotation matrix for every tick, shape (ticks, 3, 3)
+        angle = self.rotate * progress
+        cos, sin = np.cos(angle), np.sin(angle)
+        i = AXES[self.axis]
+        j, k = [a for a in range(3) if a != i]
+        rotation = np.zeros((ticks, 3, 3))
+        rotation[:, i, i] = 1
+        rotation[:, j, j] = cos
+        rotation[:, j, k] = sin
+        rotation[:, k, j] = -sin
+        rotation[:, k, k] = cos
+
+        scaled = formation[:, np.newaxis, :] * scale[np.newaxis, :, :]
+        positions = np.einsum('tab,dtb->dta', rotation, scaled) + translate[np.newaxis]
+
+        setpoints = np.empty((len(formation), ticks, 4))
+        setpoints[:, :, :3] = positions
+        setpoints[:, :, 3] = self.yaw
+        return setpoints
+
+
+def _interpolate(start, end, progress):
+    """
+    Linearly interpolates between two 3D values (or numbers, which are used
+    for all 3 axes) for each value of progress, giving shape (ticks, 3)
+    """
+    start = np.broadcast_to(np.asarray(start, dtype=float), (3,))
+    end = np.broadcast_to(np.asarray(end, dtype=float), (3,))
+    return start + (end - start) * progress[:, np.newaxis]
+
+
+class Trajectory:
+    """
+    The compiled setpoints of every drone in a formation
+
+    :param uris: The uris of the drones, in the order of the array
+    :param setpoints: an array of shape (drones, ticks, 4) of x, y, z and yaw
+    :param rate: how many ticks per second
+    :param segment_starts: the tick each segment starts at
+    """
+
+    def __init__(self, uris, setpoints, rate, segment_starts=(0,)):
+        self.uris = uris
+        self.setpoints = setpoints
+        self.rate = rate
+        self.segment_starts = list(segment_starts)
+
+    def duration(self):
+        return self.setpoints.shape[1] / self.rate
+
+    def for_drone(self, uri):
+        """ The setpoints of one drone, shape (ticks, 4) """
+        return self.setpoints[self.uris.index(uri)]
+
+    def args_dict(self, uris=None):
+        """
+        The args_dict to pass to Swarm.parallel_safe with fly
+
+        The setpoints are turned into lists here so that no NumPy conversions
+        happen while flying.
+
+        :param uris: Only include these drones, all of them if not given
+        """
+        return {uri: [self.setpoints[i].tolist(), self.rate]
+                for i, uri in enumerate(self.uris)
+                if uris is None or uri in uris}
+
+    def first_positions(self):
+        """ A dictionary of uri to where each drone starts """
+        return {uri: self.setpoints[i, 0, :3] for i, uri in enumerate(self.uris)}
+
+    def last_positions(self):
+        """ A dictionary of uri to where each drone ends """
+        return {uri: self.setpoints[i, -1, :3] for i, uri in enumerate(self.uris)}
+
+    def between(self, takeoff=None, landing=None):
+        """
+        The trajectory with a takeoff before it and a landing after it, such as
+        the MovePlans from cfdemos.takeoff.plan_moves
+
+        :param takeoff, landing: anything with setpoints(uris, yaw) giving an
+                                 array of shape (drones, ticks, 4)
+        :return: a new Trajectory
+        """
+        parts = []
+        if takeoff is not None:
+            parts.append(takeoff.setpoints(self.uris, self.setpoints[:, 0, 3]))
+        parts.append(self.setpoints)
+        if landing is not None:
+            parts.append(landing.setpoints(self.uris, self.setpoints[:, -1, 3]))
+
+        offset = parts[0].shape[1] if takeoff is not None else 0
+        segment_starts = [start + offset for start in self.segment_starts]
+        if takeoff is not None:
+            segment_starts.insert(0, 0)
+        if landing is not None:
+            segment_starts.append(offset + self.setpoints.shape[1])
+        return Trajectory(self.uris, np.concatenate(parts, axis=1), self.rate, segment_starts)
+
+    def min_separation(self, settled=0.0):
+        """
+        The closest any two drones get to each other, and at which tick.
+        Infinite if there is only one drone
+
+        :param settled: Two drones that start (or end) closer than this, like
+                        drones sitting on the ground, are left out while both
+                        are still within it of where they start (or end)
+        """
+        positions = self.setpoints[:, :, :3]
+        if len(positions) < 2:
+            return np.inf, 0
+        first, second = np.triu_indices(len(positions), k=1)
+        distances = np.linalg.norm(positions[first] - positions[second], axis=2)
+        for end in (positions[:, :1], positions[:, -1:]):
+            near = np.linalg.norm(positions - end, axis=2) < settled
+            close = np.linalg.norm(end[first] - end[second], axis=2) < settled
+            distances[close & near[first] & near[second]] = np.inf
+        pair, tick = np.unravel_index(np.argmin(distances), distances.shape)
+        return distances[pair, tick], tick
+
+    def validate(self, min_separation=0.3, bounds=((-2, 2), (-2, 2), (0, 2)),
+                 max_velocity=1.0):
+        """
+        Checks that the trajectory is safe to fly
+
+        :param min_separation: How close two drones can come in meters
+        :param bounds: The (min, max) of the flying area along x, y and z
+        :param max_velocity: The fastest a drone may be asked to move in m/s
+        :return: a list of the problems found, empty if there are none
+        """
+        problems = []
+        positions = self.setpoints[:, :, :3]
+
+        separation, tick = self.min_separation(min_separation)
+        if separation < min_separation:
+            problems.append("Drones come within {:.2f}m of each other at {:.2f}s"
+                            .format(separation, tick / self.rate))
+
+        for axis, (low, high) in zip('xyz', bounds):
+            values = positions[:, :, AXES[axis]]
+            if values.min() < low or values.max() > high:
+                problems.append("{} goes from {:.2f} to {:.2f}, outside of ({}, {})"
+                                .format(axis, values.min(), values.max(), low, high))
+
+        if positions.shape[1] > 1:
+            steps = np.linalg.norm(np.diff(positions, axis=1), axis=2) * self.rate
+            # Jumps at the start of a segment (like going from hovering to
+            # landing) are flown by the controller at its own pace
+            steps[:, [start - 1 for start in self.segment_starts if start > 0]] = 0
+            fastest = steps.max()
+            if fastest > max_velocity:
+                drone, tick = np.unravel_index(np.argmax(steps), steps.shape)
+                problems.append("{} is asked to move at {:.2f}m/s at {:.2f}s"
+                                .format(self.uris[drone], fastest, tick / self.rate))
+        return problems
+
+    def plot(self):
+        """
+        Plots the path of every drone in 3D
+        """
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.mplot3d import Axes3D
+
+        fig = plt.figure()
+        ax = fig.add_subplot(111, projection='3d')
+        for uri, setpoints in zip(self.uris, self.setpoints):
+            ax.plot(setpoints[:, 0], setpoints[:, 1], setpoints[:, 2], label=uri)
+        ax.set_xlabel('X')
+        ax.set_ylabel('Y')
+        ax.set_zlabel('Z')
+        ax.legend()
+        plt.show()
+
+
+def compile_formation(positions, segments, rate=20, uris=None):
+    """
+    Compiles a formation and a list of segments into a Trajectory
+
+    :param positions: a dictionary of uri to the position of that drone in the
+                      formation
+    :param segments: a list of Segment to fly through one after another
+    :param rate: how many setpoints per second
+    :param uris: Only include these drones, all in positions if not given
+    """
+    if uris is None:
+        uris = list(positions)
+    uris = sorted(uri for uri in positions if uri in uris)
+    formation = np.array([positions[uri] for uri in uris], dtype=float).reshape(-1, 3)
+    compiled = [segment.compile(formation, rate) for segment in segments]
+    segment_starts = np.cumsum([0] + [c.shape[1] for c in compiled[:-1]])
+    return Trajectory(uris, np.concatenate(compiled, axis=1), rate, segment_starts)
+
+
+@print_errors
+def fly(scf, setpoints, rate, scheduler=None):
+    """
+    Sends a list of precompiled setpoints to a drone at the given rate. Pass
+    this to Swarm.parallel_safe with Trajectory.args_dict
+
+    :param scf: SyncCrazyflie object
+    :param setpoints: a list of [x, y, z, yaw]
+    :param rate: how many setpoints per second
+    :param scheduler: A Scheduler at rate to carry on from, so that several
+                      lists of setpoints are flown back to back
+    """
+    cf = scf.cf
+    if scheduler is None:
+        scheduler = Scheduler(rate, name=cf.link_uri)
+    for t in scheduler.ticks(len(setpoints) / rate):
+        x, y, z, yaw = setpoints[int(round(t * rate))]
+        cf.commander.send_position_setpoint(x, y, z, yaw)
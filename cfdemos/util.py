@@ -2,13 +2,79 @@
 This module contains common utilities that can be reused among demos
 """
 
+from cflib.crazyflie import Crazyflie
 from cflib.crazyflie.log import LogConfig
+from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
 from cflib.crazyflie.syncLogger import SyncLogger
 from cflib.crazyflie.console import Console
+from cflib.crazyflie.swarm import CachedCfFactory
 import time
 import math
+from collections import namedtuple
 
 import cflib.crtp
+from cfdemos.rolling import Convergence
+
+
+def is_simulated(scf):
+    """
+    Returns whether scf is a simulated drone (see cfdemos.sim)
+    """
+    # cfdemos.sim is imported where it is used rather than at the top, as
+    # importing cfdemos imports this module, and python -m cfdemos.sim warns
+    # when cfdemos.sim has already been imported before it runs
+    from cfdemos import sim
+    return isinstance(scf, sim.SyncCrazyflie)
+
+
+def connect(uri, rw_cache='./cache'):
+    """
+    Creates the SyncCrazyflie for uri. sim:// uris (or any uri when
+    CFDEMOS_SIM is set) get a simulated drone instead of a radio link.
+
+    Like SyncCrazyflie, the link is opened with open_link or a with block
+
+    :param uri: The address of the drone
+    :param rw_cache: The TOC cache directory for real drones
+    """
+    from cfdemos import sim
+    if sim.is_sim_uri(uri) or sim.enabled():
+        return sim.SyncCrazyflie(uri)
+    return SyncCrazyflie(uri, cf=Crazyflie(rw_cache=rw_cache))
+
+
+class CfFactory:
+    """
+    A factory for cflib's Swarm that creates drones with connect, so that
+    swarms can be made of simulated drones.
+
+    use like the following:
+    with Swarm(uris, factory=CfFactory(rw_cache='./cache')) as swarm:
+    """
+
+    def __init__(self, rw_cache=None):
+        self.rw_cache = rw_cache
+        self._cached = CachedCfFactory(rw_cache=rw_cache)
+
+    def construct(self, uri):
+        from cfdemos import sim
+        if sim.is_sim_uri(uri) or sim.enabled():
+            return sim.SyncCrazyflie(uri)
+        return self._cached.construct(uri)
+
+
+def log_api(scf):
+    """
+    Returns the LogConfig and SyncLogger classes to use with scf, the
+    simulated ones for simulated drones and cflib's otherwise.
+
+    use like the following:
+    LogConfig, SyncLogger = log_api(scf)
+    """
+    if is_simulated(scf):
+        from cfdemos import sim
+        return sim.LogConfig, sim.SyncLogger
+    return LogConfig, SyncLogger
 
 
 def print_errors(func):
@@ -46,8 +112,12 @@ def print_errors(func):
             raise e
     return wraps
 
+# How long each drone took to find its position the last time it was waited
+# for, keyed by uri. See print_time_to_ready
+time_to_ready = {}
+
 @print_errors
-def wait_for_position_estimator(scf):
+def wait_for_position_estimator(scf, window=10, period_in_ms=100, threshold=0.001):
     """
     This function was taken out of the crazyflie lighthouse openvr grab
     example found in the GitHub repository for cflib.
@@ -55,56 +125,65 @@ def wait_for_position_estimator(scf):
 
     It has the simple purpose of waiting until the kalman filter (the algorithm
     that the crazyflie uses to determine it's position) is fairly certain of it's
-    position. (within the threshold, here 0.001m)
+    position. The position is found once the variance in x, y and z has moved
+    by less than threshold over the last window log entries.
+
+    The original example logged every 500ms, meaning it took at least 5
+    seconds to find the position. Here the default is 100ms, so a drone is
+    ready as soon as 1 second after the filter converges.
 
     :param scf: The SyncCrazyflie object for a particular crazyflie
+    :param window: How many log entries the variance has to be stable for
+    :param period_in_ms: How often the variance is logged
+    :param threshold: How much the variance can change within the window
+    :return: How long it took to find the position, in seconds
     """
     print('Waiting for estimator to find position...')
+    start = time.time()
 
-    log_config = LogConfig(name='Kalman Variance', period_in_ms=500)
+    LogConfig, SyncLogger = log_api(scf)
+    log_config = LogConfig(name='Kalman Variance', period_in_ms=period_in_ms)
     log_config.add_variable('kalman.varPX', 'float')
     log_config.add_variable('kalman.varPY', 'float')
     log_config.add_variable('kalman.varPZ', 'float')
 
-    var_y_history = [1000] * 10
-    var_x_history = [1000] * 10
-    var_z_history = [1000] * 10
-
-    threshold = 0.001
+    convergence = Convergence(['kalman.varPX', 'kalman.varPY', 'kalman.varPZ'],
+                              window=window, threshold=threshold)
 
     with SyncLogger(scf, log_config) as logger:
         for log_entry in logger:
-            data = log_entry[1]
-
-            var_x_history.append(data['kalman.varPX'])
-            var_x_history.pop(0)
-            var_y_history.append(data['kalman.varPY'])
-            var_y_history.pop(0)
-            var_z_history.append(data['kalman.varPZ'])
-            var_z_history.pop(0)
-
-            min_x = min(var_x_history)
-            max_x = max(var_x_history)
-            min_y = min(var_y_history)
-            max_y = max(var_y_history)
-            min_z = min(var_z_history)
-            max_z = max(var_z_history)
-
-            if (max_x - min_x) < threshold and (
-                    max_y - min_y) < threshold and (
-                    max_z - min_z) < threshold:
+            if convergence.update(log_entry[1]):
                 break
 
+    elapsed = time.time() - start
+    time_to_ready[scf.cf.link_uri] = elapsed
+    return elapsed
+
+
+def print_time_to_ready():
+    """
+    Prints how long each drone took to find its position, slowest first
+    """
+    for uri, elapsed in sorted(time_to_ready.items(), key=lambda item: -item[1]):
+        print("{}: position found in {:.2f}s".format(uri, elapsed))
+
 @print_errors
-def reset_estimator(scf):
+def reset_estimator(scf, wait=True):
     """
     Resets the algorithm and waits for it to find the position again
+
+    :param wait: Whether to wait for the position, or return straight after
+                 the reset
+    :return: How long it took to find the position, in seconds, or None if
+             it did not wait
     """
     cf = scf.cf
     cf.param.set_value('kalman.resetEstimation', '1')
     time.sleep(0.1)
     cf.param.set_value('kalman.resetEstimation', '0')
-    wait_for_position_estimator(scf)
+    if not wait:
+        return None
+    return wait_for_position_estimator(scf)
 
 @print_errors
 def position_callback(timestamp, data, logconf):
@@ -119,6 +198,7 @@ def start_position_printing(scf):
     """
       Starts printing the postion of the drone
     """
+    LogConfig, SyncLogger = log_api(scf)
     log_conf = LogConfig(name='Position', period_in_ms=500)
     log_conf.add_variable('kalman.stateX', 'float')
     log_conf.add_variable('kalman.stateY', 'float')
@@ -139,7 +219,11 @@ def start_console(scf, name):
     :param scf: SyncCrazyflie object
     :param name: name of the drone to prepend to every log
     """
-    console = Console(scf.cf)
+    if is_simulated(scf):
+        from cfdemos import sim
+        console = sim.Console(scf.cf)
+    else:
+        console = Console(scf.cf)
 
     def incoming(message):
         print(name + ": " + message)
@@ -160,6 +244,7 @@ def check_battery(scf, name):
     """
     print("Checking battery")
 
+    LogConfig, SyncLogger = log_api(scf)
     log_config = LogConfig(name = 'Battery', period_in_ms=500)
     log_config.add_variable('pm.vbat', 'float')
 
@@ -173,6 +258,203 @@ def check_battery(scf, name):
               print(name + ": Battery too low")
               return False
 
+# The result of preflight for one drone
+#
+# name: The name the drone was logged with
+# battery: The battery voltage
+# battery_ok: Whether the battery was above the minimum voltage
+# time_to_battery: Seconds until the battery was known
+# time_to_ready: Seconds until the position was found, None if it wasn't
+# ready: Whether the drone is good to fly
+Readiness = namedtuple('Readiness',
+                       'name battery battery_ok time_to_battery time_to_ready ready')
+
+
+# The variables preflight logs in one block
+PREFLIGHT_VARIABLES = ['pm.vbat', 'kalman.varPX', 'kalman.varPY', 'kalman.varPZ']
+
+
+class PreflightCheck:
+    """
+    Follows one drone through preflight, one log entry of
+    PREFLIGHT_VARIABLES at a time, so that the entries can come from a
+    SyncLogger or from cfdemos.aioswarm
+
+    The first entry checks the battery, and the rest wait for the position to
+    be found. Times are from when it was made, so make it just before
+    resetting the estimator.
+
+    :param uri: The uri of the drone
+    :param name: The "Name" for logging
+    :param min_voltage: The lowest battery voltage that is good to fly
+    :param window, threshold: see wait_for_position_estimator
+    """
+
+    def __init__(self, uri, name, min_voltage=3.4, window=10, threshold=0.001):
+        self.uri = uri
+        self.name = name
+        self.min_voltage = min_voltage
+        self.convergence = Convergence(['kalman.varPX', 'kalman.varPY', 'kalman.varPZ'],
+                                       window=window, threshold=threshold)
+        self.start = time.time()
+        self.battery = None
+        self.battery_time = None
+        self.ready_time = None
+
+    def update(self, data):
+        """
+        Takes in a log entry
+
+        :param data: The values of PREFLIGHT_VARIABLES, by name
+        :return: whether it is done, either ready or with the battery too low
+        """
+        if self.battery is None:
+            self.battery = data['pm.vbat']
+            self.battery_time = time.time() - self.start
+            print(self.name + ": battery at " + str(self.battery))
+            if self.battery <= self.min_voltage:
+                print(self.name + ": Battery too low")
+                return True
+        if self.convergence.update(data):
+            self.ready_time = time.time() - self.start
+            time_to_ready[self.uri] = self.ready_time
+            print("{}: position found in {:.2f}s".format(self.name, self.ready_time))
+            return True
+        return False
+
+    def readiness(self, report=None):
+        """
+        The Readiness of the drone so far
+
+        :param report: a dictionary to put it into, keyed by uri
+        """
+        battery_ok = self.battery is not None and self.battery > self.min_voltage
+        readiness = Readiness(self.name, self.battery, battery_ok, self.battery_time,
+                              self.ready_time, battery_ok and self.ready_time is not None)
+        if report is not None:
+            report[self.uri] = readiness
+        return readiness
+
+
+@print_errors
+def preflight_drone(scf, name=None, report=None, min_voltage=3.4, window=10,
+                    period_in_ms=100, threshold=0.001):
+    """
+    Gets a single drone ready to fly. This does the same as start_console,
+    check_battery and reset_estimator, but the battery and the kalman variance
+    come through one log block, so the position is being found while the
+    battery is checked.
+
+    If the battery is too low, it stops without waiting for the position.
+
+    :param scf: SyncCrazyflie object
+    :param name: The "Name" for logging, the uri if not given
+    :param report: a dictionary to put the Readiness of the drone into, keyed
+                   by uri
+    :param min_voltage: The lowest battery voltage that is good to fly
+    :param window, period_in_ms, threshold: see wait_for_position_estimator
+    :return: The Readiness of the drone
+    """
+    cf = scf.cf
+    uri = cf.link_uri
+    if name is None:
+        name = uri
+    start_console(scf, name)
+
+    check = PreflightCheck(uri, name, min_voltage, window, threshold)
+    # The position is waited for below, along with the battery
+    reset_estimator(scf, wait=False)
+
+    LogConfig, SyncLogger = log_api(scf)
+    log_config = LogConfig(name='Preflight', period_in_ms=period_in_ms)
+    for variable in PREFLIGHT_VARIABLES:
+        log_config.add_variable(variable, 'float')
+
+    with SyncLogger(scf, log_config) as logger:
+        for log_entry in logger:
+            if check.update(log_entry[1]):
+                break
+
+    return check.readiness(report)
+
+
+def preflight(swarm, names=None, compare=False, **kwargs):
+    """
+    Gets every drone in the swarm ready to fly at the same time, see
+    preflight_drone.
+
+    Doing this with separate start_console, check_battery and reset_estimator
+    calls to swarm.parallel_safe waits for the slowest drone three times
+    over. Here each drone goes at its own pace and there is only one wait.
+
+    use like the following:
+    report = preflight(swarm, names)
+    if not all(r.ready for r in report.values()):
+        sys.exit("Not all drones are ready")
+
+    :param swarm: The Swarm
+    :param names: The names to log each drone with, as passed to args_dict
+    :param compare: Whether to then also time the separate steps (see
+                    preflight_separately), to report how much time is saved
+    :param kwargs: passed on to preflight_drone
+    :return: a dictionary of uri to the Readiness of each drone
+    """
+    report = {}
+
+    def run(scf, name=None):
+        preflight_drone(scf, name, report=report, **kwargs)
+
+    start = time.time()
+    swarm.parallel_safe(run, args_dict=names)
+    elapsed = time.time() - start
+
+    separate = preflight_separately(swarm, names) if compare else None
+    print_preflight_report(report, elapsed, separate)
+    return report
+
+
+def preflight_separately(swarm, names=None):
+    """
+    Checks the battery and finds the position of every drone the way the
+    demos did before preflight, one swarm.parallel_safe after the other, and
+    times it. start_console is left out, as it waits on nothing and its
+    callbacks are already added by preflight
+
+    :param swarm: The Swarm
+    :param names: The names to log each drone with, as passed to args_dict
+    :return: How long it took, in seconds
+    """
+    start = time.time()
+    swarm.parallel_safe(check_battery, args_dict=names)
+    swarm.parallel_safe(reset_estimator)
+    return time.time() - start
+
+
+def print_preflight_report(report, elapsed, separate=None):
+    """
+    Prints the Readiness of every drone from preflight, and how long
+    preflight took
+
+    :param report: a dictionary of uri to Readiness
+    :param elapsed: How long preflight took, in seconds
+    :param separate: How long the separate steps took, from
+                     preflight_separately, to compare with
+    """
+    for uri, readiness in sorted(report.items()):
+        if readiness.ready:
+            status = "ready"
+        elif not readiness.battery_ok:
+            status = "battery too low"
+        else:
+            status = "position not found"
+        print("{} ({}): {}, battery {}".format(readiness.name, uri, status, readiness.battery))
+    if separate is None:
+        print("Preflight took {:.2f}s".format(elapsed))
+    else:
+        print("Preflight took {:.2f}s, {:.2f}s less than the separate steps took ({:.2f}s)"
+              .format(elapsed, separate - elapsed, separate))
+
+
 def distance(x, y):
     """
     Finds the euclidiean distance between two lists x and y
@@ -12,6 +12,7 @@ let
     libusb
     python37Packages.pyusb
     python37Packages.matplotlib
+    python37Packages.numpy
   ];
 
 in
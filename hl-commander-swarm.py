@@ -32,65 +32,15 @@ This example is intended to work with any absolute positioning system.
 It aims at documenting how to use the High Level Commander together with
 the Swarm class.
 """
+import sys
 import time
 
 import cflib.crtp
-from cflib.crazyflie.log import LogConfig
-from cflib.crazyflie.console import Console
-from cflib.crazyflie.swarm import CachedCfFactory
 from cflib.crazyflie.swarm import Swarm
-from cflib.crazyflie.syncLogger import SyncLogger
 from cflib.positioning.position_hl_commander import PositionHlCommander
 import math
-
-
-def wait_for_position_estimator(scf):
-    print('Waiting for estimator to find position...')
-
-    log_config = LogConfig(name='Kalman Variance', period_in_ms=500)
-    log_config.add_variable('kalman.varPX', 'float')
-    log_config.add_variable('kalman.varPY', 'float')
-    log_config.add_variable('kalman.varPZ', 'float')
-
-    var_y_history = [1000] * 10
-    var_x_history = [1000] * 10
-    var_z_history = [1000] * 10
-
-    threshold = 0.001
-
-    with SyncLogger(scf, log_config) as logger:
-        for log_entry in logger:
-            data = log_entry[1]
-
-            var_x_history.append(data['kalman.varPX'])
-            var_x_history.pop(0)
-            var_y_history.append(data['kalman.varPY'])
-            var_y_history.pop(0)
-            var_z_history.append(data['kalman.varPZ'])
-            var_z_history.pop(0)
-
-            min_x = min(var_x_history)
-            max_x = max(var_x_history)
-            min_y = min(var_y_history)
-            max_y = max(var_y_history)
-            min_z = min(var_z_history)
-            max_z = max(var_z_history)
-
-            # print("{} {} {}".
-            #       format(max_x - min_x, max_y - min_y, max_z - min_z))
-
-            if (max_x - min_x) < threshold and (
-                    max_y - min_y) < threshold and (
-                    max_z - min_z) < threshold:
-                break
-
-
-def reset_estimator(scf):
-    cf = scf.cf
-    cf.param.set_value('kalman.resetEstimation', '1')
-    time.sleep(0.1)
-    cf.param.set_value('kalman.resetEstimation', '0')
-    wait_for_position_estimator(scf)
+from cfdemos.scheduler import Scheduler, print_stats
+from cfdemos.util import preflight, CfFactory
 
 
 def activate_high_level_commander(scf):
@@ -111,27 +61,26 @@ def run_shared_sequence(scf, x, y, z):
 
     try:
         box_size = 0.5
+        scheduler = Scheduler(SETPOINT_RATE, name=cf.link_uri)
         
-        for i in range(20):
+        for t in scheduler.ticks(4):
             cf.commander.send_position_setpoint(x * box_size,
                                                 y * box_size,
                                                 z * box_size + 1,
                                                 0)
-            time.sleep(0.2)
 
-        for i in range(50):
+        for t in scheduler.ticks(10):
+            angle = 2 * math.pi * t / 10
             cf.commander.send_position_setpoint(x * box_size,
-                                                y * box_size * math.cos(2 * math.pi / 50 * i) + z*box_size * math.sin(2*math.pi / 50 * i),
-                                                -y* box_size * math.sin(2*math.pi / 50 * i) +z * box_size * math.cos(2 * math.pi / 50 * i) + 1,
+                                                y * box_size * math.cos(angle) + z*box_size * math.sin(angle),
+                                                -y* box_size * math.sin(angle) +z * box_size * math.cos(angle) + 1,
                                                 0)
-            time.sleep(0.2)
 
-        for i in range(20):
+        for t in scheduler.ticks(4):
             cf.commander.send_position_setpoint(x * box_size,
                                                 y * box_size,
                                                 0.1,
                                                 0)
-            time.sleep(0.2)
         #    cf.param.set_value('ring.effect', '13')
 
             #set_led_color(cf, [0,0,0])
@@ -149,6 +98,9 @@ def run_shared_sequence(scf, x, y, z):
         print(e)
 
 
+# How many setpoints are sent to each drone per second
+SETPOINT_RATE = 20
+
 URI1 = 'radio://0/80/2M/A0A0A0A0AA'
 URI2 = 'radio://0/80/2M/A0A0A0A0AB'
 URI3 = 'radio://0/80/2M/A0A0A0A0AC'
@@ -175,41 +127,16 @@ names = {
   URI4: ["Doug"]
 }
 
-def start_console(scf, name):
-    try:
-        console = Console(scf.cf)
-
-        def incoming(message):
-            print(name + ": " + message)
-
-        console.receivedChar.add_callback(incoming)
-        
-
-    except Exception as e:
-        print(e)
-
-def start_battery(scf, name ):
-    print("Cecking battery")
-
-    log_config = LogConfig(name = 'Battery', period_in_ms=500)
-    log_config.add_variable('pm.vbat', 'float')
-
-    with SyncLogger(scf, log_config) as logger:
-      for log_entry in logger:
-          print(name + ": " + str(log_entry[1]['pm.vbat']))
-          if log_entry[1]['pm.vbat'] > 0.4:
-              print("Good to go")
-              break
-          else:
-              print("Battery too low")
-
 if __name__ == '__main__':
     cflib.crtp.init_drivers(enable_debug_driver=False)
-    factory = CachedCfFactory(rw_cache='./cache')
+    factory = CfFactory(rw_cache='./cache')
     with Swarm(uris, factory=factory) as swarm:
         #swarm.parallel_safe(activate_high_level_commander)
-        swarm.parallel_safe(start_console, args_dict=names)
-        swarm.parallel_safe(start_battery, args_dict=names)
-        swarm.parallel_safe(reset_estimator)
+        # Run with --compare-preflight to also time the checks done one after
+        # the other, and print how much preflight saves
+        report = preflight(swarm, names, compare='--compare-preflight' in sys.argv)
+        if not all(readiness.ready for readiness in report.values()):
+            sys.exit("Not all drones are ready to fly")
         swarm.parallel_safe(run_shared_sequence, args_dict=positions)
+        print_stats()
         time.sleep(200)
@@ -12,8 +12,9 @@ from cflib.crazyflie import Crazyflie
 from cflib.crazyflie.log import LogConfig
 from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
 from cflib.crazyflie.syncLogger import SyncLogger
-from cflib.crazyflie.mem import MemoryElement
 from cflib.positioning.position_hl_commander import PositionHlCommander
+from cfdemos.ledring import LedRing
+from cfdemos.paths import load_paths, simplify_path
 
 # URI to the Crazyflie to connect to
 uri = 'radio://0/80/2M/A0A0A0A0AA'
@@ -102,12 +103,14 @@ def vector_add(v0, v1):
     return [v0[0] + v1[0], v0[1] + v1[1], v0[2] + v1[2]]
 
 
+# How far in meters the path can stray from the one in the file. Every vertex
+# is a go_to that stops, so dropping the ones that add nothing saves time
+SIMPLIFY_TOLERANCE = 0.005
+
+
 def get_path():
-    path = sys.argv[1]
-    contents = open(path, "r").readlines()
-    vertices = [line for line in contents if line.startswith("v ")]
-    elements = [[float(coordinate) for coordinate in vertex.split(" ")[1:]] for vertex in vertices]
-    return elements
+    return [point for polyline in load_paths(sys.argv[1])
+            for point in simplify_path(polyline, SIMPLIFY_TOLERANCE, speed=0.1).points]
     
     
 
@@ -116,44 +119,35 @@ def pos_distance(pa, pb):
         return x * x
     return math.sqrt(squared(pa[0] - pb[0]) + squared(pa[1] - pb[1]) + squared(pa[2] - pb[2]))
 
-def set_led_color(cf, color):
-
-    # Get LED memory and write to it
-    mem = cf.mem.get_mems(MemoryElement.TYPE_DRIVER_LED)
-    if len(mem) > 0:
-        for i in range(12):
-            mem[0].leds[i].set(r=color[0], g=color[1], b=color[2])
-        mem[0].write_data(None)
-
 
 def run_sequence(scf):
     cf = scf.cf
     with PositionHlCommander(scf, default_velocity=0.1) as pc:
         path = get_path()
         cf.param.set_value('ring.effect', '13')
+        ring = LedRing(cf)
 
-        set_led_color(cf, [0,0,0])
+        ring.set_color([0,0,0])
 
 
         pc.go_to(path[0][0], path[0][2], path[0][1])
 
         last_pos = path[0]
-        set_led_color(cf, [0,100,0])
-        for position in get_path():
+        ring.set_color([0,100,0])
+        for position in path:
             pc.go_to(position[0], position[2], position[1])
             last_pos = position
 
 
-        set_led_color(cf, [0,0,0])
+        ring.set_color([0,0,0])
         pc.go_to(0,0,0.1)
         # Make sure that the last packet leaves before the link is closed
         # since the message queue is not flushed before closing
         time.sleep(0.1)
 
 
-print(get_path())
-
 if __name__ == '__main__':
+    print(get_path())
     cflib.crtp.init_drivers(enable_debug_driver=False)
 
     with SyncCrazyflie(uri, cf=Crazyflie(rw_cache='./cache')) as scf: